@@ -20,50 +20,144 @@ Usage:
     appveyor-artifacts -V | --version
 
 Options:
+    --api-jobs=NUM              Query artifacts of up to NUM AppVeyor jobs
+                                concurrently. Default is 4.
+    --artifact-cache=DIR        Keep downloaded files in DIR and hardlink or
+                                copy them from there in later runs. Can be
+                                shared by concurrent runs and projects.
+    --artifact-cache-size=SIZE  Max size of --artifact-cache in bytes. Default
+                                is 1073741824.
+    --attempts=NUM              Max attempts per API query. Default is 3.
+    --backoff=SEC               Base delay between attempts. Doubled on every
+                                retry with random jitter. Default is 1.
     -C DIR --dir=DIR            Download to DIR instead of cwd.
+    --cache-dir=DIR             Cache API responses in DIR and revalidate them
+                                with ETags. Can be shared by concurrent runs.
+    --cache-size=BYTES          Max size of --cache-dir. Default is 10485760.
+    --checksums=FILE            Write SHA-256 checksums of downloaded files to
+                                FILE in the format of sha256sum.
+    --combine=FILE              Combine downloaded .coverage files into FILE.
     -c SHA --commit=SHA         Git commit currently building.
+    --from-plan=FILE            Download what --plan wrote to FILE without
+                                querying AppVeyor.
     -h --help                   Show this screen.
     -i --ignore-errors          Exit 0 on errors.
     -j --always-job-dirs        Always download files within ./<jobID>/ dirs.
+    --jobs=NUM                  Download NUM files concurrently. Default is 1.
     -J MODE --no-job-dirs=MODE  All jobs download to same directory. Modes for
-                                file path collisions: rename, overwrite, skip
+                                file path collisions: rename, number,
+                                overwrite, skip
     -m --mangle-coverage        Edit downloaded .coverage file(s) replacing
                                 Windows paths with Linux paths.
     -n NAME --repo-name=NAME    Repository name.
     -N JOB --job-name=JOB       Filter by job name (Python versions, etc).
+    --no-keep-alive             Close HTTP connections after every request.
     -o NAME --owner-name=NAME   Repository owner/account name.
     -p NUM --pull-request=NUM   Pull request number of current job.
+    --path-map=RULES            Rewrite paths starting with PREFIX to local
+                                ROOT with --mangle-coverage. RULES are
+                                PREFIX[,PREFIX...]=ROOT separated by ";". A
+                                "*" matches one directory. Default is
+                                "C:\projects\*\=.".
+    --plan=FILE                 Don't download, write a JSON manifest of what
+                                would be downloaded and an ETA to FILE.
+    -P --pipeline               Download artifacts of each job as soon as it
+                                succeeds while waiting for other jobs.
+    --pool-size=NUM             Max pooled HTTP connections per host. Default
+                                is 10.
     -r --raise                  Don't handle exceptions, raise all the way.
+    --retry-budget=NUM          Max retries for the whole run. Default is 20.
+    --segments=NUM              Number of byte ranges for --split-above.
+                                Default is 4.
+    --split-above=BYTES         Download files larger than BYTES in parallel
+                                byte ranges. Default is 0 (disabled).
+    --sync                      Skip files already downloaded by an earlier
+                                run and replace changed ones instead of
+                                failing if files exist.
     -t NAME --tag-name=NAME     Tag name that triggered current job.
+    --timeout=SEC               Give up waiting for AppVeyor after SEC seconds.
+                                Default is 0 (wait for up to 3 build queries,
+                                then wait for jobs indefinitely).
     -v --verbose                Raise exceptions with tracebacks.
     -V --version                Print appveyor-artifacts version.
+    --verify=FILE               Don't download, check files in DIR against
+                                checksums in FILE written by --checksums.
 """
 
 from __future__ import print_function
 
+import calendar
+import email.utils
 import functools
+import hashlib
+import itertools
+import json
 import logging
+import multiprocessing.pool
 import os
+import random
 import re
+import shutil
 import signal
+import sqlite3
 import sys
+import tempfile
+import threading
 import time
 
 import pkg_resources
 import requests
+import requests.adapters
 import requests.exceptions
+from requests.packages.urllib3.exceptions import DecodeError, ProtocolError, ReadTimeoutError
 from docopt import docopt
 
+try:
+    import fcntl
+except ImportError:  # Windows.
+    fcntl = None
+
 __author__ = '@Robpol86'
 __license__ = 'MIT'
 __version__ = '1.0.2'
 
+API_JOBS = 4
 API_PREFIX = 'https://ci.appveyor.com/api'
+ARTIFACT_CACHE_SIZE = 1073741824
+ARTIFACT_URL = '{0}/buildjobs/{1}/artifacts/{2}'
+CACHE_SIZE = 10485760
+COVERAGE_HEADER = b"!coverage.py: This is a private format, don't read it directly!"
+DEFAULT_PATH_MAP = 'C:\\projects\\*\\=.'
+DOWNLOAD_TIMEOUT = 60  # Seconds without receiving bytes before a download is treated as interrupted.
+HASH_CHUNK = 1048576
+HISTORY_LIMIT = 1000  # Stop paging through older builds after indexing this many.
+HISTORY_PAGE = 10
+HISTORY_PAGE_MAX = 100
+IO_BLOCK = 262144  # Bytes read from the network and written to disk at once.
+MANGLE_CHUNK = 1048576
+PART_SUFFIX = '.part'
+PATH_INDEX = None  # Shared PathIndex instance. Set by get_path_index().
+PLAN_PROBE_SIZE = 1048576  # Bytes downloaded by --plan to measure throughput.
+POOL_SIZE = 10
+PROGRESS_REDRAW = 0.2  # Seconds between redraws of the status line on a TTY.
+PROGRESS_SUMMARY = 10  # Seconds between progress lines if stderr isn't a TTY (e.g. CI logs).
 QUERY_ATTEMPTS = 3
 REGEX_COMMIT = re.compile(r'^[0-9a-f]{7,40}$')
 REGEX_GENERAL = re.compile(r'^[0-9a-zA-Z\._-]+$')
-REGEX_MANGLE = re.compile(r'"(C:\\\\projects\\\\(?:(?!":\[).)+)')  # http://stackoverflow.com/a/17089058/1198943
+REGEX_IMMUTABLE = re.compile(r'^/buildjobs/[^/]+/artifacts$')  # Only queried after the job finished.
+REGEX_TIMESTAMP = re.compile(r'^(\d{4})-(\d\d)-(\d\d)T(\d\d):(\d\d):(\d\d)(\.\d+)?(?:Z|([+-])(\d\d):(\d\d))?$')
+RETRY_BACKOFF = 1
+RETRY_BACKOFF_MAX = 60
+RETRY_BUDGET = 20
+RETRY_STATUSES = (429, 502, 503, 504)
+SEGMENTS = 4
+SESSION = None  # Shared Session instance. Set by open_session() or get_session().
 SLEEP_FOR = 10
+SLEEP_MAX = 60
+SLEEP_MIN = 2
+SQLITE_HEADER = b'SQLite format 3\x00'
+STAGING_DIR = '.appveyor-artifacts'
+SYNC_STATE = '.appveyor-artifacts.json'
 
 
 class HandledError(Exception):
@@ -89,6 +183,106 @@ class InfoFilter(logging.Filter):
         return record.levelno <= logging.INFO
 
 
+class Session(requests.Session):
+    """HTTP session shared by all API queries and artifact downloads for the whole run.
+
+    Keeps connections to AppVeyor alive in a connection pool instead of opening a new TCP/TLS connection for every
+    request.
+    """
+
+    def __init__(self, config):
+        """Constructor.
+
+        :param dict config: Dictionary from get_arguments().
+        """
+        super(Session, self).__init__()
+        connections = int(config.get('jobs') or 1)
+        if config.get('split_above'):
+            connections *= int(config.get('segments') or SEGMENTS)
+        pool_size = int(config.get('pool_size') or max(POOL_SIZE, connections))
+        adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.mount('https://', adapter)
+        self.mount('http://', adapter)
+        if config.get('no_keep_alive'):
+            self.headers['Connection'] = 'close'
+        self.cache_dir = config.get('cache_dir') or ''
+        self.cache_size = int(config.get('cache_size') or CACHE_SIZE)
+
+        # Retry policy and statistics.
+        self.attempts = int(config.get('attempts') or QUERY_ATTEMPTS)
+        self.backoff = int(config.get('backoff') or RETRY_BACKOFF)
+        self.retry_budget = int(config.get('retry_budget') or RETRY_BUDGET)
+        self.retries = 0
+        self.retry_wait = 0.0
+
+    @property
+    def pool_size(self):
+        """Max number of pooled connections per host.
+
+        :return: Pool size of the HTTP adapter.
+        :rtype: int
+        """
+        return self.get_adapter('https://').poolmanager.connection_pool_kw['maxsize']
+
+    def exhausted(self, attempt):
+        """Check if a failed attempt is the last one, either for this request or for the whole run.
+
+        :param int attempt: Zero-based number of the attempt that failed.
+
+        :return: True if the request must not be retried.
+        :rtype: bool
+        """
+        return attempt >= self.attempts - 1 or self.retries >= self.retry_budget
+
+    def wait(self, delay):
+        """Sleep before retrying a request and keep track of it.
+
+        :param float delay: Number of seconds to sleep, from retry_delay().
+        """
+        self.retries += 1
+        self.retry_wait += delay
+        time.sleep(delay)
+
+    def get_with_retries(self, url, log, **kwargs):
+        """Send a GET request, retrying on network errors and RETRY_STATUSES responses with retry_delay() in between.
+
+        :raise HandledError: On network errors once retries are exhausted.
+
+        :param str url: URL to query.
+        :param logging.Logger log: Logger of the caller.
+        :param dict kwargs: Passed to requests.Session.get().
+
+        :return: Response of the last attempt, which may still be one of RETRY_STATUSES.
+        :rtype: requests.Response
+        """
+        response = None
+        for attempt in range(self.attempts):
+            last_attempt = self.exhausted(attempt)
+            try:
+                try:
+                    response = self.get(url, **kwargs)
+                except (requests.exceptions.ConnectTimeout, requests.exceptions.ReadTimeout, requests.Timeout):
+                    log.error('Timed out waiting for reply from server.')
+                    raise HandledError
+                except requests.ConnectionError:
+                    log.error('Unable to connect to server.')
+                    raise HandledError
+            except HandledError:
+                if last_attempt:
+                    raise
+                reason = 'Network error'
+            else:
+                if last_attempt or response.status_code not in RETRY_STATUSES:
+                    break
+                reason = 'HTTP {0}'.format(response.status_code)
+                response.close()
+            delay = retry_delay(attempt, response)
+            log.warning('%s, retrying in %.1f seconds...', reason, delay)
+            self.wait(delay)
+            response = None
+        return response
+
+
 def setup_logging(verbose=False, logger=None):
     """Setup console logging. Info and below go to stdout, others go to stderr.
 
@@ -181,23 +375,306 @@ def get_arguments(argv=None, environ=None):
     # Merge env variables and have command line args override.
     config = {
         'always_job_dirs': args['--always-job-dirs'],
+        'api_jobs': args['--api-jobs'] or '',
+        'artifact_cache': args['--artifact-cache'] or '',
+        'artifact_cache_size': args['--artifact-cache-size'] or '',
+        'attempts': args['--attempts'] or '',
+        'backoff': args['--backoff'] or '',
+        'cache_dir': args['--cache-dir'] or '',
+        'cache_size': args['--cache-size'] or '',
+        'checksums': args['--checksums'] or '',
+        'combine': args['--combine'] or '',
         'commit': commit,
         'dir': args['--dir'] or '',
+        'from_plan': args['--from-plan'] or '',
         'ignore_errors': args['--ignore-errors'],
         'job_name': args['--job-name'] or '',
+        'jobs': args['--jobs'] or '',
         'mangle_coverage': args['--mangle-coverage'],
         'no_job_dirs': args['--no-job-dirs'] or '',
+        'no_keep_alive': args['--no-keep-alive'],
         'owner': owner,
+        'path_map': args['--path-map'] or '',
+        'pipeline': args['--pipeline'],
+        'plan': args['--plan'] or '',
+        'pool_size': args['--pool-size'] or '',
         'pull_request': pull_request,
         'raise': args['--raise'],
         'repo': repo,
+        'retry_budget': args['--retry-budget'] or '',
+        'segments': args['--segments'] or '',
+        'split_above': args['--split-above'] or '',
+        'sync': args['--sync'],
         'tag': tag,
+        'timeout': args['--timeout'] or '',
         'verbose': args['--verbose'],
+        'verify': args['--verify'] or '',
     }
 
     return config
 
 
+def open_session(config):
+    """Replace the shared HTTP session with a new one configured from command line options.
+
+    :param dict config: Dictionary from get_arguments().
+
+    :return: Shared session.
+    :rtype: Session
+    """
+    global SESSION  # pylint: disable=global-statement
+    close_session()
+    SESSION = Session(config)
+    return SESSION
+
+
+def get_session():
+    """Get the shared HTTP session, creating one with default settings if open_session() wasn't called.
+
+    :return: Shared session.
+    :rtype: Session
+    """
+    return SESSION or open_session(dict())
+
+
+def close_session():
+    """Close the shared HTTP session and all of its pooled connections."""
+    global SESSION  # pylint: disable=global-statement
+    if SESSION is not None:
+        SESSION.close()
+        SESSION = None
+
+
+def replace_file(source, destination):
+    """Atomically move a file over another one.
+
+    :param str source: File to move.
+    :param str destination: File to replace.
+    """
+    getattr(os, 'replace', os.rename)(source, destination)  # Python 2.7 has no os.replace().
+
+
+def cache_path(endpoint):
+    """Get the file path of an API response in the cache directory.
+
+    :param str endpoint: API endpoint (e.g. '/projects/Robpol86/appveyor-artifacts').
+
+    :return: File path or empty string if caching is disabled.
+    :rtype: str
+    """
+    cache_dir = get_session().cache_dir
+    if not cache_dir:
+        return ''
+    return os.path.join(cache_dir, hashlib.sha1(endpoint.encode('utf-8')).hexdigest() + '.json')
+
+
+@with_log
+def cache_load(endpoint, log):
+    """Read a cached API response.
+
+    :param str endpoint: API endpoint (e.g. '/projects/Robpol86/appveyor-artifacts').
+    :param logging.Logger log: Logger for this function. Populated by with_log() decorator.
+
+    :return: Cache entry with the response text and its validators, or None on cache miss.
+    :rtype: dict
+    """
+    path = cache_path(endpoint)
+    if not path:
+        return None
+    try:
+        with open(path) as handle:
+            entry = json.load(handle)
+        os.utime(path, None)  # Most recently used.
+    except (IOError, OSError, ValueError):
+        log.debug('Cache miss for %s', endpoint)
+        return None
+    if entry.get('endpoint') != endpoint:
+        return None
+    log.debug('Cache hit for %s: %s', endpoint, path)
+    return entry
+
+
+@with_log
+def cache_save(endpoint, response, log):
+    """Store an API response in the cache along with its ETag/Last-Modified validators.
+
+    :param str endpoint: API endpoint (e.g. '/projects/Robpol86/appveyor-artifacts').
+    :param requests.Response response: Successful HTTP response.
+    :param logging.Logger log: Logger for this function. Populated by with_log() decorator.
+    """
+    path = cache_path(endpoint)
+    if not path:
+        return
+    entry = dict(
+        endpoint=endpoint,
+        etag=response.headers.get('ETag', ''),
+        last_modified=response.headers.get('Last-Modified', ''),
+        text=response.text,
+    )
+
+    # Write to a temporary file first so concurrent runs never read half-written entries.
+    try:
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        handle, temp_path = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(path))
+        with os.fdopen(handle, 'w') as handle:
+            json.dump(entry, handle)
+        replace_file(temp_path, path)
+    except (IOError, OSError) as exc:
+        log.warning('Unable to write to cache directory: %s', exc)
+        return
+    log.debug('Cached %s in %s', endpoint, path)
+    cache_evict(os.path.dirname(path), get_session().cache_size)
+
+
+@with_log
+def cache_evict(cache_dir, max_size, log):
+    """Delete least recently used cache entries until the cache directory is no larger than max_size.
+
+    Holds an exclusive lock on <cache_dir>/.lock (where supported) so concurrent processes don't evict at the same
+    time. Temporary files of concurrent writers are left alone.
+
+    :param str cache_dir: Cache directory.
+    :param int max_size: Max total size in bytes.
+    :param logging.Logger log: Logger for this function. Populated by with_log() decorator.
+    """
+    with open(os.path.join(cache_dir, '.lock'), 'a') as lock:
+        if fcntl is not None:
+            fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+        cache_evict_locked(cache_dir, max_size, log)
+
+
+def cache_evict_locked(cache_dir, max_size, log):
+    """Delete least recently used cache entries. Called by cache_evict() while holding the lock.
+
+    :param str cache_dir: Cache directory.
+    :param int max_size: Max total size in bytes.
+    :param logging.Logger log: Logger of cache_evict().
+    """
+    entries = list()
+    for name in os.listdir(cache_dir):
+        if name.startswith('.') or name.endswith('.tmp'):
+            continue
+        path = os.path.join(cache_dir, name)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue  # Deleted by another process.
+        entries.append((stat.st_mtime, stat.st_size, path))
+
+    total_size = sum(i[1] for i in entries)
+    for _, size, path in sorted(entries):
+        if total_size <= max_size:
+            break
+        log.debug('Evicting %s from cache.', path)
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        total_size -= size
+
+
+def artifact_cache_path(config, url, size):
+    """Get the file path of an artifact in --artifact-cache.
+
+    Keyed by URL (which holds the globally unique job ID and the file name) and size, so it can be shared by projects.
+
+    :param dict config: Dictionary from get_arguments().
+    :param str url: URL of the file to download.
+    :param int size: Expected file size in bytes.
+
+    :return: File path or empty string if the artifact cache is disabled.
+    :rtype: str
+    """
+    if not config.get('artifact_cache'):
+        return ''
+    key = '{0}\n{1}'.format(url, size).encode('utf-8')
+    return os.path.join(config['artifact_cache'], hashlib.sha1(key).hexdigest() + '.bin')
+
+
+@with_log
+def artifact_cache_load(cache_entry, local_path, expected_size, log):
+    """Hardlink (or copy if that's not possible) a cached artifact to local_path.
+
+    :param str cache_entry: File path from artifact_cache_path().
+    :param str local_path: Destination path to save file to.
+    :param int expected_size: Expected file size in bytes.
+    :param logging.Logger log: Logger for this function. Populated by with_log() decorator.
+
+    :return: If local_path was created from the cache.
+    :rtype: bool
+    """
+    try:
+        if os.path.getsize(cache_entry) != expected_size:
+            return False
+        os.utime(cache_entry, None)  # Most recently used.
+        try:
+            os.link(cache_entry, local_path)
+        except (AttributeError, OSError):  # Other filesystem or no hardlink support.
+            shutil.copyfile(cache_entry, local_path + PART_SUFFIX)
+            replace_file(local_path + PART_SUFFIX, local_path)
+    except (IOError, OSError):
+        log.debug('Artifact cache miss: %s', cache_entry)
+        return False
+    log.debug('Artifact cache hit: %s', cache_entry)
+    return True
+
+
+@with_log
+def artifact_cache_save(config, cache_entry, local_path, log):
+    """Hardlink (or copy if that's not possible) a downloaded artifact into the cache and evict old ones.
+
+    :param dict config: Dictionary from get_arguments().
+    :param str cache_entry: File path from artifact_cache_path().
+    :param str local_path: Downloaded file.
+    :param logging.Logger log: Logger for this function. Populated by with_log() decorator.
+    """
+    cache_dir = os.path.dirname(cache_entry)
+    try:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        handle, temp_path = tempfile.mkstemp(suffix='.tmp', dir=cache_dir)
+        os.close(handle)
+        os.remove(temp_path)
+        try:
+            os.link(local_path, temp_path)
+        except (AttributeError, OSError):
+            shutil.copyfile(local_path, temp_path)
+        replace_file(temp_path, cache_entry)
+        cache_evict(cache_dir, int(config.get('artifact_cache_size') or ARTIFACT_CACHE_SIZE))
+    except (IOError, OSError) as exc:
+        log.warning('Unable to write to artifact cache: %s', exc)
+        return
+    log.debug('Cached %s in %s', local_path, cache_entry)
+
+
+def retry_delay(attempt, response=None):
+    """Determine how long to wait before retrying a request.
+
+    Uses exponential backoff with full jitter so that many CI jobs starting at the same time don't retry in lockstep.
+    The server's Retry-After header takes precedence if present, but never makes the delay exceed RETRY_BACKOFF_MAX.
+
+    :param int attempt: Zero-based number of the attempt that failed.
+    :param requests.Response response: Failed HTTP response, None on network errors.
+
+    :return: Number of seconds to wait.
+    :rtype: float
+    """
+    backoff = get_session().backoff
+    delay = random.uniform(0, min(RETRY_BACKOFF_MAX, backoff * 2 ** attempt))
+
+    # Honor Retry-After, which is either a number of seconds or an HTTP date.
+    retry_after = response.headers.get('Retry-After', '').strip() if response is not None else ''
+    if retry_after.isdigit():
+        delay = int(retry_after) + random.uniform(0, backoff)
+    elif retry_after:
+        parsed = email.utils.parsedate_tz(retry_after)
+        if parsed:
+            delay = max(email.utils.mktime_tz(parsed) - time.time(), 0) + random.uniform(0, backoff)
+
+    return min(delay, RETRY_BACKOFF_MAX)
+
+
 @with_log
 def query_api(endpoint, log):
     """Query the AppVeyor API.
@@ -212,31 +689,32 @@ def query_api(endpoint, log):
     """
     url = API_PREFIX + endpoint
     headers = {'content-type': 'application/json'}
-    response = None
+
+    # Check cache.
+    cached = cache_load(endpoint)
+    if cached and REGEX_IMMUTABLE.match(endpoint):
+        log.debug('Artifacts of finished jobs never change, skipping query.')
+        return json.loads(cached['text'])
+    if cached and cached['etag']:
+        headers['If-None-Match'] = cached['etag']
+    if cached and cached['last_modified']:
+        headers['If-Modified-Since'] = cached['last_modified']
+
     log.debug('Querying %s with headers %s.', url, headers)
-    for i in range(QUERY_ATTEMPTS):
-        try:
-            try:
-                response = requests.get(url, headers=headers, timeout=10)
-            except (requests.exceptions.ConnectTimeout, requests.exceptions.ReadTimeout, requests.Timeout):
-                log.error('Timed out waiting for reply from server.')
-                raise HandledError
-            except requests.ConnectionError:
-                log.error('Unable to connect to server.')
-                raise HandledError
-        except HandledError:
-            if i == QUERY_ATTEMPTS - 1:
-                raise
-            log.warning('Network error, retrying in 1 second...')
-            time.sleep(1)
-        else:
-            break
+    response = get_session().get_with_retries(url, log, headers=headers, timeout=10)
     log.debug('Response status: %d', response.status_code)
     log.debug('Response headers: %s', str(response.headers))
     log.debug('Response text: %s', response.text)
 
+    if cached and response.status_code == 304:
+        log.debug('Not modified, using cached response.')
+        return json.loads(cached['text'])
+
     if not response.ok:
-        message = response.json().get('message')
+        try:
+            message = response.json().get('message')
+        except (AttributeError, ValueError):
+            message = None
         if message:
             log.error('HTTP %d: %s', response.status_code, message)
         else:
@@ -244,10 +722,27 @@ def query_api(endpoint, log):
         raise HandledError
 
     try:
-        return response.json()
+        json_data = response.json()
     except ValueError:
         log.error('Failed to parse JSON: %s', response.text)
         raise HandledError
+    cache_save(endpoint, response)
+    return json_data
+
+
+def invalid_path_map_rule(value):
+    """Find the first invalid rule of a --path-map value.
+
+    :param str value: --path-map value.
+
+    :return: Invalid rule or None if all are valid.
+    :rtype: str
+    """
+    try:
+        PathMap(value)
+    except ValueError as exc:
+        return str(exc)
+    return None
 
 
 @with_log
@@ -259,71 +754,234 @@ def validate(config, log):
     :param dict config: Dictionary from get_arguments().
     :param logging.Logger log: Logger for this function. Populated by with_log() decorator.
     """
-    if config['always_job_dirs'] and config['no_job_dirs']:
-        log.error('Contradiction: --always-job-dirs and --no-job-dirs used.')
-        raise HandledError
-    if config['commit'] and not REGEX_COMMIT.match(config['commit']):
-        log.error('No or invalid git commit obtained.')
-        raise HandledError
-    if config['dir'] and not os.path.isdir(config['dir']):
-        log.error("Not a directory or doesn't exist: %s", config['dir'])
-        raise HandledError
-    if config['no_job_dirs'] not in ('', 'rename', 'overwrite', 'skip'):
-        log.error('--no-job-dirs has invalid value. Check --help for valid values.')
-        raise HandledError
-    if not config['owner'] or not REGEX_GENERAL.match(config['owner']):
-        log.error('No or invalid repo owner name obtained.')
-        raise HandledError
-    if config['pull_request'] and not config['pull_request'].isdigit():
-        log.error('--pull-request is not a digit.')
-        raise HandledError
-    if not config['repo'] or not REGEX_GENERAL.match(config['repo']):
-        log.error('No or invalid repo name obtained.')
-        raise HandledError
-    if config['tag'] and not REGEX_GENERAL.match(config['tag']):
-        log.error('Invalid git tag obtained.')
-        raise HandledError
+    path_map_rule = invalid_path_map_rule(config['path_map']) if config['path_map'] else None
+    remote = not config['verify'] and not config['from_plan']  # Both make no AppVeyor queries.
+
+    # Failed condition (first), error message and its arguments (rest). The first failed check is reported.
+    checks = (
+        (config['always_job_dirs'] and config['no_job_dirs'],
+         'Contradiction: --always-job-dirs and --no-job-dirs used.'),
+        (remote and config['commit'] and not REGEX_COMMIT.match(config['commit']),
+         'No or invalid git commit obtained.'),
+        (config['checksums'] and not os.path.isdir(os.path.dirname(os.path.abspath(config['checksums']))),
+         "--checksums directory doesn't exist: %s", config['checksums']),
+        (config['combine'] and not os.path.isdir(os.path.dirname(os.path.abspath(config['combine']))),
+         "--combine directory doesn't exist: %s", config['combine']),
+        (config['dir'] and not os.path.isdir(config['dir']), "Not a directory or doesn't exist: %s", config['dir']),
+        (config['from_plan'] and config['plan'], 'Contradiction: --from-plan and --plan used.'),
+        (config['from_plan'] and not os.path.isfile(config['from_plan']), "Plan file doesn't exist: %s",
+         config['from_plan']),
+        (config['no_job_dirs'] not in ('', 'rename', 'number', 'overwrite', 'skip'),
+         '--no-job-dirs has invalid value. Check --help for valid values.'),
+        (remote and (not config['owner'] or not REGEX_GENERAL.match(config['owner'])),
+         'No or invalid repo owner name obtained.'),
+        (path_map_rule is not None, '--path-map has invalid rule: %s', path_map_rule),
+        (config['plan'] and not os.path.isdir(os.path.dirname(os.path.abspath(config['plan']))),
+         "--plan directory doesn't exist: %s", config['plan']),
+        (config['pull_request'] and not config['pull_request'].isdigit(), '--pull-request is not a digit.'),
+        (remote and (not config['repo'] or not REGEX_GENERAL.match(config['repo'])),
+         'No or invalid repo name obtained.'),
+        (config['tag'] and not REGEX_GENERAL.match(config['tag']), 'Invalid git tag obtained.'),
+        (config['verify'] and not os.path.isfile(config['verify']), "Checksums file doesn't exist: %s",
+         config['verify']),
+    )
+    for check in checks:
+        if check[0]:
+            log.error(*check[1:])
+            raise HandledError
+
+    # Numeric options.
+    for key in ('api_jobs', 'attempts', 'jobs', 'pool_size', 'segments'):
+        if config[key] and (not config[key].isdigit() or not int(config[key])):
+            log.error('--%s is not a positive integer.', key.replace('_', '-'))
+            raise HandledError
+    for key in ('artifact_cache_size', 'backoff', 'cache_size', 'retry_budget', 'split_above', 'timeout'):
+        if config[key] and not config[key].isdigit():
+            log.error('--%s is not a digit.', key.replace('_', '-'))
+            raise HandledError
+
+
+def parse_timestamp(value):
+    """Parse an ISO 8601 timestamp from the AppVeyor API (e.g. '2016-05-01T22:01:35.1234567+00:00').
+
+    :param str value: Timestamp.
+
+    :return: Seconds since the epoch, or None if value is empty or invalid.
+    :rtype: float
+    """
+    match = REGEX_TIMESTAMP.match(value)
+    if not match:
+        return None
+    year, month, day, hour, minute, second, fraction, sign, offset_hours, offset_minutes = match.groups()
+    timestamp = calendar.timegm(tuple(int(i) for i in (year, month, day, hour, minute, second)))
+    timestamp += float(fraction or 0)
+    if sign:
+        offset = int(offset_hours) * 3600 + int(offset_minutes) * 60
+        timestamp += -offset if sign == '+' else offset
+    return timestamp
+
+
+def build_durations(builds):
+    """Get how long previous successful builds took from the history API.
+
+    :param iter builds: Builds from the history API.
+
+    :return: Durations in seconds.
+    :rtype: list
+    """
+    durations = list()
+    for build in builds:
+        if build.get('status') != 'success':
+            continue
+        started, finished = parse_timestamp(build.get('started') or ''), parse_timestamp(build.get('finished') or '')
+        if started and finished and finished >= started:
+            durations.append(finished - started)
+    return durations
+
+
+def poll_interval(history, deadline=None):
+    """Determine how long to sleep before polling job statuses again.
+
+    Estimates when the build finishes from the median duration of previous builds. Backs off while that's far away
+    and polls more often close to it. Falls back to SLEEP_FOR without history.
+
+    :param dict history: Filled in by query_build_version().
+    :param float deadline: Don't sleep past this time.
+
+    :return: Number of seconds to sleep.
+    :rtype: float
+    """
+    durations, started = sorted(history.get('durations') or []), history.get('started')
+    if durations and started:
+        remaining = started + durations[len(durations) // 2] - time.time()
+        if remaining > 0:
+            delay = min(max(remaining / 2, SLEEP_MIN), SLEEP_MAX)
+        else:
+            delay = min(max(-remaining / 4, SLEEP_MIN), SLEEP_FOR)  # Overdue, slowly back off to the default.
+    else:
+        delay = SLEEP_FOR
+    if deadline is not None:
+        delay = max(min(delay, deadline - time.time()), 0)
+    return delay
+
+
+def index_builds(builds, history):
+    """Add builds from the history API to the tag/pull request/commit lookup index.
+
+    :param iter builds: Builds from the history API, newest first.
+    :param dict history: State shared by query_build_version() calls.
+    """
+    index = history.setdefault('index', dict())
+    for build in builds:
+        history['indexed'] = history.get('indexed', 0) + 1
+        rank = (build.get('buildId', 0), -history['indexed'])  # Newest build wins.
+        for key in (('tag', build.get('tag')), ('pr', build.get('pullRequestId')), ('commit', build.get('commitId'))):
+            if key[1] and (key not in index or index[key][0] < rank):
+                index[key] = (rank, build)
+
+
+def lookup_build(config, history):
+    """Find the newest indexed build matching the tag, pull request, or commit currently building.
+
+    :param dict config: Dictionary from get_arguments().
+    :param dict history: State shared by query_build_version() calls.
+
+    :return: Kind of build (first) and build JSON dict (second), or None.
+    :rtype: tuple
+    """
+    index = history.get('index', dict())
+    candidates = list()
+    for kind, key in (('tag', ('tag', config['tag'])), ('pull request', ('pr', config['pull_request'])),
+                      ('branch', ('commit', config['commit']))):
+        if key[1] and key in index:
+            candidates.append((index[key][0], -len(candidates), kind, index[key][1]))
+    if not candidates:
+        return None
+    return max(candidates, key=lambda c: c[:2])[2:]
 
 
 @with_log
-def query_build_version(config, log):
+def query_build_version(config, log, history=None):
     """Find the build version we're looking for.
 
     AppVeyor calls build IDs "versions" which is confusing but whatever. Job IDs aren't available in the history query,
     only on latest, specific version, and deployment queries. Hence we need two queries to get a one-time status update.
 
+    Pages through the build history with startBuildId, doubling the page size every page, until a matching build is
+    found. Builds are indexed in `history` so repeated calls only fetch builds newer than the ones already seen and
+    resume paging where the previous call stopped.
+
     Returns None if the job isn't queued yet.
 
     :raise HandledError: On invalid JSON data.
 
     :param dict config: Dictionary from get_arguments().
     :param logging.Logger log: Logger for this function. Populated by with_log() decorator.
+    :param dict history: State shared by repeated calls. Also filled with "durations" of previous successful builds
+        and when the found build "started", in seconds, for poll_interval().
 
     :return: Build version.
     :rtype: str
     """
-    url = '/projects/{0}/{1}/history?recordsNumber=10'.format(config['owner'], config['repo'])
-
-    # Query history.
-    log.debug('Querying AppVeyor history API for %s/%s...', config['owner'], config['repo'])
-    json_data = query_api(url)
-    if 'builds' not in json_data:
-        log.error('Bad JSON reply: "builds" key missing.')
-        raise HandledError
+    history = dict() if history is None else history
+    url = '/projects/{0}/{1}/history?recordsNumber={{0}}'.format(config['owner'], config['repo'])
+
+    def query(records_number, start_build_id=None):
+        """Query one page of the build history, newest first."""
+        log.debug('Querying AppVeyor history API for %s/%s...', config['owner'], config['repo'])
+        json_data = query_api(url.format(records_number) + ('&startBuildId={0}'.format(start_build_id)
+                                                            if start_build_id else ''))
+        if 'builds' not in json_data:
+            log.error('Bad JSON reply: "builds" key missing.')
+            raise HandledError
+        return json_data['builds']
 
-    # Find AppVeyor build "version".
-    for build in json_data['builds']:
-        if config['tag'] and config['tag'] == build.get('tag'):
-            log.debug('This is a tag build.')
-        elif config['pull_request'] and config['pull_request'] == build.get('pullRequestId'):
-            log.debug('This is a pull request build.')
-        elif config['commit'] == build['commitId']:
-            log.debug('This is a branch build.')
-        else:
-            continue
-        log.debug('Build JSON dict: %s', str(build))
-        return build['version']
-    return None
+    # Index builds newer than the ones already seen, paging if there are more than one page of them.
+    newest, new_builds, start_build_id = history.get('newest'), list(), None
+    while True:
+        builds = query(HISTORY_PAGE, start_build_id)
+        if not all('buildId' in b for b in builds):  # Can't page without build IDs, start over every time.
+            for key in ('durations', 'index', 'newest', 'oldest'):
+                history.pop(key, None)
+            new_builds, history['exhausted'] = builds, True
+            break
+        if start_build_id is not None and builds and builds[-1]['buildId'] >= start_build_id:
+            log.debug('History API ignored startBuildId, not paging further.')
+            break
+        fresh = [b for b in builds if newest is None or b['buildId'] > newest]
+        new_builds.extend(fresh)
+        if newest is None:
+            history['exhausted'] = len(builds) < HISTORY_PAGE
+        if newest is None or len(fresh) < len(builds) or len(builds) < HISTORY_PAGE or \
+                len(new_builds) >= HISTORY_LIMIT:
+            break
+        start_build_id = builds[-1]['buildId']
+    index_builds(new_builds, history)
+    history['durations'] = history.get('durations', list()) + build_durations(new_builds)
+    if new_builds and 'buildId' in new_builds[0]:
+        history['newest'] = new_builds[0]['buildId']
+        history.setdefault('oldest', new_builds[-1]['buildId'])
+    match = lookup_build(config, history)
+
+    # Page through older builds.
+    records_number = HISTORY_PAGE
+    while not match and not history['exhausted'] and history.get('oldest'):
+        records_number = min(records_number * 2, HISTORY_PAGE_MAX)
+        builds = query(records_number, history['oldest'])
+        history['exhausted'] = len(builds) < records_number or history.get('indexed', 0) >= HISTORY_LIMIT
+        index_builds(builds, history)
+        history['durations'].extend(build_durations(builds))
+        if builds:
+            history['oldest'] = min(b['buildId'] for b in builds)
+        match = lookup_build(config, history)
+
+    if not match:
+        return None
+    kind, build = match
+    log.debug('This is a %s build.', kind)
+    log.debug('Build JSON dict: %s', str(build))
+    history['started'] = parse_timestamp(build.get('started') or build.get('created') or '')
+    return build['version']
 
 
 @with_log
@@ -367,103 +1025,192 @@ def query_job_ids(build_version, config, log):
 
 
 @with_log
-def query_artifacts(job_ids, log):
+def query_artifacts(job_ids, log, api_jobs=1):
     """Query API again for artifacts.
 
+    Up to `api_jobs` jobs are queried concurrently. Results are always in the same order as `job_ids`.
+
     :param iter job_ids: List of AppVeyor jobIDs.
     :param logging.Logger log: Logger for this function. Populated by with_log() decorator.
+    :param int api_jobs: Number of concurrent queries.
 
     :return: List of tuples: (job ID, artifact file name, artifact file size).
     :rtype: list
     """
-    jobs_artifacts = list()
-    for job in job_ids:
-        url = '/buildjobs/{0}/artifacts'.format(job)
+    def query(job):
+        """Query artifacts of one job.
+
+        :param str job: AppVeyor jobID.
+
+        :return: Parsed JSON response.
+        :rtype: list
+        """
         log.debug('Querying AppVeyor artifact API for %s...', job)
-        json_data = query_api(url)
+        return query_api('/buildjobs/{0}/artifacts'.format(job))
+
+    job_ids = list(job_ids)
+    if api_jobs > 1 and len(job_ids) > 1:
+        pool = multiprocessing.pool.ThreadPool(min(api_jobs, len(job_ids)))
+        try:
+            replies = pool.map(query, job_ids)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        replies = [query(j) for j in job_ids]
+
+    jobs_artifacts = list()
+    for job, json_data in zip(job_ids, replies):
         for artifact in json_data:
             jobs_artifacts.append((job, artifact['fileName'], artifact['size']))
     return jobs_artifacts
 
 
 @with_log
-def artifacts_urls(config, jobs_artifacts, log):
+def use_job_dirs(config, jobs_artifacts, log):
+    """Determine if artifacts are downloaded within ./<jobID>/ directories.
+
+    :param dict config: Dictionary from get_arguments().
+    :param iter jobs_artifacts: List of job artifacts from query_artifacts().
+    :param logging.Logger log: Logger for this function. Populated by with_log() decorator.
+
+    :return: If job ID directories should be created.
+    :rtype: bool
+    """
+    if config['always_job_dirs']:
+        return True
+    if config['no_job_dirs']:
+        return False
+    job_ids = set(i[0] for i in jobs_artifacts)
+    file_names = set(i[1] for i in jobs_artifacts)
+    if len(job_ids) == 1:
+        log.debug('Only one job ID, automatically setting job_dirs = False.')
+        return False
+    if len(file_names) == len(jobs_artifacts):
+        log.debug('No local file conflicts, automatically setting job_dirs = False')
+        return False
+    log.debug('Multiple job IDs with file conflicts, automatically setting job_dirs = True')
+    return True
+
+
+def resolve_collision(config, artifacts, artifact_local, artifact_url, renamed, log):
+    """Handle an artifact whose destination path is already taken by another one, according to --no-job-dirs.
+
+    :raise HandledError: If --no-job-dirs isn't used.
+
+    :param dict config: Dictionary from get_arguments().
+    :param dict artifacts: Destination paths taken so far, from artifacts_urls().
+    :param str artifact_local: Colliding destination path.
+    :param str artifact_url: URL of the colliding artifact.
+    :param dict renamed: Number of times each colliding path was renamed. Updated in place.
+    :param logging.Logger log: Logger of artifacts_urls().
+
+    :return: Destination path to use instead, None if skipped.
+    :rtype: str
+    """
+    if config['no_job_dirs'] == 'skip':
+        log.debug('Skipping %s from %s', artifact_local, artifact_url)
+        return None
+    if config['no_job_dirs'] in ('rename', 'number'):
+        path, ext = os.path.splitext(artifact_local)
+        new_name = artifact_local
+        while new_name in artifacts:  # Only loops again if an artifact is named like a renamed one.
+            renamed[artifact_local] = count = renamed.get(artifact_local, 0) + 1
+            new_name = path + ('_' * count if config['no_job_dirs'] == 'rename' else '_{0}'.format(count)) + ext
+        log.debug('Renaming %s to %s from %s', artifact_local, new_name, artifact_url)
+        return new_name
+    if config['no_job_dirs'] == 'overwrite':
+        log.debug('Overwriting %s from %s with %s', artifact_local, artifacts[artifact_local][0], artifact_url)
+        return artifact_local
+    log.error('Collision: %s from %s and %s', artifact_local, artifacts[artifact_local][0], artifact_url)
+    raise HandledError
+
+
+@with_log
+def artifacts_urls(config, jobs_artifacts, log, actions=None):
     """Determine destination file paths for job artifacts.
 
+    File path collisions are renamed by appending underscores (rename mode, file_.txt, file__.txt, ...) or numbers
+    (number mode, file_1.txt, file_2.txt, ...). A counter per colliding path keeps this linear in the number of
+    artifacts.
+
     :param dict config: Dictionary from get_arguments().
     :param iter jobs_artifacts: List of job artifacts from query_artifacts().
     :param logging.Logger log: Logger for this function. Populated by with_log() decorator.
+    :param list actions: Filled with a dict per artifact: job, file_name, url, size, path (None if not downloaded), and
+        action (download, rename, skip, overwrite, or overwritten by a later artifact).
 
     :return: Destination file paths (keys), download URLs (value[0]), and expected file size (value[1]).
     :rtype: dict
     """
     artifacts = dict()
-
-    # Determine if we should create job ID directories.
-    if config['always_job_dirs']:
-        job_dirs = True
-    elif config['no_job_dirs']:
-        job_dirs = False
-    elif len(set(i[0] for i in jobs_artifacts)) == 1:
-        log.debug('Only one job ID, automatically setting job_dirs = False.')
-        job_dirs = False
-    elif len(set(i[1] for i in jobs_artifacts)) == len(jobs_artifacts):
-        log.debug('No local file conflicts, automatically setting job_dirs = False')
-        job_dirs = False
-    else:
-        log.debug('Multiple job IDs with file conflicts, automatically setting job_dirs = True')
-        job_dirs = True
+    renamed = dict()  # Number of times each colliding path was renamed.
+    planned = dict()  # Entries of `actions` by path.
+    job_dirs = use_job_dirs(config, jobs_artifacts)
 
     # Get final URLs and destination file paths.
     root_dir = config['dir'] or os.getcwd()
     for job, file_name, size in jobs_artifacts:
-        artifact_url = '{0}/buildjobs/{1}/artifacts/{2}'.format(API_PREFIX, job, file_name)
+        artifact_url = ARTIFACT_URL.format(API_PREFIX, job, file_name)
         artifact_local = os.path.join(root_dir, job if job_dirs else '', file_name)
+        action = 'download'
         if artifact_local in artifacts:
-            if config['no_job_dirs'] == 'skip':
-                log.debug('Skipping %s from %s', artifact_local, artifact_url)
-                continue
-            if config['no_job_dirs'] == 'rename':
-                new_name = artifact_local
-                while new_name in artifacts:
-                    path, ext = os.path.splitext(new_name)
-                    new_name = (path + '_' + ext) if ext else (new_name + '_')
-                log.debug('Renaming %s to %s from %s', artifact_local, new_name, artifact_url)
-                artifact_local = new_name
-            elif config['no_job_dirs'] == 'overwrite':
-                log.debug('Overwriting %s from %s with %s', artifact_local, artifacts[artifact_local][0], artifact_url)
-            else:
-                log.error('Collision: %s from %s and %s', artifact_local, artifacts[artifact_local][0], artifact_url)
-                raise HandledError
-        artifacts[artifact_local] = (artifact_url, size)
+            action = 'rename' if config['no_job_dirs'] == 'number' else config['no_job_dirs']
+            artifact_local = resolve_collision(config, artifacts, artifact_local, artifact_url, renamed, log)
+            if action == 'overwrite' and artifact_local in planned:
+                planned[artifact_local].update(action='overwritten', path=None)
+        if actions is not None:
+            actions.append(dict(job=job, file_name=file_name, url=artifact_url, size=size, path=artifact_local,
+                                action=action))
+            if artifact_local:
+                planned[artifact_local] = actions[-1]
+        if artifact_local:
+            artifacts[artifact_local] = (artifact_url, size)
 
     return artifacts
 
 
-@with_log
-def get_urls(config, log):
-    """Wait for AppVeyor job to finish and get all artifacts' URLs.
+def wait_for_build_version(config, history, deadline, log):
+    """Wait for the AppVeyor job to be queued. Called by get_urls().
+
+    :raise HandledError: If it isn't queued in time or the build isn't found.
 
     :param dict config: Dictionary from get_arguments().
-    :param logging.Logger log: Logger for this function. Populated by with_log() decorator.
+    :param dict history: Passed to query_build_version().
+    :param float deadline: Give up at this time. None gives up after 3 queries.
+    :param logging.Logger log: Logger of get_urls().
 
-    :return: Paths and URLs from artifacts_urls.
-    :rtype: dict
+    :return: Build version.
+    :rtype: str
     """
-    # Wait for job to be queued. Once it is we'll have the "version".
-    build_version = None
-    for _ in range(3):
-        build_version = query_build_version(config)
+    for attempt in itertools.count(1):
+        build_version = query_build_version(config, history=history)
         if build_version:
-            break
+            return build_version
         log.info('Waiting for job to be queued...')
-        time.sleep(SLEEP_FOR)
-    if not build_version:
-        log.error('Timed out waiting for job to be queued or build not found.')
-        raise HandledError
+        if (deadline is None and attempt >= 3) or (deadline is not None and time.time() >= deadline):
+            break
+        time.sleep(poll_interval(dict(), deadline))
+    log.error('Timed out waiting for job to be queued or build not found.')
+    raise HandledError
+
+
+def wait_for_jobs(build_version, config, history, deadline, log, on_success=None):
+    """Wait for all jobs of a build to succeed. Called by get_urls().
+
+    :raise HandledError: If a job failed, on unknown statuses, or if jobs don't finish in time.
+
+    :param str build_version: AppVeyor build version from query_build_version().
+    :param dict config: Dictionary from get_arguments().
+    :param dict history: Filled in by query_build_version(), for poll_interval().
+    :param float deadline: Give up at this time. None waits indefinitely.
+    :param logging.Logger log: Logger of get_urls().
+    :param function on_success: Passed from get_urls().
 
-    # Get job IDs. Wait for AppVeyor job to finish.
-    job_ids = list()
+    :return: Job IDs and statuses from query_job_ids() (first), return values of on_success() by job ID (second).
+    :rtype: tuple
+    """
+    listed = dict()
     valid_statuses = ['success', 'failed', 'running', 'queued']
     while True:
         job_ids = query_job_ids(build_version, config)
@@ -473,9 +1220,12 @@ def get_urls(config, log):
             url = 'https://ci.appveyor.com/project/{0}/{1}/build/job/{2}'.format(config['owner'], config['repo'], job)
             log.error('AppVeyor job failed: %s', url)
             raise HandledError
+        if on_success:
+            for job in (i[0] for i in job_ids if i[1] == 'success' and i[0] not in listed):
+                listed[job] = on_success(job)
         if statuses == set(valid_statuses[:1]):
             log.info('Build successful. Found %d job%s.', len(job_ids), '' if len(job_ids) == 1 else 's')
-            break
+            return job_ids, listed
         if 'running' in statuses:
             log.info('Waiting for job%s to finish...', '' if len(job_ids) == 1 else 's')
         elif 'queued' in statuses:
@@ -483,80 +1233,1952 @@ def get_urls(config, log):
         else:
             log.error('Got unknown status from AppVeyor API: %s', ' '.join(statuses - set(valid_statuses)))
             raise HandledError
-        time.sleep(SLEEP_FOR)
-
-    # Get artifacts.
-    artifacts = query_artifacts([i[0] for i in job_ids])
-    log.info('Found %d artifact%s.', len(artifacts), '' if len(artifacts) == 1 else 's')
-    return artifacts_urls(config, artifacts) if artifacts else dict()
+        if deadline is not None and time.time() >= deadline:
+            log.error('Timed out waiting for job%s to finish.', '' if len(job_ids) == 1 else 's')
+            raise HandledError
+        delay = poll_interval(history, deadline)
+        log.debug('Polling again in %.1f seconds.', delay)
+        time.sleep(delay)
 
 
 @with_log
-def download_file(config, local_path, url, expected_size, chunk_size, log):
-    """Download a file.
+def get_urls(config, log, on_success=None, actions=None):
+    """Wait for AppVeyor job to finish and get all artifacts' URLs.
 
     :param dict config: Dictionary from get_arguments().
-    :param str local_path: Destination path to save file to.
+    :param logging.Logger log: Logger for this function. Populated by with_log() decorator.
+    :param function on_success: Called with each job ID as soon as that job succeeds, while other jobs may still be
+        running. Returns that job's artifacts (like query_artifacts()), which won't be queried again.
+    :param list actions: Passed to artifacts_urls().
+
+    :return: Paths and URLs from artifacts_urls.
+    :rtype: dict
+    """
+    timeout = int(config.get('timeout') or 0)
+    deadline = time.time() + timeout if timeout else None
+    history = dict()
+
+    # Wait for job to be queued. Once it is we'll have the "version". Then wait for AppVeyor jobs to finish.
+    build_version = wait_for_build_version(config, history, deadline, log)
+    job_ids, listed = wait_for_jobs(build_version, config, history, deadline, log, on_success)
+
+    # Get artifacts, in job order regardless of which jobs on_success() already got.
+    remaining = [i[0] for i in job_ids if i[0] not in listed]
+    artifacts = query_artifacts(remaining, api_jobs=int(config.get('api_jobs') or API_JOBS)) if remaining else list()
+    if listed:
+        queried, artifacts = artifacts, list()
+        for job in (i[0] for i in job_ids):
+            artifacts.extend(listed[job] if job in listed else [a for a in queried if a[0] == job])
+    log.info('Found %d artifact%s.', len(artifacts), '' if len(artifacts) == 1 else 's')
+    return artifacts_urls(config, artifacts, actions=actions) if artifacts else dict()
+
+
+@with_log
+def read_part_state(part_path, url, expected_size, log):
+    """Determine where to resume an interrupted download from.
+
+    :param str part_path: Partially downloaded file.
+    :param str url: URL of the file to download.
+    :param int expected_size: Expected file size in bytes.
+    :param logging.Logger log: Logger for this function. Populated by with_log() decorator.
+
+    :return: Number of bytes already downloaded (first) and the ETag of the file they belong to (second).
+    :rtype: tuple
+    """
+    try:
+        with open(part_path + '.json') as handle:
+            state = json.load(handle)
+        offset = os.path.getsize(part_path)
+    except (IOError, OSError, ValueError):
+        return 0, ''
+    if state.get('url') != url or state.get('size') != expected_size or offset > expected_size or 'done' in state:
+        log.debug('Discarding stale partial download: %s', part_path)
+        return 0, ''
+    if state.get('mangled'):
+        log.debug('Discarding partial download with substituted paths: %s', part_path)
+        return 0, ''
+    return offset, state.get('etag', '')
+
+
+@with_log
+def read_segments_state(part_path, url, expected_size, log):
+    """Determine which byte ranges of an interrupted download_segments() call are already downloaded.
+
+    :param str part_path: Partially downloaded file.
+    :param str url: URL of the file to download.
+    :param int expected_size: Expected file size in bytes.
+    :param logging.Logger log: Logger for this function. Populated by with_log() decorator.
+
+    :return: Start offsets of completed ranges (first) and the ETag of the file they belong to (second).
+    :rtype: tuple
+    """
+    try:
+        with open(part_path + '.json') as handle:
+            state = json.load(handle)
+        preallocated = os.path.getsize(part_path) == expected_size
+    except (IOError, OSError, ValueError):
+        return set(), ''
+    if state.get('url') != url or state.get('size') != expected_size or not preallocated or 'done' not in state:
+        log.debug('Discarding stale partial download: %s', part_path)
+        return set(), ''
+    return set(state['done']), state.get('etag', '')
+
+
+def write_part_state(part_path, url, expected_size, etag, done=None, mangled=False):
+    """Remember what a .part file belongs to so a later run can resume it.
+
+    :param str part_path: Partially downloaded file.
+    :param str url: URL of the file to download.
+    :param int expected_size: Expected file size in bytes.
+    :param str etag: ETag of the file on the server, if any.
+    :param list done: Start offsets of completed ranges for download_segments().
+    :param bool mangled: Paths are substituted while downloading, can't be resumed.
+    """
+    state = dict(url=url, size=expected_size, etag=etag)
+    if done is not None:
+        state['done'] = done
+    if mangled:
+        state['mangled'] = True
+    with open(part_path + '.json', 'w') as handle:
+        json.dump(state, handle)
+
+
+def remove_part(part_path):
+    """Delete a .part file and its state file, whichever exist.
+
+    :param str part_path: Partially downloaded file.
+    """
+    for path in (part_path, part_path + '.json'):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+class SyncState(object):
+    """Remembers which artifact every local file was downloaded from, for --sync.
+
+    Stored in <dir>/.appveyor-artifacts.json. Artifacts never change once uploaded and their URLs contain the job ID,
+    so a file is up to date if it was downloaded from the same URL with the same size and its size and mtime haven't
+    changed since the end of that run (which includes --mangle-coverage edits). Hardlinks to --artifact-cache entries
+    are only compared by size, as every run loading the entry touches its mtime. Files without a record are up to date
+    if they have the expected size. Safe to use from multiple threads.
+    """
+
+    def __init__(self, root, log):
+        """Constructor.
+
+        :param str root: Download directory.
+        :param logging.Logger log: Logger for this class.
+        """
+        self.path = os.path.join(root, SYNC_STATE)
+        self.root = root
+        self.log = log
+        self.lock = threading.Lock()
+        self.skipped = 0
+        try:
+            with open(self.path) as handle:
+                self.files = json.load(handle)['files']
+        except (IOError, OSError, ValueError, KeyError, TypeError):
+            self.files = dict()
+
+    def up_to_date(self, local_path, url, size):
+        """Check if a file needs no download, remembering it if so.
+
+        :param str local_path: Destination path.
+        :param str url: URL of the file to download.
+        :param int size: Expected file size in bytes.
+
+        :return: If local_path exists and is up to date.
+        :rtype: bool
+        """
+        relative_path = os.path.relpath(local_path, self.root)
+        try:
+            stat = os.stat(local_path)
+        except OSError:
+            return False
+        with self.lock:
+            record = self.files.get(relative_path)
+            if record is None:
+                current = stat.st_size == size
+            else:
+                current = record.get('url') == url and record.get('size') == size and self.unchanged(record, stat)
+            if current:
+                self.files[relative_path] = record or dict(url=url, size=size, local=None)
+                self.skipped += 1
+        self.log.debug('%s is %s.', relative_path, 'up to date' if current else 'outdated')
+        return current
+
+    def known(self, url, size):
+        """Check if any up to date local file was downloaded from url.
+
+        :param str url: URL of the file to download.
+        :param int size: Expected file size in bytes.
+
+        :return: If a previous run downloaded the artifact.
+        :rtype: bool
+        """
+        with self.lock:
+            paths = [p for p, r in self.files.items() if r.get('url') == url and r.get('size') == size]
+        for relative_path in paths:
+            record = self.files[relative_path]
+            try:
+                stat = os.stat(os.path.join(self.root, relative_path))
+            except OSError:
+                continue
+            if self.unchanged(record, stat):
+                return True
+        return False
+
+    @staticmethod
+    def unchanged(record, stat):
+        """Check if a local file wasn't modified since save() recorded its size and mtime.
+
+        :param dict record: Record of the file.
+        :param stat: os.stat() result of the file.
+
+        :return: If the file is unchanged or was recorded without size and mtime.
+        :rtype: bool
+        """
+        local = record.get('local')
+        if local is None:
+            return True
+        if stat.st_nlink > 1:  # Linked to the artifact cache.
+            return local[0] == stat.st_size
+        return local == [stat.st_size, stat.st_mtime]
+
+    def record(self, local_path, url, size):
+        """Remember a downloaded file.
+
+        :param str local_path: Destination path.
+        :param str url: URL of the file.
+        :param int size: File size in bytes.
+        """
+        with self.lock:
+            self.files[os.path.relpath(local_path, self.root)] = dict(url=url, size=size, local=None)
+
+    def save(self):
+        """Write records of all files that still exist along with their current size and mtime."""
+        files = dict()
+        with self.lock:
+            for relative_path, record in self.files.items():
+                try:
+                    stat = os.stat(os.path.join(self.root, relative_path))
+                except OSError:
+                    continue
+                files[relative_path] = dict(record, local=[stat.st_size, stat.st_mtime])
+        if not files and not os.path.exists(self.path):
+            return
+        try:
+            handle, temp_path = tempfile.mkstemp(suffix='.tmp', dir=self.root)
+            with os.fdopen(handle, 'w') as temp:
+                json.dump(dict(files=files), temp, indent=2, sort_keys=True)
+            replace_file(temp_path, self.path)
+        except (IOError, OSError) as exc:
+            self.log.warning('Unable to write %s: %s', self.path, exc)
+
+
+def format_size(size):
+    """Format a number of bytes for humans.
+
+    :param float size: Number of bytes.
+
+    :return: E.g. "512 B" or "1.5 MiB".
+    :rtype: str
+    """
+    if size < 1024:
+        return '{0} B'.format(int(size))
+    for unit in ('KiB', 'MiB', 'GiB'):
+        size /= 1024.0
+        if size < 1024 or unit == 'GiB':
+            break
+    return '{0:.1f} {1}'.format(size, unit)
+
+
+class StatusLine(object):
+    """Status line of Progress, redrawn in place on a TTY and printed as a plain line otherwise. Not thread safe."""
+
+    def __init__(self):
+        """Constructor."""
+        self.stream = sys.stderr
+        self.tty = hasattr(self.stream, 'isatty') and self.stream.isatty()
+        self.interval = PROGRESS_REDRAW if self.tty else PROGRESS_SUMMARY
+        self.rendered = time.time()
+        self.drawn = False
+
+    def due(self, now):
+        """Check if it's time to redraw, at most every PROGRESS_REDRAW seconds on a TTY or PROGRESS_SUMMARY otherwise.
+
+        :param float now: Current time.
+
+        :return: True if the line should be drawn now.
+        :rtype: bool
+        """
+        if now - self.rendered < self.interval:
+            return False
+        self.rendered = now
+        return True
+
+    def draw(self, line):
+        """Redraw the status line on a TTY or print a progress line otherwise.
+
+        :param str line: Status line from Progress.status().
+        """
+        if self.tty:
+            get_terminal_size = getattr(shutil, 'get_terminal_size', None)  # Python 3.3+.
+            width = get_terminal_size().columns if get_terminal_size else 80
+            self.stream.write('\r\x1b[K' + line[:width - 1])
+            self.drawn = True
+        else:
+            self.stream.write('Progress: ' + line + '\n')
+        self.stream.flush()
+
+    def clear(self):
+        """Erase the status line from a TTY."""
+        if self.drawn:
+            self.stream.write('\r\x1b[K')
+            self.drawn = False
+
+
+class Progress(object):
+    """Download progress display shared by concurrent downloads.
+
+    On a TTY a status line with total and per-file progress, throughput, and ETA is redrawn at most every
+    PROGRESS_REDRAW seconds. Otherwise the same line is printed every PROGRESS_SUMMARY seconds, so CI logs aren't
+    flooded. Finished files are printed on their own lines. Safe to use from multiple threads.
+    """
+
+    def __init__(self, total_size=0, total_files=0, report_files=True):
+        """Constructor.
+
+        :param int total_size: Expected number of bytes of all files. Can be increased by expect().
+        :param int total_files: Expected number of files. Can be increased by expect().
+        :param bool report_files: Print a line for every finished file.
+        """
+        self.screen = StatusLine()
+        self.report_files = report_files
+        self.counts = dict(files=total_files, size=total_size, finished=0, received=0)
+        self.active = dict()
+        self.started = time.time()
+        self.abort = threading.Event()
+        self.lock = threading.Lock()
+
+    def expect(self, files, size):
+        """Add files to the totals, for downloads queued while others are running.
+
+        :param int files: Number of files.
+        :param int size: Number of bytes of all of them.
+        """
+        with self.lock:
+            self.counts['files'] += files
+            self.counts['size'] += size
+
+    def start(self, relative_path, size):
+        """Show a file as being downloaded.
+
+        :param str relative_path: File path to display.
+        :param int size: Expected file size in bytes.
+        """
+        with self.lock:
+            self.active[relative_path] = [0, size]
+
+    def update(self, relative_path, size):
+        """Count received bytes of a file and redraw if it's time to.
+
+        :raise HandledError: If another download failed, to stop this one.
+
+        :param str relative_path: File path passed to start().
+        :param int size: Number of bytes just received.
+        """
+        if self.abort.is_set():
+            raise HandledError
+        with self.lock:
+            if relative_path in self.active:
+                self.active[relative_path][0] += size
+            self.counts['received'] += size
+            now = time.time()
+            if self.screen.due(now):
+                self.screen.draw(self.status(now))
+
+    def done(self, relative_path, size, note=''):
+        """Count a file as complete, including bytes not received by this run (e.g. resumed or cached).
+
+        :param str relative_path: File path to display.
+        :param int size: File size in bytes.
+        :param str note: Appended to the line of this file, e.g. "cached".
+        """
+        with self.lock:
+            received = self.active.pop(relative_path, [0])[0]
+            self.counts['received'] += size - received
+            self.counts['finished'] += 1
+            if self.report_files:
+                note = ' ({0})'.format(note) if note else ''
+                self.write_line(' => {0} {1} bytes{2}'.format(relative_path, size, note))
+            elif not self.active:
+                self.screen.clear()
+
+    def discard(self, relative_path):
+        """Stop showing a file whose download failed.
+
+        :param str relative_path: File path passed to start().
+        """
+        with self.lock:
+            self.counts['received'] -= self.active.pop(relative_path, [0])[0]
+            if not self.active:
+                self.screen.clear()  # Error messages follow.
+
+    def write(self, line):
+        """Print a line without garbling the status line.
+
+        :param str line: Line to print without trailing newline.
+        """
+        with self.lock:
+            self.write_line(line)
+
+    def write_line(self, line):
+        """Print a line while holding the lock, keeping the status line below it on a TTY.
+
+        :param str line: Line to print without trailing newline.
+        """
+        self.screen.clear()
+        self.screen.stream.write(line + '\n')
+        if self.screen.tty and self.active:
+            self.screen.draw(self.status(time.time()))
+        self.screen.stream.flush()
+
+    def status(self, now):
+        """Build the status line.
+
+        :param float now: Current time.
+
+        :return: Status line.
+        :rtype: str
+        """
+        received, total_size = self.counts['received'], self.counts['size']
+        rate = received / max(now - self.started, 0.001)
+        remaining = max(total_size - received, 0)
+        eta = '{0}:{1:02d}'.format(*divmod(int(remaining / rate), 60)) if rate else '?'
+        percent = 100 * received // total_size if total_size else 100
+        line = '{0}/{1} files, {2} of {3} ({4}%), {5}/s, ETA {6}'.format(
+            self.counts['finished'], self.counts['files'], format_size(received), format_size(total_size), percent,
+            format_size(rate), eta,
+        )
+        files = sorted(self.active.items())
+        for relative_path, (file_received, size) in files[:3]:
+            line += ' | {0} {1}%'.format(os.path.basename(relative_path), 100 * file_received // size if size else 100)
+        if len(files) > 3:
+            line += ' | +{0} more'.format(len(files) - 3)
+        return line
+
+    def close(self):
+        """Erase the status line before other output follows."""
+        with self.lock:
+            self.screen.clear()
+            self.screen.stream.flush()
+
+
+def iter_blocks(response, buffer):
+    """Read a streamed response body into one reused buffer instead of allocating a new bytes object per chunk.
+
+    Content-encoded responses are decoded by requests and yielded as new objects, as their decoded size is unknown.
+
+    :raise requests.ConnectionError: On network errors, same as Response.iter_content().
+
+    :param requests.Response response: Streamed response.
+    :param bytearray buffer: Reused buffer, its size is the I/O block size.
+
+    :return: Memoryviews of the received bytes, only valid until the next iteration.
+    :rtype: iter
+    """
+    if response.headers.get('Content-Encoding', 'identity') != 'identity':
+        for chunk in response.iter_content(len(buffer)):
+            yield memoryview(chunk)
+        return
+    view = memoryview(buffer)
+    try:
+        while True:
+            size = response.raw.readinto(view)
+            if not size:
+                return
+            yield view[:size]
+    except ProtocolError as exc:
+        raise requests.exceptions.ChunkedEncodingError(exc)
+    except DecodeError as exc:
+        raise requests.exceptions.ContentDecodingError(exc)
+    except ReadTimeoutError as exc:
+        raise requests.ConnectionError(exc)
+
+
+def preallocate(path, size):
+    """Create a file reserving disk space for all of it up front so it isn't fragmented and a full disk fails early.
+
+    Uses posix_fallocate() where available, otherwise extends the file without reserving blocks.
+
+    :param str path: File to create or truncate.
+    :param int size: File size in bytes.
+    """
+    fallocate = getattr(os, 'posix_fallocate', None)
+    with open(path, 'wb') as handle:
+        if fallocate is not None and size:
+            try:
+                fallocate(handle.fileno(), 0, size)
+                return
+            except OSError:  # Not supported by the filesystem.
+                pass
+        handle.truncate(size)
+
+
+def split_ranges(size, segments):
+    """Split a file into byte ranges of about the same size.
+
+    :param int size: File size in bytes.
+    :param int segments: Number of ranges.
+
+    :return: First and last byte of every range.
+    :rtype: list
+    """
+    length = -(-size // segments)  # Round up.
+    return [(start, min(start + length, size) - 1) for start in range(0, size, length)]
+
+
+def range_headers(start, end=None, etag=''):
+    """Build headers requesting a byte range, which servers only honor if the file still has the same ETag.
+
+    :param int start: First byte.
+    :param int end: Last byte, None for the rest of the file.
+    :param str etag: ETag of the file on the server, if any.
+
+    :return: Request headers.
+    :rtype: dict
+    """
+    headers = dict(Range='bytes={0}-{1}'.format(start, '' if end is None else end))
+    if etag:
+        headers['If-Range'] = etag
+    return headers
+
+
+def wait_to_resume(attempt, part_path, log):
+    """Sleep before resuming an interrupted download, unless it must not be retried.
+
+    :raise HandledError: If the download must not be retried.
+
+    :param int attempt: Zero-based number of the attempt that was interrupted.
+    :param str part_path: Partially downloaded file.
+    :param logging.Logger log: Logger of the caller.
+    """
+    session = get_session()
+    if session.exhausted(attempt):
+        log.error('Download interrupted, run again to resume: %s', part_path)
+        raise HandledError
+    delay = retry_delay(attempt)
+    log.warning('Download interrupted, resuming in %.1f seconds...', delay)
+    session.wait(delay)
+
+
+def write_blocks(handle, blocks, mangler, digest, progress):
+    """Write received blocks to a file, substituting coverage paths and hashing the written bytes on the way.
+
+    :param file handle: File opened for writing.
+    :param iter blocks: Memoryviews from iter_blocks().
+    :param CoverageMangler mangler: Substitutes coverage paths in blocks, None writes them unchanged.
+    :param digest: hashlib object updated with the written bytes, None to skip hashing.
+    :param function progress: Called with the number of bytes of every block.
+    """
+    for block in blocks:
+        data = mangler.feed(block.tobytes()) if mangler else block
+        handle.write(data)
+        if digest:
+            digest.update(data)
+        progress(len(block))
+    if mangler:
+        data = mangler.flush()
+        handle.write(data)
+        if digest:
+            digest.update(data)
+
+
+@with_log
+def download_stream(part_path, url, expected_size, log, progress, mangle=None):
+    """Download a file in a single HTTP stream, resuming a previous partial download of the same file.
+
+    With `mangle` coverage paths are substituted as the bytes arrive so the file is written once, already mangled.
+    Only done for downloads starting from the first byte, resumed downloads are mangled afterwards by the caller.
+
+    :raise HandledError: On HTTP errors or if the download was interrupted too many times.
+
+    :param str part_path: Partially downloaded file to write to.
+    :param str url: URL of the file to download.
+    :param int expected_size: Expected file size in bytes.
+    :param logging.Logger log: Logger for this function. Populated by with_log() decorator.
+    :param function progress: Called with the number of bytes of every block read, IO_BLOCK bytes at most.
+    :param str mangle: --path-map value if coverage paths are to be substituted while downloading, else None.
+
+    :return: CoverageMangler used while downloading if any (first), SHA-256 hex digest of the written bytes unless
+        resumed (second).
+    :rtype: tuple
+    """
+    session = get_session()
+    mangler = digest = None
+    buffer = bytearray(max(min(IO_BLOCK, expected_size), 1))
+    for attempt in range(session.attempts):
+        offset, etag = read_part_state(part_path, url, expected_size)
+        if offset and offset == expected_size:
+            log.debug('Already downloaded: %s', part_path)
+            return None, None
+        try:
+            response = session.get(url, headers=range_headers(offset, etag=etag) if offset else dict(), stream=True,
+                                   timeout=DOWNLOAD_TIMEOUT)
+            if not response.ok:
+                log.error('HTTP %d: %s', response.status_code, url)
+                raise HandledError
+            if offset and response.status_code == 206:
+                log.debug('Resuming %s at byte %d.', part_path, offset)
+            else:
+                offset = 0
+            mangler = None if offset or mangle is None else CoverageMangler(mangle, log)
+            digest = None if offset else hashlib.sha256()
+            write_part_state(part_path, url, expected_size, response.headers.get('ETag', ''), mangled=bool(mangler))
+            log.debug('Writing to: %s', part_path)
+            with open(part_path, 'ab' if offset else 'wb') as handle:
+                write_blocks(handle, iter_blocks(response, buffer), mangler, digest, progress)
+        except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError):
+            wait_to_resume(attempt, part_path, log)
+        else:
+            return mangler, digest.hexdigest() if digest else None
+    log.error('Download interrupted, run again to resume: %s', part_path)  # wait_to_resume() raises before this.
+    raise HandledError
+
+
+@with_log
+def download_range(part_path, url, etag, task, log, progress, abort):
+    """Download one byte range of download_segments() and write it at its offset.
+
+    :raise HandledError: On HTTP errors, if the range download was interrupted too many times, or once abort is set.
+
+    :param str part_path: Preallocated .part file to write to.
+    :param str url: URL of the file to download.
+    :param str etag: ETag of the file on the server, if any.
+    :param tuple task: First and last byte of the range, and an already opened response or None.
+    :param logging.Logger log: Logger for this function. Populated by with_log() decorator.
+    :param function progress: Called with the number of bytes of every block read.
+    :param threading.Event abort: Set when another range failed.
+    """
+    start, end, response = task
+    position = start
+    buffer = bytearray(min(IO_BLOCK, end + 1 - start))
+    for attempt in range(get_session().attempts):
+        try:
+            if response is None:
+                response = get_session().get(url, headers=range_headers(position, end, etag), stream=True,
+                                             timeout=DOWNLOAD_TIMEOUT)
+                if response.status_code != 206:
+                    log.error('HTTP %d instead of 206 for bytes %d-%d of %s', response.status_code, position, end, url)
+                    raise HandledError
+            with open(part_path, 'r+b') as handle:
+                handle.seek(position)
+                for block in iter_blocks(response, buffer):
+                    if abort.is_set():
+                        raise HandledError
+                    handle.write(block)
+                    position += len(block)
+                    progress(len(block))
+        except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError):
+            response = None
+            wait_to_resume(attempt, part_path, log)
+        else:
+            break
+    if position != end + 1:
+        log.error('Expected %d bytes but got %d bytes instead.', end + 1 - start, position - start)
+        raise HandledError
+
+
+@with_log
+def download_segments(part_path, url, expected_size, segments, log, progress):
+    """Download a large file in parallel byte ranges over pooled connections.
+
+    Every range is written at its own offset of a preallocated .part file. Completed ranges are remembered in the .part
+    state file, so interrupted downloads only fetch missing ranges later.
+
+    :raise HandledError: On HTTP errors or if the probe or a range download was interrupted too many times.
+
+    :param str part_path: Partially downloaded file to write to.
+    :param str url: URL of the file to download.
+    :param int expected_size: Expected file size in bytes.
+    :param int segments: Number of byte ranges to download in parallel.
+    :param logging.Logger log: Logger for this function. Populated by with_log() decorator.
+    :param function progress: Called with the number of bytes of every block read, by every thread.
+
+    :return: False if the server doesn't honor Range requests and nothing was downloaded.
+    :rtype: bool
+    """
+    ranges = split_ranges(expected_size, segments)
+
+    # Resume or preallocate.
+    done, etag = read_segments_state(part_path, url, expected_size)
+    if not done:
+        preallocate(part_path, expected_size)
+    pending = [r for r in ranges if r[0] not in done]
+    if not pending:
+        log.debug('Already downloaded: %s', part_path)
+        return True
+
+    # Probe Range support with the first pending range.
+    response = get_session().get_with_retries(url, log, headers=range_headers(*pending[0], etag=etag), stream=True,
+                                              timeout=DOWNLOAD_TIMEOUT)
+    if response.status_code != 206:
+        response.close()
+        log.debug('Server did not honor Range request (HTTP %d), using a single stream.', response.status_code)
+        return False
+    etag = etag or response.headers.get('ETag', '')
+    log.debug('Downloading %d of %d ranges of %s in parallel.', len(pending), len(ranges), part_path)
+    abort = threading.Event()
+    lock = threading.Lock()
+
+    def fetch(task):
+        """Download one byte range and remember it as done.
+
+        :param tuple task: Passed to download_range().
+        """
+        download_range(part_path, url, etag, task, progress=progress, abort=abort)
+        with lock:
+            done.add(task[0])
+            write_part_state(part_path, url, expected_size, etag, done=sorted(done))
+
+    pool = multiprocessing.pool.ThreadPool(min(segments, len(pending)))
+    try:
+        for _ in pool.imap_unordered(fetch, [pending[0] + (response,)] + [r + (None,) for r in pending[1:]]):
+            pass
+    except BaseException:
+        abort.set()
+        raise
+    finally:
+        pool.close()
+        pool.join()
+    return True
+
+
+def prepare_local_path(local_path, url, expected_size, sync, log):
+    """Create the directory of a download and remove an outdated file in the way. Called by download_file().
+
+    :raise HandledError: If local_path exists and sync is None.
+
+    :param str local_path: Destination path to save file to.
+    :param str url: URL of the file to download.
+    :param int expected_size: Expected file size in bytes.
+    :param SyncState sync: Passed to download_file().
+    :param logging.Logger log: Logger of download_file().
+
+    :return: False if local_path is up to date and needs no download.
+    :rtype: bool
+    """
+    if not os.path.exists(os.path.dirname(local_path)):
+        log.debug('Creating directory: %s', os.path.dirname(local_path))
+        try:
+            os.makedirs(os.path.dirname(local_path))
+        except OSError:
+            if not os.path.isdir(os.path.dirname(local_path)):  # Created by another thread in the meantime.
+                raise
+    if os.path.exists(local_path):
+        if sync is None:
+            log.error('File already exists: %s', local_path)
+            raise HandledError
+        if sync.up_to_date(local_path, url, expected_size):
+            return False
+        os.remove(local_path)
+    return True
+
+
+def download_part(config, part_path, url, expected_size, progress, path_map):
+    """Download a file into its .part file, in parallel byte ranges if it's larger than --split-above.
+
+    :param dict config: Dictionary from get_arguments().
+    :param str part_path: Partially downloaded file to write to.
+    :param str url: URL of the file to download.
+    :param int expected_size: Expected file size in bytes.
+    :param function progress: Called with the number of bytes of every block read.
+    :param str path_map: Passed to download_stream() as `mangle`.
+
+    :return: Same as download_stream(), (None, None) if downloaded in byte ranges.
+    :rtype: tuple
+    """
+    split_above = int(config.get('split_above') or 0)
+    segments = int(config.get('segments') or SEGMENTS)
+    if split_above and segments > 1 and expected_size > split_above and \
+            download_segments(part_path, url, expected_size, segments, progress=progress):
+        return None, None
+    return download_stream(part_path, url, expected_size, progress=progress, mangle=path_map)
+
+
+def check_part(part_path, expected_size, mangler, discard, log):
+    """Check the size of a downloaded .part file and that coverage source files exist. Called by download_file().
+
+    :raise HandledError: On unexpected file size or missing coverage source files.
+
+    :param str part_path: Downloaded file.
+    :param int expected_size: Expected file size in bytes.
+    :param CoverageMangler mangler: Returned by download_stream(), if any.
+    :param function discard: Stops showing the download in progress before errors are logged.
+    :param logging.Logger log: Logger of download_file().
+
+    :return: Number of bytes downloaded.
+    :rtype: int
+    """
+    file_size = mangler.received if mangler else os.path.getsize(part_path)
+    log.debug('Downloaded %s: %d bytes', part_path, file_size)
+    if file_size != expected_size:
+        discard()
+        log.error('Expected %d bytes but got %d bytes instead.', expected_size, file_size)
+        if file_size > expected_size or mangler:
+            remove_part(part_path)  # Can't be resumed.
+        raise HandledError
+    if mangler:
+        try:
+            mangler.report_missing()
+        except HandledError:
+            discard()
+            remove_part(part_path)
+            raise
+    return file_size
+
+
+@with_log
+def download_file(config, local_path, url, expected_size, log, progress=None, mangle=None, sync=None):
+    """Download a file.
+
+    Data is written to a .part file which is renamed to local_path once complete. Interrupted downloads are resumed
+    with HTTP Range requests, both within this run and by later runs.
+
+    :raise HandledError: On HTTP errors, existing local_path, unexpected file size, or missing coverage source files.
+
+    :param dict config: Dictionary from get_arguments().
+    :param str local_path: Destination path to save file to.
     :param str url: URL of the file to download.
     :param int expected_size: Expected file size in bytes.
-    :param int chunk_size: Number of bytes to read in memory before writing to disk and printing a dot.
     :param logging.Logger log: Logger for this function. Populated by with_log() decorator.
+    :param Progress progress: Shared progress display of all downloads. None shows progress of this file only.
+    :param function mangle: Substitute Windows paths in .coverage files while downloading. Called with local_path
+        afterwards if that wasn't possible (e.g. SQLite files or resumed downloads). None disables mangling.
+    :param SyncState sync: Skip local_path if it's up to date and replace it otherwise. None fails if it exists.
+
+    :return: SHA-256 hex digest of local_path if hashed while downloading, None if it wasn't (e.g. skipped, resumed,
+        downloaded in segments, or mangled afterwards).
+    :rtype: str
+    """
+    progress = progress or Progress(expected_size, 1)
+    relative_path = os.path.relpath(local_path, config['dir'] or os.getcwd())
+    if not prepare_local_path(local_path, url, expected_size, sync, log):
+        progress.done(relative_path, expected_size, 'up to date')
+        return None
+
+    # Use the artifact cache if possible.
+    cache_entry = artifact_cache_path(config, url, expected_size)
+    if cache_entry and artifact_cache_load(cache_entry, local_path, expected_size):
+        progress.done(relative_path, expected_size, 'cached')
+        if sync is not None:
+            sync.record(local_path, url, expected_size)
+        if mangle is not None:
+            mangle(local_path)
+        return None
+
+    # Download file into a .part file.
+    part_path = local_path + PART_SUFFIX
+    path_map = None if mangle is None or cache_entry else config.get('path_map') or ''  # Cache unmangled.
+    progress.start(relative_path, expected_size)
+    try:
+        mangler, digest = download_part(config, part_path, url, expected_size,
+                                        functools.partial(progress.update, relative_path), path_map)
+    except BaseException:
+        progress.discard(relative_path)
+        raise
+    file_size = check_part(part_path, expected_size, mangler, functools.partial(progress.discard, relative_path), log)
+    if mangler and mangler.has_duplicates():
+        combine_json([part_path], part_path)
+        digest = None  # Hashed later by write_checksums().
+
+    # Complete, move into place.
+    replace_file(part_path, local_path)
+    remove_part(part_path)
+    progress.done(relative_path, file_size)
+    if cache_entry:
+        artifact_cache_save(config, cache_entry, local_path)
+    if sync is not None:
+        sync.record(local_path, url, expected_size)
+    if mangle is not None and (mangler is None or mangler.sqlite):
+        mangle(local_path)
+        return None
+    return digest
+
+
+@with_log
+def download_files(config, downloads, jobs, log, progress=None, mangle=None, sync=None, digests=None):
+    """Download files concurrently with a bounded pool of threads.
+
+    Stops at the first failed download.
+
+    :raise HandledError: On the first failed download.
+
+    :param dict config: Dictionary from get_arguments().
+    :param iter downloads: List of tuples: (expected file size, destination path, URL).
+    :param int jobs: Number of worker threads.
+    :param logging.Logger log: Logger for this function. Populated by with_log() decorator.
+    :param Progress progress: Shared progress display. None creates one for these downloads.
+    :param function mangle: Passed to download_file().
+    :param SyncState sync: Passed to download_file().
+    :param dict digests: Populated with return values of download_file() keyed by local path.
+    """
+    own_progress = progress is None
+    if own_progress:
+        progress = Progress(sum(d[0] for d in downloads), len(downloads))
+
+    def worker(download):
+        """Download one file and optionally mangle it.
+
+        :param tuple download: Expected file size, destination path, and URL.
+        """
+        size, local_path, url = download
+        if progress.abort.is_set():
+            return
+        digest = download_file(config, local_path, url, size, progress=progress, mangle=mangle, sync=sync)
+        if digests is not None:
+            digests[local_path] = digest
+
+    # Largest files first so the slowest transfer doesn't start last.
+    log.debug('Downloading %d files with %d threads.', len(downloads), jobs)
+    pool = multiprocessing.pool.ThreadPool(min(jobs, len(downloads)))
+    try:
+        for _ in pool.imap_unordered(worker, sorted(downloads, reverse=True)):
+            pass
+    except BaseException:
+        progress.abort.set()
+        raise
+    finally:
+        pool.close()
+        pool.join()
+        if own_progress:
+            progress.close()
+
+
+class PathMap(object):
+    """Rules rewriting Windows path prefixes from AppVeyor to local directories, like coverage.py's [paths] setting.
+
+    All prefixes are compiled into one combined regex per format, raw for SQLite .coverage files and JSON escaped for
+    legacy ones, so matching doesn't slow down with more rules. The first matching rule wins.
+    """
+
+    def __init__(self, value=''):
+        """Constructor.
+
+        :raise ValueError: On invalid rules.
+
+        :param str value: --path-map value, PREFIX[,PREFIX...]=ROOT rules separated by semicolons.
+        """
+        self.rules = list()
+        for rule in (value or DEFAULT_PATH_MAP).split(';'):
+            prefixes, equals, root = rule.strip().rpartition('=')
+            if not equals or not root or not all(p.strip() for p in prefixes.split(',')):
+                raise ValueError(rule)
+            self.rules.extend((p.strip(), root) for p in prefixes.split(','))
+        raw = '|'.join('({0})'.format(self.pattern(p, r'[\\/]', r'[^\\/]+')) for p, _ in self.rules)
+        escaped = '|'.join(self.pattern(p, r'(?:\\\\|/)', r'[^\\/"]+') for p, _ in self.rules)
+        self.regex_raw = re.compile(raw, re.IGNORECASE)
+        self.regex_json = re.compile(  # http://stackoverflow.com/a/17089058/1198943
+            '"((?:{0})(?:(?!":\\[).)+)'.format(escaped).encode('utf-8'), re.IGNORECASE
+        )
+
+    @staticmethod
+    def pattern(prefix, separator, wildcard):
+        """Convert one prefix to a regex pattern without capture groups.
+
+        :param str prefix: Windows path prefix, optionally with "*" wildcards.
+        :param str separator: Pattern matching a path separator.
+        :param str wildcard: Pattern matching one directory name.
+
+        :return: Regex pattern.
+        :rtype: str
+        """
+        tokens = [t for t in re.split(r'([\\/*])', prefix.rstrip('\\/') + '\\') if t]
+        return ''.join(separator if t in '\\/' else wildcard if t == '*' else re.escape(t) for t in tokens)
+
+    def split(self, windows_path):
+        """Split a Windows path into the local root of the first matching rule and the rest of the path.
+
+        :param str windows_path: Windows path with single backslashes.
+
+        :return: Local root (first) and Unix relative path below it (second), or None if no rule matches.
+        :rtype: tuple
+        """
+        match = self.regex_raw.match(windows_path)
+        if not match:
+            return None
+        return self.rules[match.lastindex - 1][1], windows_path[match.end():].replace('\\', '/')
+
+
+class PathIndex(object):
+    """Resolves Windows paths from .coverage files to local files for the whole run.
+
+    Each local directory is listed once with os.scandir() instead of calling os.path.isfile() for every path, and
+    resolved paths are memoized across all coverage files. Only paths missing from a listing are stat()ed. Safe to use
+    from multiple threads.
+    """
+
+    def __init__(self, path_map='', root=None):
+        """Constructor.
+
+        :param str path_map: --path-map value.
+        :param str root: Directory relative paths are resolved against. Defaults to the current working directory.
+        """
+        self.path_map = PathMap(path_map)
+        self.path_map_value = path_map
+        self.root = root or os.getcwd()
+        self.listings = dict()
+        self.resolved = dict()
+        self.lock = threading.Lock()
+
+    def listing(self, directory):
+        """Get names of files in a directory, listing it only once.
+
+        :param str directory: Absolute directory path.
+
+        :return: File names, empty if the directory doesn't exist.
+        :rtype: frozenset
+        """
+        if directory not in self.listings:
+            try:
+                if hasattr(os, 'scandir'):
+                    names = frozenset(e.name for e in os.scandir(directory) if e.is_file())
+                else:  # Python 2.7.
+                    names = frozenset(n for n in os.listdir(directory) if os.path.isfile(os.path.join(directory, n)))
+            except OSError:
+                names = frozenset()
+            self.listings[directory] = names
+        return self.listings[directory]
+
+    def resolve(self, windows_path):
+        """Get the Unix path for a Windows path.
+
+        :param str windows_path: Windows path with single backslashes.
+
+        :return: Unix relative path (first), Unix absolute path (second), and if the file exists (third).
+        :rtype: tuple
+        """
+        with self.lock:
+            if windows_path not in self.resolved:
+                local_root, unix_relative_path = self.path_map.split(windows_path)
+                unix_absolute_path = os.path.normpath(os.path.join(self.root, local_root, unix_relative_path))
+                directory, name = os.path.split(unix_absolute_path)
+                exists = name in self.listing(directory) or os.path.isfile(unix_absolute_path)  # Created since listed.
+                if not exists:
+                    return unix_relative_path, unix_absolute_path, False  # Not memoized, may be created later.
+                self.resolved[windows_path] = (unix_relative_path, unix_absolute_path, True)
+            return self.resolved[windows_path]
+
+
+def get_path_index(path_map=''):
+    """Get the shared PathIndex for the current working directory, creating a new one if it or path_map changed.
+
+    :param str path_map: --path-map value.
+
+    :return: Shared path index.
+    :rtype: PathIndex
+    """
+    global PATH_INDEX  # pylint: disable=global-statement
+    if PATH_INDEX is None or PATH_INDEX.root != os.getcwd() or PATH_INDEX.path_map_value != path_map:
+        PATH_INDEX = PathIndex(path_map)
+    return PATH_INDEX
+
+
+def seed_path_index(path_map, root, listings, resolved):
+    """Install a shared PathIndex holding another process' directory listings and resolved paths.
+
+    Pool initializer of MangleQueue worker processes, so they start from the run-wide index of the parent.
+
+    :param str path_map: --path-map value.
+    :param str root: Directory relative paths are resolved against.
+    :param dict listings: PathIndex.listings of the parent.
+    :param dict resolved: PathIndex.resolved of the parent.
+    """
+    global PATH_INDEX  # pylint: disable=global-statement
+    PATH_INDEX = PathIndex(path_map, root)
+    PATH_INDEX.listings.update(listings)
+    PATH_INDEX.resolved.update(resolved)
+
+
+def mangle_cut(buffer):
+    """Find where a buffer of .coverage file contents can be cut without splitting a PathMap.regex_json match.
+
+    Matches never span the ":[ after a file name or a newline, so everything before the last one is safe to substitute.
+
+    :param bytes buffer: File contents read so far and not substituted yet.
+
+    :return: Number of leading bytes safe to substitute, 0 if none.
+    :rtype: int
+    """
+    return max(buffer.rfind(b'":['), buffer.rfind(b'\n'), 0)
+
+
+class CoverageMangler(object):
+    """Substitutes Windows file paths to Linux paths in a stream of .coverage file contents.
+
+    Fed chunk by chunk, either from disk by mangle_coverage() or straight from the network by download_stream(). Only
+    legacy JSON files are rewritten, which is sniffed from the first bytes. Anything else passes through unchanged.
+    """
+
+    def __init__(self, path_map, log):
+        """Constructor.
+
+        :param str path_map: --path-map value.
+        :param logging.Logger log: Logger to report missing files to.
+        """
+        self.index = get_path_index(path_map)
+        self.log = log
+        self.buffer = b''
+        self.format = None  # "json", "sqlite" or "other", unknown until the header arrived.
+        self.mapping = dict()
+        self.missing = dict()
+        self.received = 0
+
+    @property
+    def path_map(self):
+        """PathMap of the shared path index."""
+        return self.index.path_map
+
+    @property
+    def sqlite(self):
+        """True if the contents are a SQLite .coverage file, which can't be substituted as a stream."""
+        return self.format == 'sqlite'
+
+    @staticmethod
+    def sniff(header):
+        """Determine the file format from the first bytes.
+
+        :param bytes header: First 16 bytes of the file, or all of it if shorter.
+
+        :return: "json" for legacy .coverage files, "sqlite" for SQLite files, "other" otherwise.
+        :rtype: str
+        """
+        if header.startswith(b'!coverage.py:'):
+            return 'json'
+        return 'sqlite' if header.startswith(SQLITE_HEADER) else 'other'
+
+    def resolve(self, windows_path):
+        """Return the Unix path for a Windows path, remembering missing files.
+
+        :param str windows_path: Windows path with single backslashes.
+
+        :return: Unix absolute path, None if missing.
+        :rtype: str
+        """
+        unix_relative_path, unix_absolute_path, exists = self.index.resolve(windows_path)
+        if not exists:
+            self.missing[windows_path] = (unix_relative_path, unix_absolute_path)
+            return None
+        self.mapping[windows_path] = unix_absolute_path
+        return unix_absolute_path
+
+    def has_duplicates(self):
+        """Check if different Windows paths were substituted with the same Unix path, e.g. by two --path-map prefixes.
+
+        Their JSON keys are duplicated then and have to be merged by combine_json().
+
+        :return: True if any Unix path was substituted for more than one Windows path.
+        :rtype: bool
+        """
+        return len(set(self.mapping.values())) < len(self.mapping)
+
+    def substitute(self, match):
+        """Return the Unix path for one Windows path match.
+
+        :param match: PathMap.regex_json match object.
+
+        :return: Replacement bytes.
+        :rtype: bytes
+        """
+        unix_absolute_path = self.resolve(match.group(1).decode('utf-8').replace(r'\\', '\\'))
+        return match.group(0) if unix_absolute_path is None else b'"' + unix_absolute_path.encode('utf-8')
+
+    def feed(self, chunk):
+        """Substitute paths in the next chunk, carrying over the tail which may hold part of a path.
+
+        :param bytes chunk: Next chunk of file contents.
+
+        :return: Bytes to write.
+        :rtype: bytes
+        """
+        self.received += len(chunk)
+        self.buffer += chunk
+        if self.format is None:
+            if len(self.buffer) < 16:
+                return b''
+            self.format = self.sniff(self.buffer)
+        if self.format != 'json':
+            data, self.buffer = self.buffer, b''
+            return data
+        cut = mangle_cut(self.buffer)
+        data, self.buffer = self.path_map.regex_json.sub(self.substitute, self.buffer[:cut]), self.buffer[cut:]
+        return data
+
+    def flush(self):
+        """Substitute paths in the remaining tail.
+
+        :return: Bytes to write.
+        :rtype: bytes
+        """
+        data, self.buffer = self.buffer, b''
+        if self.format is None:  # Shorter than the header.
+            self.format = self.sniff(data)
+        return self.path_map.regex_json.sub(self.substitute, data) if self.format == 'json' else data
+
+    def report_missing(self):
+        """Log every missing file at once.
+
+        :raise HandledError: If any file is missing.
+        """
+        if not self.missing:
+            return
+        for windows_path, (unix_relative_path, unix_absolute_path) in sorted(self.missing.items()):
+            self.log.debug('Windows path: %s', windows_path)
+            self.log.debug('Unix relative path: %s', unix_relative_path)
+            self.log.error('No such file: %s', unix_absolute_path)
+        raise HandledError
+
+
+def update_file_paths(connection, rows, updates):
+    """Set new paths in the "file" table of a coverage.py database. Called by mangle_coverage_sqlite().
+
+    A file whose new path is taken already, e.g. by two --path-map prefixes for the same directory, is merged into the
+    file with that path: line numbits are combined with numbits_union(), arcs and tracers are moved over.
+
+    :param sqlite3.Connection connection: Database connection within a transaction.
+    :param list rows: IDs and paths of all files in the "file" table.
+    :param list updates: New paths and IDs of the files to rewrite.
+    """
+    statements = (  # Merge file :merged into file :into.
+        'INSERT INTO line_bits (file_id, context_id, numbits) '
+        'SELECT :into, context_id, numbits FROM line_bits WHERE file_id = :merged '
+        'ON CONFLICT (file_id, context_id) DO UPDATE SET numbits = numbits_union(numbits, excluded.numbits)',
+        'INSERT OR IGNORE INTO arc (file_id, context_id, fromno, tono) '
+        'SELECT :into, context_id, fromno, tono FROM arc WHERE file_id = :merged',
+        'INSERT OR IGNORE INTO tracer (file_id, tracer) SELECT :into, tracer FROM tracer WHERE file_id = :merged',
+        'DELETE FROM line_bits WHERE file_id = :merged',
+        'DELETE FROM arc WHERE file_id = :merged',
+        'DELETE FROM tracer WHERE file_id = :merged',
+        'DELETE FROM file WHERE id = :merged',
+    )
+    updated = set(u[1] for u in updates)
+    file_ids = dict((path, file_id) for file_id, path in rows if file_id not in updated)
+    connection.create_function('numbits_union', 2, numbits_union)
+    for path, file_id in updates:
+        if path in file_ids:
+            for statement in statements:
+                connection.execute(statement, dict(into=file_ids[path], merged=file_id))
+        else:
+            file_ids[path] = file_id
+            connection.execute('UPDATE file SET path = ? WHERE id = ?', (path, file_id))
+
+
+@with_log
+def mangle_coverage_sqlite(local_path, resolve, path_map, log):
+    """Edit a SQLite .coverage file (coverage.py 5.0+) in place substituting Windows file paths to Linux paths.
+
+    Only the "file" table is rewritten, in a single transaction with update_file_paths(). Hard links are broken first
+    so other links to the file keep the original contents.
+
+    :raise HandledError: On database errors.
+
+    :param str local_path: Destination path to save file to.
+    :param function resolve: Returns the Linux path for a Windows path, None if missing. Reported by the caller.
+    :param PathMap path_map: Rules selecting which paths to rewrite.
+    :param logging.Logger log: Logger for this function. Populated by with_log() decorator.
+
+    :return: If local_path is a coverage.py database.
+    :rtype: bool
     """
-    if not os.path.exists(os.path.dirname(local_path)):
-        log.debug('Creating directory: %s', os.path.dirname(local_path))
-        os.makedirs(os.path.dirname(local_path))
-    if os.path.exists(local_path):
-        log.error('File already exists: %s', local_path)
+    connection = sqlite3.connect(local_path)
+    try:
+        query = "SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name IN ('coverage_schema', 'file')"
+        if connection.execute(query).fetchone()[0] != 2:
+            return False
+        rows = connection.execute('SELECT id, path FROM file').fetchall()
+    except sqlite3.DatabaseError as exc:
+        log.error('Unable to read %s: %s', local_path, exc)
         raise HandledError
-    relative_path = os.path.relpath(local_path, config['dir'] or os.getcwd())
-    print(' => {0}'.format(relative_path), end=' ', file=sys.stderr)
-
-    # Download file.
-    log.debug('Writing to: %s', local_path)
-    with open(local_path, 'wb') as handle:
-        response = requests.get(url, stream=True)
-        for chunk in response.iter_content(chunk_size):
-            handle.write(chunk)
-            print('.', end='', file=sys.stderr)
-
-    file_size = os.path.getsize(local_path)
-    print(' {0} bytes'.format(file_size), file=sys.stderr)
-    if file_size != expected_size:
-        log.error('Expected %d bytes but got %d bytes instead.', expected_size, file_size)
+    finally:
+        connection.close()
+
+    # Resolve every path before writing anything so missing files leave the database untouched.
+    updates = [(resolve(path), file_id) for file_id, path in rows if path_map.regex_raw.match(path)]
+    if not updates or any(u[0] is None for u in updates):
+        return True
+
+    # Break hard links.
+    if os.stat(local_path).st_nlink > 1:
+        handle, temp_path = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(os.path.abspath(local_path)))
+        os.close(handle)
+        shutil.copy2(local_path, temp_path)
+        replace_file(temp_path, local_path)
+
+    # Update paths in one transaction.
+    connection = sqlite3.connect(local_path)
+    try:
+        with connection:
+            update_file_paths(connection, rows, updates)
+    except sqlite3.DatabaseError as exc:
+        log.error('Unable to update %s: %s', local_path, exc)
         raise HandledError
+    finally:
+        connection.close()
+    return True
 
 
 @with_log
-def mangle_coverage(local_path, log):
+def mangle_coverage(local_path, log, path_map=''):
     """Edit .coverage file substituting Windows file paths to Linux paths.
 
+    Legacy JSON files are streamed in MANGLE_CHUNK sized pieces to a temporary file which then atomically replaces the
+    original, so memory use doesn't depend on the file size and the original is left untouched on errors. SQLite files
+    are updated in place by mangle_coverage_sqlite().
+
+    :raise HandledError: When source files are missing locally, all of them are logged first.
+
     :param str local_path: Destination path to save file to.
     :param logging.Logger log: Logger for this function. Populated by with_log() decorator.
+    :param str path_map: --path-map value.
     """
-    # Read the file, or return if not a .coverage file.
     with open(local_path, mode='rb') as handle:
-        if handle.read(13) != b'!coverage.py:':
-            log.debug('File %s not a coverage file.', local_path)
-            return
-        handle.seek(0)
-
-        # I'm lazy, reading all of this into memory. What could possibly go wrong?
-        file_contents = handle.read(52428800).decode('utf-8')  # 50 MiB limit, surely this is enough?
-
-    # Substitute paths.
-    for windows_path in set(REGEX_MANGLE.findall(file_contents)):
-        unix_relative_path = windows_path.replace(r'\\', '/').split('/', 3)[-1]
-        unix_absolute_path = os.path.abspath(unix_relative_path)
-        if not os.path.isfile(unix_absolute_path):
-            log.debug('Windows path: %s', windows_path)
-            log.debug('Unix relative path: %s', unix_relative_path)
-            log.error('No such file: %s', unix_absolute_path)
+        header = handle.read(16)
+    mangler = CoverageMangler(path_map, log)
+
+    # Return if not a .coverage file.
+    if header == SQLITE_HEADER and mangle_coverage_sqlite(local_path, mangler.resolve, mangler.path_map):
+        mangler.report_missing()
+        log.debug('Substituted %d path(s) in %s', len(mangler.mapping), local_path)
+        return
+    if not header.startswith(b'!coverage.py:'):
+        log.debug('File %s not a coverage file.', local_path)
+        return
+
+    # Substitute paths chunk by chunk.
+    handle, temp_path = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(os.path.abspath(local_path)))
+    try:
+        with open(local_path, mode='rb') as source, os.fdopen(handle, 'wb') as destination:
+            for chunk in iter(functools.partial(source.read, MANGLE_CHUNK), b''):
+                destination.write(mangler.feed(chunk))
+            destination.write(mangler.flush())
+        mangler.report_missing()
+        if mangler.has_duplicates():
+            combine_json([temp_path], temp_path)
+        shutil.copymode(local_path, temp_path)
+        replace_file(temp_path, local_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    log.debug('Substituted %d path(s) in %s', len(mangler.mapping), local_path)
+
+
+@with_log
+def measure_throughput(url, log):
+    """Measure download throughput by downloading the first PLAN_PROBE_SIZE bytes of a file.
+
+    :param str url: URL of the file to download.
+    :param logging.Logger log: Logger for this function. Populated by with_log() decorator.
+
+    :return: Bytes per second, None if unknown.
+    :rtype: float
+    """
+    received, start = 0, time.time()
+    try:
+        response = get_session().get(url, headers=dict(Range='bytes=0-{0}'.format(PLAN_PROBE_SIZE - 1)), stream=True,
+                                     timeout=DOWNLOAD_TIMEOUT)
+        if response.ok:
+            for chunk in response.iter_content(65536):
+                received += len(chunk)
+                if received >= PLAN_PROBE_SIZE:
+                    break
+        response.close()
+    except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError) as exc:
+        log.warning('Unable to measure throughput: %s', exc)
+        return None
+    elapsed = time.time() - start
+    if not received or elapsed <= 0:
+        return None
+    log.debug('Downloaded %d bytes in %.3f seconds.', received, elapsed)
+    return received / elapsed
+
+
+@with_log
+def write_plan(config, paths_and_urls, actions, log):
+    """Write a JSON manifest of what would be downloaded for --plan, with an ETA based on measured throughput.
+
+    :param dict config: Dictionary from get_arguments().
+    :param dict paths_and_urls: Paths and URLs from artifacts_urls().
+    :param list actions: Filled in by artifacts_urls().
+    :param logging.Logger log: Logger for this function. Populated by with_log() decorator.
+    """
+    total_size = sum(v[1] for v in paths_and_urls.values())
+    throughput = None
+    if paths_and_urls:
+        throughput = measure_throughput(max(paths_and_urls.values(), key=lambda v: v[1])[0])
+    eta = total_size / (throughput * min(int(config.get('jobs') or 1), len(paths_and_urls))) if throughput else None
+    manifest = dict(
+        artifacts=actions,
+        eta=eta,
+        throughput=throughput,
+        total_files=len(paths_and_urls),
+        total_size=total_size,
+        version=1,
+    )
+    with open(config['plan'], 'w') as handle:
+        json.dump(manifest, handle, indent=2, sort_keys=True)
+    if eta is None:
+        log.info('Planned %d file(s), %d bytes total.', len(paths_and_urls), total_size)
+    else:
+        log.info('Planned %d file(s), %d bytes total, ETA %.1f seconds.', len(paths_and_urls), total_size, eta)
+
+
+@with_log
+def read_plan(path, log):
+    """Read a JSON manifest written by --plan.
+
+    :raise HandledError: On invalid manifests.
+
+    :param str path: Manifest file.
+    :param logging.Logger log: Logger for this function. Populated by with_log() decorator.
+
+    :return: Paths and URLs like artifacts_urls().
+    :rtype: dict
+    """
+    try:
+        with open(path) as handle:
+            manifest = json.load(handle)
+        if manifest.get('version') != 1:
+            raise ValueError('unsupported version {0}'.format(manifest.get('version')))
+        paths_and_urls = dict((a['path'], (a['url'], a['size'])) for a in manifest['artifacts'] if a['path'])
+    except (IOError, OSError, ValueError, KeyError, TypeError, AttributeError) as exc:
+        log.error('Invalid plan file %s: %s', path, exc)
+        raise HandledError
+    log.info('Loaded plan for %d file(s) from %s', len(paths_and_urls), path)
+    return paths_and_urls
+
+
+def numbits_union(numbits1, numbits2):
+    """Combine two coverage.py numbits blobs (bit N set if line N was executed). SQLite function for combine_sqlite().
+
+    :param bytes numbits1: First blob.
+    :param bytes numbits2: Second blob.
+
+    :return: Bitwise OR of both blobs.
+    :rtype: bytes
+    """
+    first, second = bytearray(numbits1 or b''), bytearray(numbits2 or b'')
+    if len(first) < len(second):
+        first, second = second, first
+    for i, byte in enumerate(second):
+        first[i] |= byte
+    return sqlite3.Binary(bytes(first))
+
+
+def merge_json_pairs(pairs):
+    """Build a JSON object keeping the values of duplicate keys, which CoverageMangler writes for merged paths.
+
+    Lists of lines or arcs are concatenated (combine_json() removes duplicates), for other values the first one wins.
+
+    :param list pairs: Keys and values of the object, in file order.
+
+    :return: JSON object.
+    :rtype: dict
+    """
+    merged = dict()
+    for key, value in pairs:
+        if key not in merged:
+            merged[key] = value
+        elif isinstance(merged[key], list) and isinstance(value, list):
+            merged[key] = merged[key] + value
+    return merged
+
+
+def read_json_coverage(path):
+    """Parse a legacy JSON .coverage file, skipping its header.
+
+    :param str path: .coverage file to read.
+
+    :return: Coverage data.
+    :rtype: dict
+    """
+    with open(path, 'rb') as handle:
+        contents = handle.read()
+    return json.loads(contents[contents.index(b'{'):].decode('utf-8'), object_pairs_hook=merge_json_pairs)
+
+
+@with_log
+def combine_json(paths, output, log):
+    """Combine legacy JSON .coverage files (coverage.py before 5.0) into one like `coverage combine` does.
+
+    :raise HandledError: When line data is combined with branch (arc) data.
+
+    :param iter paths: .coverage files to read.
+    :param str output: File to write to.
+    :param logging.Logger log: Logger for this function. Populated by with_log() decorator.
+    """
+    lines, arcs, file_tracers, runs = dict(), dict(), dict(), list()
+    for path in paths:
+        data = read_json_coverage(path)
+        for file_path, numbers in data.get('lines', dict()).items():
+            lines.setdefault(file_path, set()).update(numbers)
+        for file_path, pairs in data.get('arcs', dict()).items():
+            arcs.setdefault(file_path, set()).update(tuple(p) for p in pairs)
+        file_tracers.update(data.get('file_tracers', dict()))
+        runs.extend(data.get('runs', list()))
+    if lines and arcs:
+        log.error('Unable to combine line data with branch data.')
+        raise HandledError
+
+    combined = dict()
+    if lines:
+        combined['lines'] = dict((k, sorted(v)) for k, v in lines.items())
+    if arcs:
+        combined['arcs'] = dict((k, sorted(list(a) for a in v)) for k, v in arcs.items())
+    if file_tracers:
+        combined['file_tracers'] = file_tracers
+    if runs:
+        combined['runs'] = runs
+    handle, temp_path = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(os.path.abspath(output)))
+    with os.fdopen(handle, 'wb') as handle:
+        handle.write(COVERAGE_HEADER + json.dumps(combined, separators=(',', ':')).encode('utf-8'))
+    replace_file(temp_path, output)
+
+
+@with_log
+def combine_sqlite(paths, output, log):
+    """Combine SQLite .coverage files (coverage.py 5.0+) into one like `coverage combine` does.
+
+    The first file is copied and the others are merged into the copy with ATTACH DATABASE, so measured data is never
+    loaded into Python memory. Line numbits are merged with numbits_union().
+
+    :raise HandledError: On incompatible files or database errors.
+
+    :param iter paths: .coverage files to read.
+    :param str output: File to write to.
+    :param logging.Logger log: Logger for this function. Populated by with_log() decorator.
+    """
+    handle, temp_path = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(os.path.abspath(output)))
+    os.close(handle)
+    shutil.copyfile(paths[0], temp_path)
+    statements = (
+        'INSERT OR IGNORE INTO file (path) SELECT path FROM src.file',
+        'INSERT OR IGNORE INTO context (context) SELECT context FROM src.context',
+        'INSERT INTO line_bits (file_id, context_id, numbits) '
+        'SELECT f.id, c.id, s.numbits FROM src.line_bits s '
+        'JOIN src.file sf ON sf.id = s.file_id JOIN file f ON f.path = sf.path '
+        'JOIN src.context sc ON sc.id = s.context_id JOIN context c ON c.context = sc.context WHERE 1 '
+        'ON CONFLICT (file_id, context_id) DO UPDATE SET numbits = numbits_union(numbits, excluded.numbits)',
+        'INSERT OR IGNORE INTO arc (file_id, context_id, fromno, tono) '
+        'SELECT f.id, c.id, s.fromno, s.tono FROM src.arc s '
+        'JOIN src.file sf ON sf.id = s.file_id JOIN file f ON f.path = sf.path '
+        'JOIN src.context sc ON sc.id = s.context_id JOIN context c ON c.context = sc.context',
+        'INSERT OR IGNORE INTO tracer (file_id, tracer) '
+        'SELECT f.id, s.tracer FROM src.tracer s JOIN src.file sf ON sf.id = s.file_id JOIN file f ON f.path = sf.path',
+    )
+    query = "SELECT (SELECT version FROM {0}coverage_schema), (SELECT value FROM {0}meta WHERE key = 'has_arcs')"
+    connection, combined = sqlite3.connect(temp_path), False
+    try:
+        connection.create_function('numbits_union', 2, numbits_union)
+        expected = connection.execute(query.format('')).fetchone()
+        for path in paths[1:]:
+            connection.execute('ATTACH DATABASE ? AS src', (path, ))
+            if connection.execute(query.format('src.')).fetchone() != expected:
+                log.error('Incompatible coverage schema version or branch setting: %s', path)
+                raise HandledError
+            with connection:
+                for statement in statements:
+                    connection.execute(statement)
+            connection.execute('DETACH DATABASE src')
+        combined = True
+    except sqlite3.DatabaseError as exc:
+        log.error('Unable to combine %s: %s', output, exc)
+        raise HandledError
+    finally:
+        connection.close()
+        if not combined:
+            os.remove(temp_path)
+    replace_file(temp_path, output)
+
+
+@with_log
+def combine_coverage(paths, output, log):
+    """Combine downloaded .coverage files into one file.
+
+    :raise HandledError: When JSON and SQLite files are mixed or on errors combining them.
+
+    :param iter paths: Downloaded files, other files are ignored.
+    :param str output: File to write to.
+    :param logging.Logger log: Logger for this function. Populated by with_log() decorator.
+    """
+    legacy, databases = list(), list()
+    for path in sorted(paths):
+        with open(path, mode='rb') as handle:
+            header = handle.read(16)
+        if header.startswith(b'!coverage.py:'):
+            legacy.append(path)
+        elif header == SQLITE_HEADER:
+            databases.append(path)
+    if legacy and databases:
+        log.error('Unable to combine JSON and SQLite .coverage files.')
+        raise HandledError
+    if not legacy and not databases:
+        log.warning('No .coverage files to combine.')
+        return
+    if legacy:
+        combine_json(legacy, output)
+    else:
+        combine_sqlite(databases, output)
+    log.info('Combined %d .coverage file(s) into %s', len(legacy or databases), output)
+
+
+class MangleQueue(object):
+    """Runs mangle_coverage() on completed downloads in a pool of processes, overlapping with further downloads.
+
+    The pool is started before any download thread so worker processes aren't forked while threads hold locks. The
+    shared PathIndex is built once here and each worker is seeded with its tables by seed_path_index(). Paths a worker
+    resolves afterwards stay memoized in that worker for the rest of the run, so each directory is listed at most once
+    per worker.
+    """
+
+    def __init__(self, config):
+        """Constructor.
+
+        :param dict config: Dictionary from get_arguments().
+        """
+        self.path_map = config.get('path_map') or ''
+        index = get_path_index(self.path_map)
+        with index.lock:
+            seed = (index.path_map_value, index.root, dict(index.listings), dict(index.resolved))
+        processes = min(int(config.get('jobs') or 1), multiprocessing.cpu_count())
+        self.pool = multiprocessing.Pool(processes, seed_path_index, seed)
+        self.results = list()
+
+    def put(self, local_path):
+        """Queue a downloaded file.
+
+        :param str local_path: Downloaded file.
+        """
+        self.results.append(self.pool.apply_async(mangle_coverage, (local_path, ), dict(path_map=self.path_map)))
+
+    def join(self):
+        """Wait for all queued files.
+
+        :raise HandledError: If mangling any of them failed.
+        """
+        for result in self.results:
+            result.get()
+
+    def close(self):
+        """Stop worker processes."""
+        self.pool.terminate()
+        self.pool.join()
+
+
+def move_staged(config, local_path, url, size, staged, progress, mangle, sync, log):
+    """Move a file downloaded to the staging directory into place. Called by download_pipelined().
+
+    :raise HandledError: If local_path exists and sync is None, or on a failed download.
+
+    :param dict config: Dictionary from get_arguments().
+    :param str local_path: Final path from artifacts_urls().
+    :param str url: URL of the file.
+    :param int size: File size in bytes.
+    :param tuple staged: Staged path and result of its background download_file() call. (None, None) if skipped as
+        up to date, a None result if staged by a previous run.
+    :param Progress progress: Progress display of download_pipelined().
+    :param function mangle: Called with local_path once moved into place. None disables mangling.
+    :param SyncState sync: Keep local_path if it's up to date and replace it otherwise. None fails if it exists.
+    :param logging.Logger log: Logger of download_pipelined().
+
+    :return: Return value of download_file() for local_path, None if up to date or mangled.
+    :rtype: str
+    """
+    path, result = staged
+    digest = result.get() if result else None
+    if path is None:  # Up to date, unless artifacts_urls() picked another path than in the previous run.
+        progress.close()
+        return download_file(config, local_path, url, size, mangle=mangle, sync=sync)
+    if os.path.exists(local_path):
+        if sync is None:
+            log.error('File already exists: %s', local_path)
             raise HandledError
-        file_contents = file_contents.replace(windows_path, unix_absolute_path)
+        if sync.up_to_date(local_path, url, size):
+            log.debug('Discarding %s', path)
+            os.remove(path)
+            return None
+        os.remove(local_path)
+    if not os.path.isdir(os.path.dirname(local_path)):
+        os.makedirs(os.path.dirname(local_path))
+    replace_file(path, local_path)
+    if sync is not None:
+        sync.record(local_path, url, size)
+    progress.write(' => {0} {1} bytes'.format(os.path.relpath(local_path, config['dir'] or os.getcwd()), size))
+    if mangle is not None:
+        mangle(local_path)
+        return None
+    return digest
+
+
+def discard_staged(staged, log):
+    """Delete staged files not moved into place, e.g. skipped or overwritten by artifacts_urls().
+
+    :raise HandledError: On a failed download.
+
+    :param iter staged: Staged paths and results of their background download_file() calls.
+    :param logging.Logger log: Logger of download_pipelined().
+    """
+    for path, result in staged:
+        if result:
+            result.get()
+        if path is not None:
+            log.debug('Discarding %s', path)
+            os.remove(path)
+
+
+@with_log
+def download_pipelined(config, log, mangle=None, sync=None, digests=None):
+    """Download artifacts of each AppVeyor job as soon as it succeeds, while polling for the remaining jobs.
+
+    Files are downloaded in the background to <dir>/.appveyor-artifacts/<jobID>/ first. Once all jobs have succeeded
+    they are moved to their final paths from artifacts_urls(), so collision handling is the same as without pipelining
+    no matter in which order jobs finish.
+
+    :raise HandledError: On any failed download.
+
+    :param dict config: Dictionary from get_arguments().
+    :param logging.Logger log: Logger for this function. Populated by with_log() decorator.
+    :param function mangle: Called with every local path once moved into place. None disables mangling.
+    :param SyncState sync: Don't download artifacts of up to date files. None fails if files exist.
+    :param dict digests: Populated with return values of download_file() keyed by final local path.
+
+    :return: Paths and URLs from artifacts_urls.
+    :rtype: dict
+    """
+    staging_dir = os.path.join(config['dir'] or os.getcwd(), STAGING_DIR)
+    pool = multiprocessing.pool.ThreadPool(int(config.get('jobs') or 1))
+    progress = Progress(report_files=False)  # Files are reported once moved into place.
+    staged = dict()
+
+    def on_success(job):
+        """Start downloading artifacts of a finished job in the background.
+
+        :param str job: AppVeyor jobID.
+
+        :return: Job artifacts like query_artifacts().
+        :rtype: list
+        """
+        artifacts = query_artifacts([job])
+        log.info('Job %s finished, downloading %d artifact%s.', job, len(artifacts), '' if len(artifacts) == 1 else 's')
+        for _, file_name, size in artifacts:
+            url = ARTIFACT_URL.format(API_PREFIX, job, file_name)
+            path = os.path.join(staging_dir, job, file_name)
+            if os.path.isfile(path) and os.path.getsize(path) == size:
+                log.debug('Already staged: %s', path)
+                staged[url] = (path, None)
+                continue
+            if sync is not None and sync.known(url, size):
+                log.debug('Not staging up to date artifact: %s', url)
+                staged[url] = (None, None)
+                continue
+            progress.expect(1, size)
+            staged[url] = (path, pool.apply_async(download_file, (config, path, url, size), dict(progress=progress)))
+        return artifacts
+
+    try:
+        paths_and_urls = get_urls(config, on_success=on_success)
+
+        # Move staged files into place.
+        for local_path, (url, size) in sorted(paths_and_urls.items()):
+            digest = move_staged(config, local_path, url, size, staged.pop(url), progress, mangle, sync, log)
+            if digests is not None:
+                digests[local_path] = digest
+
+        # Discard files skipped or overwritten by artifacts_urls().
+        discard_staged(staged.values(), log)
+    except BaseException:
+        progress.abort.set()
+        raise
+    finally:
+        pool.close()
+        pool.join()
+        progress.close()
+
+    shutil.rmtree(staging_dir, ignore_errors=True)
+    return paths_and_urls
+
+
+def hash_file(path):
+    """Compute the SHA-256 of a file.
 
-    # Write.
-    with open(local_path, 'w') as handle:
-        handle.write(file_contents)
+    :param str path: File to read.
+
+    :return: Hex digest.
+    :rtype: str
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as handle:
+        for chunk in iter(lambda: handle.read(HASH_CHUNK), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+@with_log
+def hash_files(paths, log):
+    """Compute the SHA-256 of many files in parallel.
+
+    hashlib releases the GIL while hashing large buffers, so one thread per CPU keeps all of them busy.
+
+    :param iter paths: Files to read.
+    :param logging.Logger log: Logger for this function. Populated by with_log() decorator.
+
+    :return: Hex digests keyed by path, None for files that couldn't be read.
+    :rtype: dict
+    """
+    paths = list(paths)
+    if not paths:
+        return dict()
+
+    def worker(path):
+        """Hash one file.
+
+        :param str path: File to read.
+
+        :return: Path and hex digest or None.
+        :rtype: tuple
+        """
+        try:
+            return path, hash_file(path)
+        except (IOError, OSError) as exc:
+            log.debug('Unable to read %s: %s', path, exc)
+            return path, None
+
+    pool = multiprocessing.pool.ThreadPool(min(multiprocessing.cpu_count(), len(paths)))
+    try:
+        return dict(pool.imap_unordered(worker, paths))
+    finally:
+        pool.close()
+        pool.join()
+
+
+@with_log
+def write_checksums(config, paths_and_urls, digests, log):
+    """Write SHA-256 checksums of downloaded files for --checksums, in the format of sha256sum.
+
+    Files not hashed while downloading are hashed now, in parallel.
+
+    :param dict config: Dictionary from get_arguments().
+    :param dict paths_and_urls: Downloaded files from artifacts_urls().
+    :param dict digests: Hex digests from download_file() keyed by local path. Updated in place.
+    :param logging.Logger log: Logger for this function. Populated by with_log() decorator.
+    """
+    missing = [p for p in paths_and_urls if not digests.get(p)]
+    log.debug('Hashing %d file(s) not hashed while downloading.', len(missing))
+    digests.update(hash_files(missing))
+    root = config['dir'] or os.getcwd()
+    relative_paths = sorted((os.path.relpath(p, root).replace(os.sep, '/'), p) for p in paths_and_urls)
+    lines = ['{0}  {1}\n'.format(digests[p], r) for r, p in relative_paths]
+    with open(config['checksums'], 'w') as handle:
+        handle.writelines(lines)
+    log.info('Wrote checksums of %d file(s) to %s', len(lines), config['checksums'])
+
+
+@with_log
+def verify_checksums(config, log):
+    """Check files against checksums written by --checksums, for --verify.
+
+    :raise HandledError: On missing or modified files, or an invalid checksums file.
+
+    :param dict config: Dictionary from get_arguments().
+    :param logging.Logger log: Logger for this function. Populated by with_log() decorator.
+    """
+    root = config['dir'] or os.getcwd()
+    expected = dict()
+    with open(config['verify']) as handle:
+        for number, line in enumerate(handle, 1):
+            digest, separator, path = line.rstrip('\n').partition(' ')
+            if len(digest) != 64 or not separator or path[:1] not in (' ', '*') or not path[1:]:  # Text or binary.
+                log.error('Invalid line %d in %s', number, config['verify'])
+                raise HandledError
+            expected[os.path.join(root, path[1:])] = digest.lower()
+
+    actual = hash_files(expected)
+    failed = 0
+    for path in sorted(expected):
+        if actual[path] is None:
+            log.error('No such file: %s', path)
+        elif actual[path] != expected[path]:
+            log.error('Checksum mismatch: %s', path)
+        else:
+            continue
+        failed += 1
+    if failed:
+        log.error('%d of %d file(s) failed verification.', failed, len(expected))
+        raise HandledError
+    log.info('Verified %d file(s).', len(expected))
+
+
+def find_artifacts(config, mangle, sync, digests):
+    """Get artifacts to download from --from-plan or AppVeyor. Called by main().
+
+    With --pipeline they are downloaded by download_pipelined() already.
+
+    :param dict config: Dictionary from get_arguments().
+    :param function mangle: Passed to download_pipelined().
+    :param SyncState sync: Passed to download_pipelined().
+    :param dict digests: Passed to download_pipelined().
+
+    :return: Paths and URLs from artifacts_urls() or read_plan().
+    :rtype: dict
+    """
+    if config.get('from_plan'):
+        return read_plan(config['from_plan'])
+    if config.get('pipeline'):
+        return download_pipelined(config, mangle=mangle, sync=sync, digests=digests)
+    return get_urls(config)
+
+
+def finish(mangling, sync, log):
+    """Stop mangling processes, save --sync state, report retries, and close the HTTP session. Called by main().
+
+    :param MangleQueue mangling: Mangling pool, if any.
+    :param SyncState sync: --sync state, if any.
+    :param logging.Logger log: Logger of main().
+    """
+    if mangling is not None:
+        mangling.close()
+    if sync is not None:
+        sync.save()
+    session = get_session()
+    if session.retries:
+        log.info('Retried %d request(s), waited %.1f seconds.', session.retries, session.retry_wait)
+    close_session()
+
+
+def download_all(config, paths_and_urls, log, mangle=None, sync=None, digests=None):
+    """Download files with up to --jobs threads, showing the progress of all of them. Called by main().
+
+    :param dict config: Dictionary from get_arguments().
+    :param dict paths_and_urls: Paths and URLs from artifacts_urls() or read_plan().
+    :param logging.Logger log: Logger of main().
+    :param function mangle: Passed to download_file().
+    :param SyncState sync: Passed to download_file().
+    :param dict digests: Populated with return values of download_file() keyed by local path.
+    """
+    downloads = sorted((v[1], k, v[0]) for k, v in paths_and_urls.items())
+    log.info('Downloading file%s:', '' if len(downloads) == 1 else 's')
+    jobs = int(config.get('jobs') or 1)
+    progress = Progress(sum(d[0] for d in downloads), len(downloads))
+    try:
+        if jobs > 1 and len(downloads) > 1:
+            download_files(config, downloads, jobs, progress=progress, mangle=mangle, sync=sync, digests=digests)
+            return
+        for size, local_path, url in downloads:
+            digest = download_file(config, local_path, url, size, progress=progress, mangle=mangle, sync=sync)
+            if digests is not None:
+                digests[local_path] = digest
+    finally:
+        progress.close()
 
 
 @with_log
@@ -567,22 +3189,44 @@ def main(config, log):
     :param logging.Logger log: Logger for this function. Populated by with_log() decorator.
     """
     validate(config)
-    paths_and_urls = get_urls(config)
-    if not paths_and_urls:
-        log.warning('No artifacts; nothing to download.')
+    if config.get('verify'):
+        verify_checksums(config)
         return
-
-    # Download files.
-    total_size = 0
-    chunk_size = max(min(max(v[1] for v in paths_and_urls.values()) // 50, 1048576), 1024)
-    log.info('Downloading file%s (1 dot ~ %d KiB):', '' if len(paths_and_urls) == 1 else 's', chunk_size // 1024)
-    for size, local_path, url in sorted((v[1], k, v[0]) for k, v in paths_and_urls.items()):
-        download_file(config, local_path, url, size, chunk_size)
-        total_size += size
-        if config['mangle_coverage']:
-            mangle_coverage(local_path)
-
-    log.info('Downloaded %d file(s), %d bytes total.', len(paths_and_urls), total_size)
+    open_session(config)
+    if config.get('plan'):
+        actions = list()
+        try:
+            write_plan(config, get_urls(config, actions=actions), actions)
+        finally:
+            close_session()
+        return
+    mangling = MangleQueue(config) if config['mangle_coverage'] else None
+    mangle = None if mangling is None else mangling.put
+    sync = SyncState(config['dir'] or os.getcwd(), log) if config.get('sync') else None
+    digests = dict() if config.get('checksums') else None
+    try:
+        paths_and_urls = find_artifacts(config, mangle, sync, digests)
+        if not paths_and_urls:
+            log.warning('No artifacts; nothing to download.')
+            return
+        total_size = sum(v[1] for v in paths_and_urls.values())
+
+        # Download files.
+        if config.get('from_plan') or not config.get('pipeline'):
+            download_all(config, paths_and_urls, log, mangle=mangle, sync=sync, digests=digests)
+
+        # Wait for mangling still running in the background.
+        if mangling is not None:
+            mangling.join()
+        log.info('Downloaded %d file(s), %d bytes total.', len(paths_and_urls), total_size)
+        if sync is not None and sync.skipped:
+            log.info('Skipped %d up to date file(s).', sync.skipped)
+        if digests is not None:
+            write_checksums(config, paths_and_urls, digests)
+        if config.get('combine'):
+            combine_coverage(list(paths_and_urls), config['combine'])
+    finally:
+        finish(mangling, sync, log)
 
 
 def entry_point():
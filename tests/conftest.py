@@ -20,3 +20,21 @@ def config_requests():
     if sys.version_info[:3] < (2, 7, 9):
         requests.packages.urllib3.disable_warnings()
     logging.getLogger('requests').setLevel(logging.WARNING)
+
+
+@pytest.fixture(autouse=True)
+def reset_session(monkeypatch):
+    """Give each test its own shared HTTP session.
+
+    :param monkeypatch: pytest fixture.
+    """
+    monkeypatch.setattr('appveyor_artifacts.SESSION', None)
+
+
+@pytest.fixture(autouse=True)
+def reset_path_index(monkeypatch):
+    """Give each test its own shared path index.
+
+    :param monkeypatch: pytest fixture.
+    """
+    monkeypatch.setattr('appveyor_artifacts.PATH_INDEX', None)
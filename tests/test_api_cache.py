@@ -0,0 +1,85 @@
+"""Test cache_load(), cache_save(), cache_evict() functions and their use in query_api()."""
+
+import os
+
+import httpretty
+import pytest
+
+from appveyor_artifacts import cache_evict, cache_load, cache_path, open_session, query_api
+
+
+@pytest.mark.httpretty
+def test_revalidate(tmpdir):
+    """Test conditional requests with ETag and If-None-Match.
+
+    :param tmpdir: pytest fixture.
+    """
+    url = 'https://ci.appveyor.com/api/projects/team/app/history?recordsNumber=10'
+    httpretty.register_uri(httpretty.GET, url, responses=[
+        httpretty.Response(body='{"builds": []}', adding_headers={'ETag': '"abc"'}),
+        httpretty.Response(body='', status=304),
+    ])
+    open_session(dict(cache_dir=str(tmpdir.join('cache'))))
+
+    # First query populates the cache.
+    assert query_api(url[27:]) == dict(builds=[])
+    assert 'If-None-Match' not in httpretty.last_request().headers
+    assert cache_load(url[27:])['etag'] == '"abc"'
+
+    # Second query revalidates and gets HTTP 304.
+    assert query_api(url[27:]) == dict(builds=[])
+    assert httpretty.last_request().headers['If-None-Match'] == '"abc"'
+    assert len(httpretty.latest_requests()) == 2
+
+
+@pytest.mark.httpretty
+def test_immutable(tmpdir):
+    """Test that artifact listings are served from cache without network calls.
+
+    :param tmpdir: pytest fixture.
+    """
+    url = 'https://ci.appveyor.com/api/buildjobs/abc1def2ghi3jkl4/artifacts'
+    httpretty.register_uri(httpretty.GET, url, body='[{"fileName": ".coverage", "size": 1692}]')
+    open_session(dict(cache_dir=str(tmpdir)))
+
+    expected = [dict(fileName='.coverage', size=1692)]
+    assert query_api(url[27:]) == expected
+    assert query_api(url[27:]) == expected
+    assert len(httpretty.latest_requests()) == 1
+
+
+def test_disabled():
+    """Test without --cache-dir."""
+    assert cache_path('/projects/team/app') == ''
+    assert cache_load('/projects/team/app') is None
+
+
+def test_evict(tmpdir):
+    """Test least recently used eviction.
+
+    :param tmpdir: pytest fixture.
+    """
+    for i, name in enumerate(('old.json', 'used.json', 'new.json')):
+        tmpdir.join(name).write('x' * 100)
+        os.utime(str(tmpdir.join(name)), (1000 + i, 1000 + i))
+    os.utime(str(tmpdir.join('used.json')), (2000, 2000))
+
+    cache_evict(str(tmpdir), 300)
+    assert len(tmpdir.listdir()) == 4
+
+    cache_evict(str(tmpdir), 250)
+    assert sorted(i.basename for i in tmpdir.listdir()) == ['.lock', 'new.json', 'used.json']
+
+    cache_evict(str(tmpdir), 100)
+    assert [i.basename for i in tmpdir.listdir()] == ['.lock', 'used.json']
+
+
+def test_evict_skip_temp(tmpdir):
+    """Temporary files of concurrent writers are neither counted nor deleted.
+
+    :param tmpdir: pytest fixture.
+    """
+    tmpdir.join('entry.json').write('x' * 100)
+    tmpdir.join('tmpabc123.tmp').write('x' * 100)
+    cache_evict(str(tmpdir), 100)
+    assert sorted(i.basename for i in tmpdir.listdir()) == ['.lock', 'entry.json', 'tmpabc123.tmp']
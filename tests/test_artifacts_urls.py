@@ -197,3 +197,35 @@ def test_multi_rename():
         (py.path.local('1cov__.'), (API_PREFIX + '/buildjobs/1pfx2im3cj6faq59/artifacts/1cov.', 4272)),
     ])
     assert actual == expected
+
+
+def test_multi_number():
+    """Test numbered renames, including an artifact named like a renamed one."""
+    jobs_artifacts = [
+        ('1pfx2im3cj6faq57', 'R.rst', 1270), ('1pfx2im3cj6faq57', 'R_1.rst', 1), ('1pfx2im3cj6faq58', 'R.rst', 1271),
+        ('1pfx2im3cj6faq59', 'R.rst', 1272), ('1pfx2im3cj6faq57', '.cov1', 2270), ('1pfx2im3cj6faq58', '.cov1', 2271),
+        ('1pfx2im3cj6faq57', '1cov.', 4270), ('1pfx2im3cj6faq58', '1cov.', 4271),
+    ]
+    config = dict(always_job_dirs=False, no_job_dirs='number', dir=None)
+    actual = artifacts_urls(config, jobs_artifacts)
+    expected = dict([
+        (py.path.local('R.rst'), (API_PREFIX + '/buildjobs/1pfx2im3cj6faq57/artifacts/R.rst', 1270)),
+        (py.path.local('R_1.rst'), (API_PREFIX + '/buildjobs/1pfx2im3cj6faq57/artifacts/R_1.rst', 1)),
+        (py.path.local('R_2.rst'), (API_PREFIX + '/buildjobs/1pfx2im3cj6faq58/artifacts/R.rst', 1271)),
+        (py.path.local('R_3.rst'), (API_PREFIX + '/buildjobs/1pfx2im3cj6faq59/artifacts/R.rst', 1272)),
+        (py.path.local('.cov1'), (API_PREFIX + '/buildjobs/1pfx2im3cj6faq57/artifacts/.cov1', 2270)),
+        (py.path.local('.cov1_1'), (API_PREFIX + '/buildjobs/1pfx2im3cj6faq58/artifacts/.cov1', 2271)),
+        (py.path.local('1cov.'), (API_PREFIX + '/buildjobs/1pfx2im3cj6faq57/artifacts/1cov.', 4270)),
+        (py.path.local('1cov_1.'), (API_PREFIX + '/buildjobs/1pfx2im3cj6faq58/artifacts/1cov.', 4271)),
+    ])
+    assert actual == expected
+
+
+def test_many_collisions():
+    """Test tens of thousands of jobs uploading the same file name."""
+    jobs_artifacts = [('job{0:05d}'.format(i), 'file.txt', i) for i in range(20000)]
+    config = dict(always_job_dirs=False, no_job_dirs='number', dir=None)
+    actual = artifacts_urls(config, jobs_artifacts)
+    assert len(actual) == 20000
+    expected = (API_PREFIX + '/buildjobs/job19999/artifacts/file.txt', 19999)
+    assert actual[str(py.path.local('file_19999.txt'))] == expected
@@ -0,0 +1,141 @@
+"""Test combine_coverage() function."""
+
+import json
+import sqlite3
+
+import pytest
+
+from appveyor_artifacts import combine_coverage, HandledError, numbits_union
+
+HEADER = '!coverage.py: This is a private format, don\'t read it directly!'
+SCHEMA = """
+CREATE TABLE coverage_schema (version INTEGER);
+CREATE TABLE meta (key TEXT, value TEXT, UNIQUE (key));
+CREATE TABLE file (id INTEGER PRIMARY KEY, path TEXT, UNIQUE (path));
+CREATE TABLE context (id INTEGER PRIMARY KEY, context TEXT, UNIQUE (context));
+CREATE TABLE line_bits (file_id INTEGER, context_id INTEGER, numbits BLOB, UNIQUE (file_id, context_id));
+CREATE TABLE arc (file_id INTEGER, context_id INTEGER, fromno INTEGER, tono INTEGER,
+                  UNIQUE (file_id, context_id, fromno, tono));
+CREATE TABLE tracer (file_id INTEGER PRIMARY KEY, tracer TEXT);
+INSERT INTO coverage_schema VALUES (7);
+INSERT INTO context (context) VALUES ('');
+"""
+
+
+def create_database(path, has_arcs, lines=None, arcs=None):
+    """Create a coverage.py SQLite data file.
+
+    :param path: py.path.local instance.
+    :param bool has_arcs: Branch coverage.
+    :param dict lines: File paths and numbits.
+    :param dict arcs: File paths and lists of arcs.
+    """
+    connection = sqlite3.connect(str(path))
+    with connection:
+        connection.executescript(SCHEMA)
+        connection.execute("INSERT INTO meta VALUES ('has_arcs', ?)", (str(has_arcs), ))
+        for file_path, numbits in (lines or dict()).items():
+            file_id = connection.execute('INSERT INTO file (path) VALUES (?)', (file_path, )).lastrowid
+            connection.execute('INSERT INTO line_bits VALUES (?, 1, ?)', (file_id, sqlite3.Binary(numbits)))
+        for file_path, pairs in (arcs or dict()).items():
+            file_id = connection.execute('INSERT INTO file (path) VALUES (?)', (file_path, )).lastrowid
+            connection.executemany('INSERT INTO arc VALUES (?, 1, ?, ?)', [(file_id, a, b) for a, b in pairs])
+    connection.close()
+
+
+def test_numbits_union():
+    """Test numbits_union()."""
+    assert bytes(numbits_union(b'\x01\x02', b'\x04')) == b'\x05\x02'
+    assert bytes(numbits_union(b'', b'\x04\x80')) == b'\x04\x80'
+    assert bytes(numbits_union(None, None)) == b''
+
+
+def test_json(tmpdir, caplog):
+    """Test combining legacy JSON files and ignoring other files.
+
+    :param tmpdir: pytest fixture.
+    :param caplog: pytest extension fixture.
+    """
+    tmpdir.join('one.coverage').write(HEADER + json.dumps(dict(lines={'/a.py': [1, 2], '/b.py': [3]})))
+    tmpdir.join('two.coverage').write(HEADER + json.dumps(dict(lines={'/a.py': [2, 5]}, runs=[dict(version='4')])))
+    tmpdir.join('README.md').write('# Hello')
+    output = tmpdir.join('.coverage')
+
+    combine_coverage([str(p) for p in tmpdir.listdir()], str(output))
+    contents = output.read()
+    assert contents.startswith(HEADER)
+    assert json.loads(contents[len(HEADER):]) == dict(lines={'/a.py': [1, 2, 5], '/b.py': [3]},
+                                                      runs=[dict(version='4')])
+    assert caplog.records[-2].message == 'Combined 2 .coverage file(s) into {0}'.format(output)
+
+
+def test_json_arcs(tmpdir):
+    """Test combining legacy JSON files with branch data, and refusing to combine them with line data.
+
+    :param tmpdir: pytest fixture.
+    """
+    tmpdir.join('one.coverage').write(HEADER + json.dumps(dict(arcs={'/a.py': [[-1, 1], [1, 2]]})))
+    tmpdir.join('two.coverage').write(HEADER + json.dumps(dict(arcs={'/a.py': [[1, 2], [2, -1]]})))
+    output = tmpdir.join('.coverage')
+    combine_coverage([str(p) for p in tmpdir.listdir()], str(output))
+    assert json.loads(output.read()[len(HEADER):]) == dict(arcs={'/a.py': [[-1, 1], [1, 2], [2, -1]]})
+
+    tmpdir.join('three.coverage').write(HEADER + json.dumps(dict(lines={'/a.py': [1]})))
+    with pytest.raises(HandledError):
+        combine_coverage([str(tmpdir.join(n)) for n in ('one.coverage', 'three.coverage')], str(output))
+
+
+def test_sqlite(tmpdir):
+    """Test combining SQLite files.
+
+    :param tmpdir: pytest fixture.
+    """
+    create_database(tmpdir.join('one.coverage'), False, lines={'/a.py': b'\x06', '/b.py': b'\x01'})
+    create_database(tmpdir.join('two.coverage'), False, lines={'/c.py': b'\x02', '/a.py': b'\x00\x01'})
+    output = tmpdir.join('.coverage')
+
+    combine_coverage([str(tmpdir.join('one.coverage')), str(tmpdir.join('two.coverage'))], str(output))
+    connection = sqlite3.connect(str(output))
+    query = 'SELECT f.path, l.numbits FROM line_bits l JOIN file f ON f.id = l.file_id ORDER BY f.path'
+    assert [(p, bytes(n)) for p, n in connection.execute(query)] == [
+        ('/a.py', b'\x06\x01'), ('/b.py', b'\x01'), ('/c.py', b'\x02')
+    ]
+    connection.close()
+    assert sorted(p.basename for p in tmpdir.listdir()) == ['.coverage', 'one.coverage', 'two.coverage']
+
+
+def test_sqlite_arcs(tmpdir, caplog):
+    """Test combining SQLite files with branch data, and refusing to combine them with line data.
+
+    :param tmpdir: pytest fixture.
+    :param caplog: pytest extension fixture.
+    """
+    create_database(tmpdir.join('one.coverage'), True, arcs={'/a.py': [(-1, 1), (1, 2)]})
+    create_database(tmpdir.join('two.coverage'), True, arcs={'/b.py': [(-1, 1)], '/a.py': [(1, 2), (2, -1)]})
+    create_database(tmpdir.join('three.coverage'), False, lines={'/a.py': b'\x02'})
+    output = tmpdir.join('.coverage')
+
+    combine_coverage([str(tmpdir.join('one.coverage')), str(tmpdir.join('two.coverage'))], str(output))
+    connection = sqlite3.connect(str(output))
+    query = 'SELECT f.path, a.fromno, a.tono FROM arc a JOIN file f ON f.id = a.file_id ORDER BY 1, 2, 3'
+    assert connection.execute(query).fetchall() == [('/a.py', -1, 1), ('/a.py', 1, 2), ('/a.py', 2, -1),
+                                                    ('/b.py', -1, 1)]
+    connection.close()
+
+    with pytest.raises(HandledError):
+        combine_coverage([str(tmpdir.join('one.coverage')), str(tmpdir.join('three.coverage'))], str(output))
+    assert caplog.records[-3].message.startswith('Incompatible coverage schema version or branch setting: ')
+
+
+def test_mixed(tmpdir, caplog):
+    """Test refusing to combine JSON and SQLite files.
+
+    :param tmpdir: pytest fixture.
+    :param caplog: pytest extension fixture.
+    """
+    tmpdir.join('one.coverage').write(HEADER + json.dumps(dict(lines={'/a.py': [1]})))
+    create_database(tmpdir.join('two.coverage'), False, lines={'/a.py': b'\x02'})
+    with pytest.raises(HandledError):
+        combine_coverage([str(p) for p in tmpdir.listdir()], str(tmpdir.join('.coverage')))
+    assert caplog.records[-2].message == 'Unable to combine JSON and SQLite .coverage files.'
+    assert not tmpdir.join('.coverage').check()
@@ -1,12 +1,17 @@
 """Test download_file() function."""
 
-import re
+import gzip
+import hashlib
+import io
+import json
+import os
 
 import httpretty
 import py
 import pytest
+import requests
 
-from appveyor_artifacts import download_file, HandledError
+from appveyor_artifacts import download_file, HandledError, open_session
 
 
 @pytest.mark.httpretty
@@ -23,14 +28,15 @@ def test_success(capsys, tmpdir):
 
     # Run.
     local_path = tmpdir.join('appveyor_artifacts.py')
-    download_file(dict(dir=str(tmpdir)), str(local_path), url, source_file.size(), 1024)
+    digest = download_file(dict(dir=str(tmpdir)), str(local_path), url, source_file.size())
 
     # Check.
     assert local_path.size() == source_file.size()
     assert local_path.computehash() == source_file.computehash()
+    assert digest == source_file.computehash('sha256')
     stdout, stderr = capsys.readouterr()
     assert not stdout
-    assert re.match(r'^ => appveyor_artifacts.py [\.]{15,79} [\d]{5,6} bytes\n$', stderr)
+    assert stderr == ' => appveyor_artifacts.py {0} bytes\n'.format(source_file.size())
 
 
 @pytest.mark.httpretty
@@ -47,14 +53,14 @@ def test_success_subdir(capsys, tmpdir):
 
     # Run.
     local_path = tmpdir.join('src', 'files', 'appveyor_artifacts.py')
-    download_file(dict(dir=str(tmpdir)), str(local_path), url, source_file.size(), 1024)
+    download_file(dict(dir=str(tmpdir)), str(local_path), url, source_file.size())
 
     # Check.
     assert local_path.size() == source_file.size()
     assert local_path.computehash() == source_file.computehash()
     stdout, stderr = capsys.readouterr()
     assert not stdout
-    assert re.match(r'^ => src/files/appveyor_artifacts.py [\.]{15,79} [\d]{5,6} bytes\n$', stderr)
+    assert stderr == ' => src/files/appveyor_artifacts.py {0} bytes\n'.format(source_file.size())
 
 
 @pytest.mark.httpretty
@@ -74,10 +80,390 @@ def test_errors(tmpdir, caplog, file_exists):
     if file_exists:
         local_path.ensure()
     with pytest.raises(HandledError):
-        download_file(dict(dir=str(tmpdir)), str(local_path), url, source_file.size() + 32, 1024)
+        download_file(dict(dir=str(tmpdir)), str(local_path), url, source_file.size() + 32)
 
     if file_exists:
         assert caplog.records[-2].message == 'File already exists: ' + str(local_path)
     else:
         message = 'Expected {0} bytes but got {1} bytes instead.'.format(source_file.size() + 32, source_file.size())
         assert caplog.records[-2].message == message
+        assert not local_path.check()
+        assert tmpdir.join('appveyor_artifacts.py.part').size() == source_file.size()  # Kept for resuming.
+
+
+@pytest.mark.httpretty
+@pytest.mark.parametrize('etag_matches', [True, False])
+def test_resume(capsys, tmpdir, etag_matches):
+    """Test resuming a partial download from a previous run.
+
+    :param capsys: pytest fixture.
+    :param tmpdir: pytest fixture.
+    :param bool etag_matches: If the file on the server is still the same.
+    """
+    source_file = py.path.local(__file__).dirpath().join('..', 'appveyor_artifacts.py')
+    contents = source_file.read(mode='rb')
+    url = 'https://ci.appveyor.com/api/buildjobs/abc1def2ghi3jkl4/artifacts/appveyor_artifacts.py'
+    requests_headers = list()
+
+    def callback(request, _, response_headers):
+        """Honor Range requests like AppVeyor's storage backend.
+
+        :param request: httpretty request.
+        :param str _: URL.
+        :param dict response_headers: Response headers.
+        """
+        requests_headers.append(request.headers)
+        response_headers['ETag'] = '"abc"'
+        if request.headers.get('Range') and request.headers.get('If-Range') == '"abc"':
+            start = int(request.headers['Range'][6:-1])
+            return 206, response_headers, contents[start:]
+        return 200, response_headers, contents
+    httpretty.register_uri(httpretty.GET, url, body=callback)
+
+    # Leave a partial download behind.
+    local_path = tmpdir.join('appveyor_artifacts.py')
+    tmpdir.join('appveyor_artifacts.py.part').write(contents[:1000], mode='wb')
+    state = dict(url=url, size=len(contents), etag='"abc"' if etag_matches else '"old"')
+    tmpdir.join('appveyor_artifacts.py.part.json').write(json.dumps(state))
+
+    # Run.
+    download_file(dict(dir=str(tmpdir)), str(local_path), url, len(contents))
+
+    # Check.
+    assert requests_headers[0]['Range'] == 'bytes=1000-'
+    assert local_path.computehash() == source_file.computehash()
+    assert [i.basename for i in tmpdir.listdir()] == ['appveyor_artifacts.py']
+    stdout, stderr = capsys.readouterr()
+    assert not stdout
+    assert stderr.endswith(' {0} bytes\n'.format(len(contents)))
+
+
+@pytest.mark.httpretty
+def test_read_timeout(monkeypatch, tmpdir, caplog):
+    """Test that downloads are requested with a read timeout and resumed when it expires.
+
+    :param monkeypatch: pytest fixture.
+    :param tmpdir: pytest fixture.
+    :param caplog: pytest extension fixture.
+    """
+    monkeypatch.setattr('appveyor_artifacts.time.sleep', lambda _: None)
+    contents = b'0123456789' * 10
+    url = 'https://ci.appveyor.com/api/buildjobs/abc1def2ghi3jkl4/artifacts/file.bin'
+    httpretty.register_uri(httpretty.GET, url, body=contents)
+    session = open_session(dict())
+    timeouts = list()
+    original = session.get
+
+    def get(*args, **kwargs):
+        """Time out on the first request like a stalled server."""
+        timeouts.append(kwargs.get('timeout'))
+        if len(timeouts) == 1:
+            raise requests.exceptions.ReadTimeout('Read timed out.')
+        return original(*args, **kwargs)
+    monkeypatch.setattr(session, 'get', get)
+
+    local_path = tmpdir.join('file.bin')
+    download_file(dict(dir=str(tmpdir)), str(local_path), url, len(contents))
+    assert local_path.read(mode='rb') == contents
+    assert timeouts == [60, 60]
+    assert [r.message for r in caplog.records if r.levelname == 'WARNING'][0].startswith('Download interrupted, ')
+
+
+@pytest.mark.httpretty
+def test_stale_part(tmpdir):
+    """Test that partial downloads of other files are discarded.
+
+    :param tmpdir: pytest fixture.
+    """
+    source_file = py.path.local(__file__).dirpath().join('..', 'appveyor_artifacts.py')
+    url = 'https://ci.appveyor.com/api/buildjobs/abc1def2ghi3jkl4/artifacts/appveyor_artifacts.py'
+    httpretty.register_uri(httpretty.GET, url, body=source_file.read(mode='rb'))
+
+    local_path = tmpdir.join('appveyor_artifacts.py')
+    tmpdir.join('appveyor_artifacts.py.part').write('x' * 1000)
+    state = dict(url=url.replace('abc1def2ghi3jkl4', 'other'), size=source_file.size(), etag='')
+    tmpdir.join('appveyor_artifacts.py.part.json').write(json.dumps(state))
+    download_file(dict(dir=str(tmpdir)), str(local_path), url, source_file.size())
+
+    assert 'Range' not in httpretty.last_request().headers
+    assert local_path.computehash() == source_file.computehash()
+    assert [i.basename for i in tmpdir.listdir()] == ['appveyor_artifacts.py']
+
+
+@pytest.mark.httpretty
+@pytest.mark.parametrize('accept_ranges', [True, False])
+def test_segments(capsys, tmpdir, accept_ranges):
+    """Test downloading a large file in parallel byte ranges.
+
+    :param capsys: pytest fixture.
+    :param tmpdir: pytest fixture.
+    :param bool accept_ranges: If the server honors Range requests.
+    """
+    source_file = py.path.local(__file__).dirpath().join('..', 'appveyor_artifacts.py')
+    contents = source_file.read(mode='rb')
+    url = 'https://ci.appveyor.com/api/buildjobs/abc1def2ghi3jkl4/artifacts/appveyor_artifacts.py'
+    ranges = list()
+
+    def callback(request, _, response_headers):
+        """Honor Range requests like AppVeyor's storage backend, or not.
+
+        :param request: httpretty request.
+        :param str _: URL.
+        :param dict response_headers: Response headers.
+        """
+        ranges.append(request.headers.get('Range'))
+        if not accept_ranges:
+            return 200, response_headers, contents
+        start, end = (int(i) for i in request.headers['Range'][6:].split('-'))
+        return 206, response_headers, contents[start:end + 1]
+    httpretty.register_uri(httpretty.GET, url, body=callback)
+
+    local_path = tmpdir.join('appveyor_artifacts.py')
+    config = dict(dir=str(tmpdir), segments='3', split_above='1024')
+    download_file(config, str(local_path), url, len(contents))
+
+    assert local_path.computehash() == source_file.computehash()
+    assert [i.basename for i in tmpdir.listdir()] == ['appveyor_artifacts.py']
+    third = -(-len(contents) // 3)
+    if accept_ranges:
+        expected = ['bytes=0-{0}'.format(third - 1), 'bytes={0}-{1}'.format(third, third * 2 - 1),
+                    'bytes={0}-{1}'.format(third * 2, len(contents) - 1)]
+        assert sorted(ranges) == sorted(expected)
+    else:
+        assert ranges == ['bytes=0-{0}'.format(third - 1), None]
+    stdout, stderr = capsys.readouterr()
+    assert not stdout
+    assert stderr.endswith(' {0} bytes\n'.format(len(contents)))
+
+
+def test_segments_probe_error(monkeypatch, tmpdir, caplog):
+    """Test that network errors probing Range support are retried and then handled.
+
+    :param monkeypatch: pytest fixture.
+    :param tmpdir: pytest fixture.
+    :param caplog: pytest extension fixture.
+    """
+    monkeypatch.setattr('appveyor_artifacts.time.sleep', lambda _: None)
+    session = open_session(dict(attempts='2'))
+    requested = list()
+
+    def get(url, **_):
+        """Fail like a connection reset.
+
+        :param str url: Requested URL.
+        """
+        requested.append(url)
+        raise requests.ConnectionError('Connection reset by peer')
+    monkeypatch.setattr(session, 'get', get)
+
+    url = 'https://ci.appveyor.com/api/buildjobs/abc1def2ghi3jkl4/artifacts/appveyor_artifacts.py'
+    local_path = tmpdir.join('appveyor_artifacts.py')
+    with pytest.raises(HandledError):
+        download_file(dict(dir=str(tmpdir), segments='2', split_above='10'), str(local_path), url, 100)
+
+    assert requested == [url, url]
+    assert session.retries == 1
+    records = [r.message for r in caplog.records if r.levelname in ('ERROR', 'WARNING')]
+    assert records[::2] == ['Unable to connect to server.'] * 2
+    assert records[1].startswith('Network error, retrying in ')
+    assert not local_path.check()
+
+
+@pytest.mark.httpretty
+def test_segments_resume(tmpdir):
+    """Test that only missing byte ranges are downloaded after an interruption.
+
+    :param tmpdir: pytest fixture.
+    """
+    source_file = py.path.local(__file__).dirpath().join('..', 'appveyor_artifacts.py')
+    contents = source_file.read(mode='rb')
+    url = 'https://ci.appveyor.com/api/buildjobs/abc1def2ghi3jkl4/artifacts/appveyor_artifacts.py'
+    ranges = list()
+
+    def callback(request, _, response_headers):
+        """Honor Range requests.
+
+        :param request: httpretty request.
+        :param str _: URL.
+        :param dict response_headers: Response headers.
+        """
+        ranges.append(request.headers['Range'])
+        start, end = (int(i) for i in request.headers['Range'][6:].split('-'))
+        return 206, response_headers, contents[start:end + 1]
+    httpretty.register_uri(httpretty.GET, url, body=callback)
+
+    # First half was downloaded by a previous run.
+    half = -(-len(contents) // 2)
+    tmpdir.join('appveyor_artifacts.py.part').write(contents[:half] + b'\0' * (len(contents) - half), mode='wb')
+    state = dict(url=url, size=len(contents), etag='', done=[0])
+    tmpdir.join('appveyor_artifacts.py.part.json').write(json.dumps(state))
+
+    local_path = tmpdir.join('appveyor_artifacts.py')
+    config = dict(dir=str(tmpdir), segments='2', split_above='1024')
+    download_file(config, str(local_path), url, len(contents))
+
+    assert ranges == ['bytes={0}-{1}'.format(half, len(contents) - 1)]
+    assert local_path.computehash() == source_file.computehash()
+
+
+@pytest.mark.httpretty
+@pytest.mark.parametrize('resume', [False, True])
+def test_mangle(monkeypatch, tmpdir, resume):
+    """Test substituting coverage paths while downloading, or afterwards when resuming.
+
+    :param monkeypatch: pytest fixture.
+    :param tmpdir: pytest fixture.
+    :param bool resume: Resume a partial download from a previous run.
+    """
+    monkeypatch.chdir(tmpdir)
+    monkeypatch.setattr('appveyor_artifacts.IO_BLOCK', 7)  # Paths span blocks.
+    tmpdir.join('a.py').ensure()
+    contents = (
+        b'!coverage.py: This is a private format, don\'t read it directly!{"lines":{"C:\\\\projects\\\\repo\\\\a.py":'
+        b'[1,2,3]}}'
+    )
+    expected = '!coverage.py: This is a private format, don\'t read it directly!{"lines":{"%s":[1,2,3]}}' % (
+        tmpdir.join('a.py'))
+    url = 'https://ci.appveyor.com/api/buildjobs/abc1def2ghi3jkl4/artifacts/.coverage'
+
+    def callback(request, _, response_headers):
+        """Honor Range requests."""
+        if request.headers.get('Range'):
+            return 206, response_headers, contents[int(request.headers['Range'][6:-1]):]
+        return 200, response_headers, contents
+    httpretty.register_uri(httpretty.GET, url, body=callback)
+    mangled = list()
+
+    local_path = tmpdir.join('.coverage')
+    if resume:
+        tmpdir.join('.coverage.part').write(contents[:50], mode='wb')
+        tmpdir.join('.coverage.part.json').write(json.dumps(dict(url=url, size=len(contents), etag='')))
+    download_file(dict(dir=str(tmpdir), path_map=''), str(local_path), url, len(contents),
+                  mangle=lambda p: mangled.append(p) or py.path.local(p).write(expected))
+
+    assert local_path.read() == expected
+    assert mangled == ([str(local_path)] if resume else [])
+    assert sorted(i.basename for i in tmpdir.listdir()) == ['.coverage', 'a.py']
+
+
+@pytest.mark.httpretty
+def test_mangle_merge(monkeypatch, tmpdir):
+    """Test merging paths rewritten to the same local file while downloading, instead of writing duplicate keys.
+
+    :param monkeypatch: pytest fixture.
+    :param tmpdir: pytest fixture.
+    """
+    monkeypatch.chdir(tmpdir)
+    tmpdir.join('src', 'a.py').ensure()
+    contents = (
+        b'!coverage.py: {"lines":{"C:\\\\projects\\\\repo\\\\src\\\\a.py":[1],'
+        b'"C:\\\\Python27\\\\Lib\\\\site-packages\\\\src\\\\a.py":[2,3]}}'
+    )
+    url = 'https://ci.appveyor.com/api/buildjobs/abc1def2ghi3jkl4/artifacts/.coverage'
+    httpretty.register_uri(httpretty.GET, url, body=contents)
+    config = dict(dir=str(tmpdir), path_map='C:\\projects\\*\\src,C:\\Python27\\Lib\\site-packages\\src=src')
+
+    local_path = tmpdir.join('.coverage')
+    digest = download_file(config, str(local_path), url, len(contents), mangle=list)
+    data = local_path.read()
+    assert json.loads(data[data.index('{'):]) == dict(lines={str(tmpdir.join('src', 'a.py')): [1, 2, 3]})
+    assert digest is None  # Rewritten after hashing.
+    assert sorted(i.basename for i in tmpdir.listdir()) == ['.coverage', 'src']
+
+
+@pytest.mark.httpretty
+def test_mangle_missing(monkeypatch, tmpdir, caplog):
+    """Test missing coverage source files found while downloading.
+
+    :param monkeypatch: pytest fixture.
+    :param tmpdir: pytest fixture.
+    :param caplog: pytest extension fixture.
+    """
+    monkeypatch.chdir(tmpdir)
+    contents = b'!coverage.py: {"lines":{"C:\\\\projects\\\\repo\\\\a.py":[1],"C:\\\\projects\\\\repo\\\\b.py":[2]}}'
+    url = 'https://ci.appveyor.com/api/buildjobs/abc1def2ghi3jkl4/artifacts/.coverage'
+    httpretty.register_uri(httpretty.GET, url, body=contents)
+
+    with pytest.raises(HandledError):
+        download_file(dict(dir=str(tmpdir)), str(tmpdir.join('.coverage')), url, len(contents), mangle=list)
+    errors = [r.message for r in caplog.records if r.levelname == 'ERROR']
+    assert errors == ['No such file: {0}'.format(tmpdir.join(n)) for n in ('a.py', 'b.py')]
+    assert not tmpdir.listdir()
+
+
+@pytest.mark.httpretty
+@pytest.mark.parametrize('hardlink', [True, False])
+def test_artifact_cache(monkeypatch, capsys, tmpdir, hardlink):
+    """Test populating the artifact cache and reusing it in a later run.
+
+    :param monkeypatch: pytest fixture.
+    :param capsys: pytest fixture.
+    :param tmpdir: pytest fixture.
+    :param bool hardlink: Filesystem supports hardlinks.
+    """
+    if not hardlink:
+        def link(*_):
+            """Simulate a filesystem without hardlinks."""
+            raise OSError('Operation not permitted')
+        monkeypatch.setattr('os.link', link)
+    contents = b'0123456789' * 100
+    url = 'https://ci.appveyor.com/api/buildjobs/abc1def2ghi3jkl4/artifacts/file.bin'
+    httpretty.register_uri(httpretty.GET, url, body=contents)
+    cache = tmpdir.join('cache')
+    config = dict(dir=str(tmpdir), artifact_cache=str(cache), artifact_cache_size='1500')
+    mangled = list()
+
+    # Miss.
+    download_file(config, str(tmpdir.join('one', 'file.bin')), url, len(contents), mangle=mangled.append)
+    assert len(httpretty.latest_requests()) == 1
+    entries = [i for i in cache.listdir() if i.ext == '.bin']
+    assert len(entries) == 1
+    assert entries[0].read_binary() == contents
+    assert (entries[0].stat().nlink == 2) is hardlink
+
+    # Hit.
+    download_file(config, str(tmpdir.join('two', 'file.bin')), url, len(contents), mangle=mangled.append)
+    assert len(httpretty.latest_requests()) == 1
+    assert tmpdir.join('two', 'file.bin').read_binary() == contents
+    assert (entries[0].stat().nlink == 3) is hardlink
+    assert mangled == [str(tmpdir.join(d, 'file.bin')) for d in ('one', 'two')]
+    stderr = capsys.readouterr()[1]
+    assert stderr.splitlines()[-1] == ' => {0} 1000 bytes (cached)'.format(os.path.join('two', 'file.bin'))
+
+    # Different size is a different artifact, evicts the older one.
+    contents = contents[:600]
+    httpretty.register_uri(httpretty.GET, url, body=contents)
+    download_file(config, str(tmpdir.join('three', 'file.bin')), url, len(contents))
+    assert len(httpretty.latest_requests()) == 2
+    assert [i.size() for i in cache.listdir() if i.ext == '.bin'] == [600]
+    assert tmpdir.join('one', 'file.bin').read_binary() == b'0123456789' * 100
+
+
+@pytest.mark.httpretty
+@pytest.mark.parametrize('io_block', [1000, 4096, 65536])
+@pytest.mark.parametrize('encoding', ['', 'gzip'])
+def test_io_block(monkeypatch, capsys, tmpdir, io_block, encoding):
+    """Test reading and writing in IO_BLOCK sized blocks into a reused buffer.
+
+    :param monkeypatch: pytest fixture.
+    :param capsys: pytest fixture.
+    :param tmpdir: pytest fixture.
+    :param int io_block: Mocked IO_BLOCK.
+    :param str encoding: Content-Encoding of the response.
+    """
+    monkeypatch.setattr('appveyor_artifacts.IO_BLOCK', io_block)
+    contents = bytes(bytearray(i % 251 for i in range(10000)))
+    url = 'https://ci.appveyor.com/api/buildjobs/abc1def2ghi3jkl4/artifacts/file.bin'
+    if encoding:
+        compressed = io.BytesIO()
+        with gzip.GzipFile(fileobj=compressed, mode='wb') as handle:
+            handle.write(contents)
+        httpretty.register_uri(httpretty.GET, url, body=compressed.getvalue(), content_encoding=encoding)
+    else:
+        httpretty.register_uri(httpretty.GET, url, body=contents)
+
+    local_path = tmpdir.join('file.bin')
+    digest = download_file(dict(dir=str(tmpdir)), str(local_path), url, len(contents))
+    assert local_path.read_binary() == contents
+    assert digest == hashlib.sha256(contents).hexdigest()
+    assert capsys.readouterr()[1] == ' => file.bin 10000 bytes\n'
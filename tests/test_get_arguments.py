@@ -26,18 +26,40 @@ def different_cli_argv():
     argv = []
     expected = {
         'always_job_dirs': False,
+        'api_jobs': '',
+        'artifact_cache': '',
+        'artifact_cache_size': '',
+        'attempts': '',
+        'backoff': '',
+        'cache_dir': '',
+        'cache_size': '',
+        'checksums': '',
+        'combine': '',
         'commit': '',
         'dir': '',
+        'from_plan': '',
         'ignore_errors': False,
         'job_name': '',
+        'jobs': '',
         'mangle_coverage': False,
         'no_job_dirs': '',
+        'no_keep_alive': False,
         'owner': '',
+        'path_map': '',
+        'pipeline': False,
+        'plan': '',
+        'pool_size': '',
         'pull_request': '',
         'raise': False,
         'repo': '',
+        'retry_budget': '',
+        'segments': '',
+        'split_above': '',
+        'sync': False,
         'tag': '',
+        'timeout': '',
         'verbose': False,
+        'verify': '',
     }
     yield argv, expected
 
@@ -49,47 +71,111 @@ def different_cli_argv():
         '-o', 'me',
         '-p', '1',
         '-t', 'v1.0.0',
+        '--timeout', '3600',
     ]
     expected = {
         'always_job_dirs': True,
+        'api_jobs': '',
+        'artifact_cache': '',
+        'artifact_cache_size': '',
+        'attempts': '',
+        'backoff': '',
+        'cache_dir': '',
+        'cache_size': '',
+        'checksums': '',
+        'combine': '',
         'commit': 'abc1234',
         'dir': '',
         'job_name': '',
+        'jobs': '',
         'mangle_coverage': False,
         'no_job_dirs': '',
+        'no_keep_alive': False,
         'owner': 'me',
+        'path_map': '',
+        'pipeline': False,
+        'plan': '',
+        'pool_size': '',
         'pull_request': '1',
         'raise': False,
         'repo': 'koala',
+        'retry_budget': '',
+        'segments': '',
+        'split_above': '',
+        'sync': False,
         'tag': 'v1.0.0',
+        'timeout': '3600',
         'verbose': False,
+        'verify': '',
+        'from_plan': '',
         'ignore_errors': False,
     }
     yield argv, expected
 
     # Finally the user specifies the remaining unused arguments.
     argv = [
+        '--api-jobs', '8',
+        '--artifact-cache', '/tmp/artifacts',
+        '--artifact-cache-size', '4096',
+        '--attempts', '5',
+        '--backoff', '2',
         '-C', '/tmp',
+        '--cache-dir', '/tmp/cache',
+        '--cache-size', '1024',
+        '--checksums', 'sums.txt',
+        '--combine', 'combined.coverage',
         '-i',
+        '--jobs', '4',
         '-J', 'overwrite',
         '-m',
         '-N', r'Environment: PYTHON=C:\Python27',
+        '--no-keep-alive',
+        '--path-map', 'C:\\build\\*\\=src',
+        '-P',
+        '--plan', 'plan.json',
+        '--pool-size', '4',
+        '--retry-budget', '0',
+        '--segments', '8',
+        '--split-above', '1048576',
+        '--sync',
         '-v',
     ]
     expected = {
         'always_job_dirs': False,
+        'api_jobs': '8',
+        'artifact_cache': '/tmp/artifacts',
+        'artifact_cache_size': '4096',
+        'attempts': '5',
+        'backoff': '2',
+        'cache_dir': '/tmp/cache',
+        'cache_size': '1024',
+        'checksums': 'sums.txt',
+        'combine': 'combined.coverage',
         'commit': '',
         'dir': '/tmp',
+        'from_plan': '',
         'ignore_errors': True,
         'job_name': r'Environment: PYTHON=C:\Python27',
+        'jobs': '4',
         'mangle_coverage': True,
         'no_job_dirs': 'overwrite',
+        'no_keep_alive': True,
         'owner': '',
+        'path_map': 'C:\\build\\*\\=src',
+        'pipeline': True,
+        'plan': 'plan.json',
+        'pool_size': '4',
         'pull_request': '',
         'raise': False,
         'repo': '',
+        'retry_budget': '0',
+        'segments': '8',
+        'split_above': '1048576',
+        'sync': True,
         'tag': '',
+        'timeout': '',
         'verbose': True,
+        'verify': '',
     }
     yield argv, expected
 
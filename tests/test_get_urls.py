@@ -15,10 +15,10 @@ def test_instant_success(monkeypatch, artifacts):
     :param monkeypatch: pytest fixture.
     :param bool artifacts: If simulation should have or lack artifacts.
     """
-    monkeypatch.setattr('appveyor_artifacts.query_build_version', lambda _: '1.0.1')
+    monkeypatch.setattr('appveyor_artifacts.query_build_version', lambda _, **__: '1.0.1')
     monkeypatch.setattr('appveyor_artifacts.query_job_ids', lambda *_: [('abc1def2ghi3jkl4', 'success')])
     monkeypatch.setattr('appveyor_artifacts.query_artifacts',
-                        lambda _: [('abc1def2ghi3jkl4', 'README.md', 1234)] if artifacts else [])
+                        lambda *_, **__: [('abc1def2ghi3jkl4', 'README.md', 1234)] if artifacts else [])
 
     config = dict(always_job_dirs=False, no_job_dirs=None, dir=None)
     actual = get_urls(config)
@@ -36,9 +36,9 @@ def test_wait_for_job_queue(monkeypatch, caplog, timeout):
     """
     answers = [None, '1.0.1']
     monkeypatch.setattr('appveyor_artifacts.SLEEP_FOR', 0.01)
-    monkeypatch.setattr('appveyor_artifacts.query_build_version', lambda _: None if timeout else answers.pop(0))
+    monkeypatch.setattr('appveyor_artifacts.query_build_version', lambda _, **__: None if timeout else answers.pop(0))
     monkeypatch.setattr('appveyor_artifacts.query_job_ids', lambda *_: [('abc1def2ghi3jkl4', 'success')])
-    monkeypatch.setattr('appveyor_artifacts.query_artifacts', lambda _: list())
+    monkeypatch.setattr('appveyor_artifacts.query_artifacts', lambda *_, **__: list())
 
     if timeout:
         with pytest.raises(HandledError):
@@ -66,9 +66,10 @@ def test_queued_running_success_or_failed(monkeypatch, caplog, success):
     """
     answers = (['bad'] if success is None else []) + ['queued', 'running'] + (['success'] if success else ['failed'])
     monkeypatch.setattr('appveyor_artifacts.SLEEP_FOR', 0.01)
-    monkeypatch.setattr('appveyor_artifacts.query_build_version', lambda _: '1.0.1')
+    monkeypatch.setattr('appveyor_artifacts.query_build_version', lambda _, **__: '1.0.1')
     monkeypatch.setattr('appveyor_artifacts.query_job_ids', lambda *_: [('abc1def2ghi3jkl4', answers.pop(0))])
-    monkeypatch.setattr('appveyor_artifacts.query_artifacts', lambda _: [('abc1def2ghi3jkl4', 'README.md', 1234)])
+    monkeypatch.setattr('appveyor_artifacts.query_artifacts',
+                        lambda *_, **__: [('abc1def2ghi3jkl4', 'README.md', 1234)])
 
     config = dict(always_job_dirs=False, no_job_dirs=None, dir=None, owner='me', repo='project')
     if not success:
@@ -94,3 +95,70 @@ def test_queued_running_success_or_failed(monkeypatch, caplog, success):
             'Found 1 artifact.',
         ]
     assert messages == expected
+
+
+def test_on_success(monkeypatch, caplog):
+    """Test reporting jobs as soon as they succeed.
+
+    :param monkeypatch: pytest fixture.
+    :param caplog: pytest extension fixture.
+    """
+    answers = [
+        [('v5wnn9k8auqcqovw', 'running'), ('bpgcbvqmawv1jw06', 'success')],
+        [('v5wnn9k8auqcqovw', 'success'), ('bpgcbvqmawv1jw06', 'success')],
+    ]
+    monkeypatch.setattr('appveyor_artifacts.SLEEP_FOR', 0.01)
+    monkeypatch.setattr('appveyor_artifacts.query_build_version', lambda _, **__: '1.0.1')
+    monkeypatch.setattr('appveyor_artifacts.query_job_ids', lambda *_: answers.pop(0))
+    monkeypatch.setattr('appveyor_artifacts.query_artifacts', lambda *_, **__: pytest.fail('Queried again.'))
+
+    finished = list()
+
+    def on_success(job):
+        """Record finished job.
+
+        :param str job: AppVeyor jobID.
+        """
+        finished.append(job)
+        return [(job, 'README.md', len(finished))]
+
+    config = dict(always_job_dirs=False, no_job_dirs='rename', dir=None)
+    actual = get_urls(config, on_success=on_success)
+    expected = {
+        py.path.local('README.md'): (PREFIX % ('v5wnn9k8auqcqovw', 'README.md'), 2),
+        py.path.local('README_.md'): (PREFIX % ('bpgcbvqmawv1jw06', 'README.md'), 1),
+    }
+    assert actual == expected
+    assert finished == ['bpgcbvqmawv1jw06', 'v5wnn9k8auqcqovw']
+
+    messages = [r.message for r in caplog.records if r.levelname != 'DEBUG']
+    assert messages == ['Waiting for jobs to finish...', 'Build successful. Found 2 jobs.', 'Found 2 artifacts.']
+
+
+@pytest.mark.parametrize('queued', [True, False])
+def test_timeout(monkeypatch, caplog, queued):
+    """Test --timeout while waiting for the job to be queued and while waiting for jobs to finish.
+
+    :param monkeypatch: pytest fixture.
+    :param caplog: pytest extension fixture.
+    :param bool queued: Job gets queued but never finishes.
+    """
+    monkeypatch.setattr('appveyor_artifacts.SLEEP_FOR', 0.01)
+    monkeypatch.setattr('appveyor_artifacts.query_build_version', lambda _, **__: '1.0.1' if queued else None)
+    monkeypatch.setattr('appveyor_artifacts.query_job_ids', lambda *_: [('abc1def2ghi3jkl4', 'running')])
+    monkeypatch.setattr('appveyor_artifacts.poll_interval', lambda *_: 10)
+    clock = type('Clock', (), dict(now=0))
+    monkeypatch.setattr('appveyor_artifacts.time', type('Time', (), dict(
+        time=staticmethod(lambda: clock.now),
+        sleep=staticmethod(lambda s: setattr(clock, 'now', clock.now + s)),
+    )))
+
+    with pytest.raises(HandledError):
+        get_urls(dict(owner='me', repo='project', timeout='60'))
+
+    messages = [r.message for r in caplog.records if r.levelname != 'DEBUG']
+    if queued:
+        assert messages == ['Waiting for job to finish...'] * 7 + ['Timed out waiting for job to finish.']
+    else:
+        assert messages[:-1] == ['Waiting for job to be queued...'] * 7
+        assert messages[-1] == 'Timed out waiting for job to be queued or build not found.'
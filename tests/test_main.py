@@ -1,6 +1,10 @@
 """Test main() function."""
 
+import hashlib
+import json
+import logging
 import os
+import sqlite3
 from distutils.spawn import find_executable
 
 import httpretty
@@ -47,14 +51,14 @@ def test_one_file(capsys, monkeypatch, tmpdir, caplog):
 
     messages = [r.message for r in caplog.records if r.levelname != 'DEBUG']
     expected = [
-        'Downloading file (1 dot ~ 1 KiB):',
+        'Downloading file:',
         'Downloaded 1 file(s), 1234 bytes total.',
     ]
     assert messages == expected
 
     stdout, stderr = capsys.readouterr()
     assert not stdout
-    assert stderr == ' => README.md .. 1234 bytes\n'
+    assert stderr == ' => README.md 1234 bytes\n'
 
 
 @pytest.mark.httpretty
@@ -80,17 +84,17 @@ def test_multiple_files(capsys, monkeypatch, tmpdir, caplog):
 
     messages = [r.message for r in caplog.records if r.levelname != 'DEBUG']
     expected = [
-        'Downloading files (1 dot ~ 10 KiB):',
+        'Downloading files:',
         'Downloaded 4 file(s), 802468 bytes total.',
     ]
     assert messages == expected
 
     stdout, stderr = capsys.readouterr()
     expected = (
-        ' => one.bin .. 12345 bytes\n'
-        ' => three.bin ............ 123456 bytes\n'
-        ' => eleven.bin ............ 123457 bytes\n'
-        ' => eighteen.bin ................................................... 543210 bytes\n'
+        ' => one.bin 12345 bytes\n'
+        ' => three.bin 123456 bytes\n'
+        ' => eleven.bin 123457 bytes\n'
+        ' => eighteen.bin 543210 bytes\n'
     )
     assert not stdout
     assert stderr == expected
@@ -120,18 +124,18 @@ def test_small_files(capsys, monkeypatch, tmpdir, caplog):
 
     messages = [r.message for r in caplog.records if r.levelname != 'DEBUG']
     expected = [
-        'Downloading files (1 dot ~ 1 KiB):',
+        'Downloading files:',
         'Downloaded 5 file(s), 93 bytes total.',
     ]
     assert messages == expected
 
     stdout, stderr = capsys.readouterr()
     expected = (
-        ' => twenty.bin . 3 bytes\n'
-        ' => eighteen.bin . 6 bytes\n'
-        ' => eleven.bin . 17 bytes\n'
-        ' => three.bin . 28 bytes\n'
-        ' => one.bin . 39 bytes\n'
+        ' => twenty.bin 3 bytes\n'
+        ' => eighteen.bin 6 bytes\n'
+        ' => eleven.bin 17 bytes\n'
+        ' => three.bin 28 bytes\n'
+        ' => one.bin 39 bytes\n'
     )
     assert not stdout
     assert stderr == expected
@@ -158,20 +162,385 @@ def test_large_files(capsys, monkeypatch, tmpdir, caplog):
 
     messages = [r.message for r in caplog.records if r.levelname != 'DEBUG']
     expected = [
-        'Downloading files (1 dot ~ 1024 KiB):',
+        'Downloading files:',
         'Downloaded 2 file(s), 130023424 bytes total.',
     ]
     assert messages == expected
 
     stdout, stderr = capsys.readouterr()
     expected = (
-        ' => fifty_three.bin ..................................................... 55574528 bytes\n'
-        ' => seventy_one.bin ....................................................................... 74448896 bytes\n'
+        ' => fifty_three.bin 55574528 bytes\n'
+        ' => seventy_one.bin 74448896 bytes\n'
     )
     assert not stdout
     assert stderr == expected
 
 
+@pytest.mark.httpretty
+def test_concurrent(capsys, monkeypatch, tmpdir, caplog):
+    """Test downloading multiple files with --jobs.
+
+    :param capsys: pytest fixture.
+    :param monkeypatch: pytest fixture.
+    :param tmpdir: pytest fixture.
+    :param caplog: pytest extension fixture.
+    """
+    paths_and_urls = {
+        str(tmpdir.join('one.bin')): (PREFIX % ('abc1def2ghi3jkl4', 'one.bin'), 12345),
+        str(tmpdir.join('sub', 'three.bin')): (PREFIX % ('abc1def2ghi3jkl4', 'sub/three.bin'), 123456),
+        str(tmpdir.join('sub', 'eleven.bin')): (PREFIX % ('abc1def2ghi3jkl4', 'sub/eleven.bin'), 123457),
+        str(tmpdir.join('eighteen.bin')): (PREFIX % ('abc1def2ghi3jkl4', 'eighteen.bin'), 543210),
+    }
+    for url, body in ((u, iter(['.' * s])) for u, s in paths_and_urls.values()):
+        httpretty.register_uri(httpretty.GET, url, body=body, streaming=True)
+    monkeypatch.setattr('appveyor_artifacts.get_urls', lambda _: paths_and_urls)
+    monkeypatch.setattr('appveyor_artifacts.validate', lambda _: None)
+    appveyor_artifacts.main(dict(dir=str(tmpdir), jobs='3', mangle_coverage=False))
+
+    messages = [r.message for r in caplog.records if r.levelname != 'DEBUG']
+    expected = [
+        'Downloading files:',
+        'Downloaded 4 file(s), 802468 bytes total.',
+    ]
+    assert messages == expected
+    for path, (_, size) in paths_and_urls.items():
+        assert py.path.local(path).size() == size
+
+    stdout, stderr = capsys.readouterr()
+    assert not stdout
+    assert sorted(stderr.splitlines()) == [
+        ' => eighteen.bin 543210 bytes',
+        ' => one.bin 12345 bytes',
+        ' => sub/eleven.bin 123457 bytes',
+        ' => sub/three.bin 123456 bytes',
+    ]
+
+
+@pytest.mark.httpretty
+def test_concurrent_error(monkeypatch, tmpdir, caplog):
+    """Test that --jobs stops at the first failed download.
+
+    :param monkeypatch: pytest fixture.
+    :param tmpdir: pytest fixture.
+    :param caplog: pytest extension fixture.
+    """
+    paths_and_urls = {
+        str(tmpdir.join('one.bin')): (PREFIX % ('abc1def2ghi3jkl4', 'one.bin'), 12345),
+        str(tmpdir.join('three.bin')): (PREFIX % ('abc1def2ghi3jkl4', 'three.bin'), 123456),
+    }
+    for url, body in ((u, iter(['.' * s])) for u, s in paths_and_urls.values()):
+        httpretty.register_uri(httpretty.GET, url, body=body, streaming=True)
+    tmpdir.join('one.bin').ensure()
+    monkeypatch.setattr('appveyor_artifacts.get_urls', lambda _: paths_and_urls)
+    monkeypatch.setattr('appveyor_artifacts.validate', lambda _: None)
+    with pytest.raises(appveyor_artifacts.HandledError):
+        appveyor_artifacts.main(dict(dir=str(tmpdir), jobs='2', mangle_coverage=False))
+
+    messages = [r.message for r in caplog.records if r.levelname == 'ERROR']
+    assert messages == ['File already exists: ' + str(tmpdir.join('one.bin'))]
+
+
+@pytest.mark.httpretty
+@pytest.mark.parametrize('jobs', ['1', '2'])
+def test_sync(monkeypatch, tmpdir, caplog, jobs):
+    """Test that --sync only downloads missing or changed files in later runs.
+
+    :param monkeypatch: pytest fixture.
+    :param tmpdir: pytest fixture.
+    :param caplog: pytest extension fixture.
+    :param str jobs: --jobs value.
+    """
+    paths_and_urls = {
+        str(tmpdir.join('one.bin')): (PREFIX % ('abc1def2ghi3jkl4', 'one.bin'), 100),
+        str(tmpdir.join('sub', 'two.bin')): (PREFIX % ('abc1def2ghi3jkl4', 'sub/two.bin'), 200),
+        str(tmpdir.join('three.bin')): (PREFIX % ('abc1def2ghi3jkl4', 'three.bin'), 300),
+        str(tmpdir.join('four.bin')): (PREFIX % ('abc1def2ghi3jkl4', 'four.bin'), 400),
+    }
+    for url, size in paths_and_urls.values():
+        httpretty.register_uri(httpretty.GET, url, body='.' * size)
+    monkeypatch.setattr('appveyor_artifacts.get_urls', lambda _: paths_and_urls)
+    monkeypatch.setattr('appveyor_artifacts.validate', lambda _: None)
+    config = dict(dir=str(tmpdir), jobs=jobs, mangle_coverage=False, sync=True)
+
+    # First run into a workspace with one file from a run without --sync and one unrelated file.
+    tmpdir.join('one.bin').write('.' * 100)
+    tmpdir.join('three.bin').write('x' * 3)
+    appveyor_artifacts.main(config)
+    assert len(httpretty.latest_requests()) == 3
+    assert tmpdir.join('three.bin').read() == '.' * 300
+    state = json.loads(tmpdir.join('.appveyor-artifacts.json').read())
+    assert sorted(state['files']) == sorted(os.path.relpath(p, str(tmpdir)) for p in paths_and_urls)
+
+    # Warm run, nothing to download.
+    appveyor_artifacts.main(config)
+    assert len(httpretty.latest_requests()) == 3
+    assert [r.message for r in caplog.records if r.levelname == 'INFO'][-1] == 'Skipped 4 up to date file(s).'
+
+    # Locally modified file and an artifact from a newer job.
+    tmpdir.join('one.bin').write('y' * 100)
+    os.utime(str(tmpdir.join('one.bin')), (1000, 1000))
+    paths_and_urls[str(tmpdir.join('four.bin'))] = (PREFIX % ('mno5pqr6stu7vwx8', 'four.bin'), 400)
+    httpretty.register_uri(httpretty.GET, PREFIX % ('mno5pqr6stu7vwx8', 'four.bin'), body='z' * 400)
+    appveyor_artifacts.main(config)
+    assert len(httpretty.latest_requests()) == 5
+    assert tmpdir.join('one.bin').read() == '.' * 100
+    assert tmpdir.join('four.bin').read() == 'z' * 400
+    assert [r.message for r in caplog.records if r.levelname == 'INFO'][-1] == 'Skipped 2 up to date file(s).'
+
+
+@pytest.mark.httpretty
+def test_sync_artifact_cache(monkeypatch, tmpdir):
+    """Test that --sync workspaces stay up to date while other runs load their hardlinked --artifact-cache entries.
+
+    :param monkeypatch: pytest fixture.
+    :param tmpdir: pytest fixture.
+    """
+    url = PREFIX % ('abc1def2ghi3jkl4', 'one.bin')
+    httpretty.register_uri(httpretty.GET, url, body='.' * 100)
+    monkeypatch.setattr('appveyor_artifacts.validate', lambda _: None)
+    cache = tmpdir.join('cache')
+
+    def run(workspace):
+        """Download one.bin into a workspace.
+
+        :param py.path.local workspace: Download directory.
+        """
+        workspace.ensure(dir=True)
+        monkeypatch.setattr('appveyor_artifacts.get_urls', lambda _: {str(workspace.join('one.bin')): (url, 100)})
+        appveyor_artifacts.main(dict(artifact_cache=str(cache), dir=str(workspace), mangle_coverage=False, sync=True))
+
+    run(tmpdir.join('first'))
+    assert len(httpretty.latest_requests()) == 1
+    cache_entry = cache.listdir(lambda p: p.ext == '.bin')[0]
+    os.utime(str(cache_entry), (1000, 1000))  # A run that loaded the entry earlier.
+
+    run(tmpdir.join('second'))  # Loads the entry from the cache, touching its mtime.
+    assert len(httpretty.latest_requests()) == 1
+    sync = appveyor_artifacts.SyncState(str(tmpdir.join('first')), logging.getLogger(__name__))
+    assert sync.up_to_date(str(tmpdir.join('first', 'one.bin')), url, 100)
+
+
+@pytest.mark.httpretty
+def test_pipeline(capsys, monkeypatch, tmpdir, caplog):
+    """Test downloading artifacts of finished jobs while other jobs are still running.
+
+    :param capsys: pytest fixture.
+    :param monkeypatch: pytest fixture.
+    :param tmpdir: pytest fixture.
+    :param caplog: pytest extension fixture.
+    """
+    answers = [
+        [('v5wnn9k8auqcqovw', 'running'), ('bpgcbvqmawv1jw06', 'success')],
+        [('v5wnn9k8auqcqovw', 'success'), ('bpgcbvqmawv1jw06', 'success')],
+    ]
+    listings = {
+        'v5wnn9k8auqcqovw': [('v5wnn9k8auqcqovw', 'file.txt', 10), ('v5wnn9k8auqcqovw', 'sub/one.txt', 11)],
+        'bpgcbvqmawv1jw06': [('bpgcbvqmawv1jw06', 'file.txt', 20)],
+    }
+    for job, file_name, size in listings['v5wnn9k8auqcqovw'] + listings['bpgcbvqmawv1jw06']:
+        httpretty.register_uri(httpretty.GET, PREFIX % (job, file_name), body=job[0] * size)
+    monkeypatch.setattr('appveyor_artifacts.SLEEP_FOR', 0.01)
+    monkeypatch.setattr('appveyor_artifacts.validate', lambda _: None)
+    monkeypatch.setattr('appveyor_artifacts.query_build_version', lambda _, **__: '1.0.1')
+    monkeypatch.setattr('appveyor_artifacts.query_job_ids', lambda *_: answers.pop(0))
+    monkeypatch.setattr('appveyor_artifacts.query_artifacts', lambda job_ids, **_: listings[job_ids[0]])
+
+    config = dict(always_job_dirs=False, no_job_dirs='rename', dir=str(tmpdir), mangle_coverage=False, pipeline=True)
+    appveyor_artifacts.main(config)
+
+    # Same paths as without pipelining even though the second job finished first.
+    assert sorted(i.relto(tmpdir) for i in tmpdir.visit()) == ['file.txt', 'file_.txt', 'sub', 'sub/one.txt']
+    assert tmpdir.join('file.txt').read() == 'v' * 10
+    assert tmpdir.join('file_.txt').read() == 'b' * 20
+    assert tmpdir.join('sub', 'one.txt').read() == 'v' * 11
+
+    messages = [r.message for r in caplog.records if r.levelname != 'DEBUG']
+    expected = [
+        'Job bpgcbvqmawv1jw06 finished, downloading 1 artifact.',
+        'Waiting for jobs to finish...',
+        'Job v5wnn9k8auqcqovw finished, downloading 2 artifacts.',
+        'Build successful. Found 2 jobs.',
+        'Found 3 artifacts.',
+        'Downloaded 3 file(s), 41 bytes total.',
+    ]
+    assert messages == expected
+
+    stdout, stderr = capsys.readouterr()
+    assert not stdout
+    assert stderr == ' => file.txt 10 bytes\n => file_.txt 20 bytes\n => sub/one.txt 11 bytes\n'
+
+
+@pytest.mark.httpretty
+def test_pipeline_sync(monkeypatch, tmpdir):
+    """Test that --pipeline with --sync doesn't stage artifacts of up to date files.
+
+    :param monkeypatch: pytest fixture.
+    :param tmpdir: pytest fixture.
+    """
+    listings = {
+        'v5wnn9k8auqcqovw': [('v5wnn9k8auqcqovw', 'file.txt', 10)],
+        'bpgcbvqmawv1jw06': [('bpgcbvqmawv1jw06', 'file.txt', 20)],
+    }
+    for job, file_name, size in listings['v5wnn9k8auqcqovw'] + listings['bpgcbvqmawv1jw06']:
+        httpretty.register_uri(httpretty.GET, PREFIX % (job, file_name), body=job[0] * size)
+    monkeypatch.setattr('appveyor_artifacts.validate', lambda _: None)
+    monkeypatch.setattr('appveyor_artifacts.query_build_version', lambda _, **__: '1.0.1')
+    monkeypatch.setattr('appveyor_artifacts.query_job_ids', lambda *_: [(j, 'success') for j in sorted(listings)])
+    monkeypatch.setattr('appveyor_artifacts.query_artifacts', lambda job_ids, **_: listings[job_ids[0]])
+    config = dict(always_job_dirs=False, no_job_dirs='rename', dir=str(tmpdir), mangle_coverage=False, pipeline=True,
+                  sync=True)
+
+    appveyor_artifacts.main(config)
+    assert len(httpretty.latest_requests()) == 2
+    appveyor_artifacts.main(config)
+    assert len(httpretty.latest_requests()) == 2
+
+    # Remove one file, only that one is downloaded again.
+    tmpdir.join('file.txt').remove()
+    appveyor_artifacts.main(config)
+    assert len(httpretty.latest_requests()) == 3
+    assert tmpdir.join('file.txt').read() == 'b' * 20
+    assert tmpdir.join('file_.txt').read() == 'v' * 10
+    assert sorted(i.basename for i in tmpdir.listdir()) == ['.appveyor-artifacts.json', 'file.txt', 'file_.txt']
+
+
+@pytest.mark.httpretty
+@pytest.mark.parametrize('jobs', ['1', '2'])
+def test_checksums(monkeypatch, tmpdir, caplog, jobs):
+    """Test writing SHA-256 checksums while downloading and verifying them later.
+
+    :param monkeypatch: pytest fixture.
+    :param tmpdir: pytest fixture.
+    :param caplog: pytest extension fixture.
+    :param str jobs: --jobs value.
+    """
+    paths_and_urls = {
+        str(tmpdir.join('one.bin')): (PREFIX % ('abc1def2ghi3jkl4', 'one.bin'), 12345),
+        str(tmpdir.join('sub', 'two.bin')): (PREFIX % ('abc1def2ghi3jkl4', 'sub/two.bin'), 200000),
+    }
+    for url, size in paths_and_urls.values():
+        httpretty.register_uri(httpretty.GET, url, body=url[-5] * size)
+    monkeypatch.setattr('appveyor_artifacts.get_urls', lambda _: paths_and_urls)
+    monkeypatch.setattr('appveyor_artifacts.validate', lambda _: None)
+    hash_file = appveyor_artifacts.hash_file
+    monkeypatch.setattr('appveyor_artifacts.hash_file', lambda _: pytest.fail('Hashed after downloading.'))
+    checksums = tmpdir.join('sums.txt')
+    config = dict(dir=str(tmpdir), jobs=jobs, mangle_coverage=False, checksums=str(checksums))
+    appveyor_artifacts.main(config)
+
+    expected = [
+        hashlib.sha256(b'e' * 12345).hexdigest() + '  one.bin\n',
+        hashlib.sha256(b'o' * 200000).hexdigest() + '  sub/two.bin\n',
+    ]
+    assert checksums.readlines() == expected
+    monkeypatch.setattr('appveyor_artifacts.hash_file', hash_file)
+
+    # Verify.
+    appveyor_artifacts.main(dict(dir=str(tmpdir), verify=str(checksums)))
+    assert [r.message for r in caplog.records if r.levelname == 'INFO'][-1] == 'Verified 2 file(s).'
+
+    # Verify modified tree.
+    tmpdir.join('one.bin').write('x', mode='a')
+    tmpdir.join('sub', 'two.bin').remove()
+    with pytest.raises(appveyor_artifacts.HandledError):
+        appveyor_artifacts.main(dict(dir=str(tmpdir), verify=str(checksums)))
+    messages = [r.message for r in caplog.records if r.levelname == 'ERROR']
+    assert messages[-3:] == [
+        'Checksum mismatch: ' + str(tmpdir.join('one.bin')),
+        'No such file: ' + str(tmpdir.join('sub', 'two.bin')),
+        '2 of 2 file(s) failed verification.',
+    ]
+
+
+@pytest.mark.httpretty
+@pytest.mark.parametrize('missing', [False, True])
+def test_mangle(monkeypatch, tmpdir, missing):
+    """Test mangling JSON coverage files while downloading and SQLite ones in worker processes.
+
+    :param monkeypatch: pytest fixture.
+    :param tmpdir: pytest fixture.
+    :param bool missing: Source file of the SQLite coverage file is missing.
+    """
+    monkeypatch.chdir(tmpdir)
+    tmpdir.join('a.py').ensure()
+    source = tmpdir.join('source.sqlite')
+    connection = sqlite3.connect(str(source))
+    with connection:
+        connection.execute('CREATE TABLE coverage_schema (version INTEGER)')
+        connection.execute('CREATE TABLE file (id INTEGER PRIMARY KEY, path TEXT, UNIQUE (path))')
+        connection.execute('INSERT INTO file (path) VALUES (?)', ('C:\\projects\\repo\\{0}'.format(
+            'missing.py' if missing else 'a.py'), ))
+    connection.close()
+    bodies = {
+        'json.coverage': b'!coverage.py: {"lines":{"C:\\\\projects\\\\repo\\\\a.py":[1]}}',
+        'sqlite.coverage': source.read(mode='rb'),
+    }
+    source.remove()
+    paths_and_urls = dict()
+    for name, body in bodies.items():
+        paths_and_urls[str(tmpdir.join('out', name))] = (PREFIX % ('abc1def2ghi3jkl4', name), len(body))
+        httpretty.register_uri(httpretty.GET, PREFIX % ('abc1def2ghi3jkl4', name), body=body)
+    monkeypatch.setattr('appveyor_artifacts.get_urls', lambda _: paths_and_urls)
+    monkeypatch.setattr('appveyor_artifacts.validate', lambda _: None)
+
+    if missing:
+        with pytest.raises(appveyor_artifacts.HandledError):
+            appveyor_artifacts.main(dict(dir=str(tmpdir), mangle_coverage=True))
+        return
+    appveyor_artifacts.main(dict(dir=str(tmpdir), jobs='2', mangle_coverage=True))
+
+    assert tmpdir.join('out', 'json.coverage').read() == '!coverage.py: {"lines":{"%s":[1]}}' % tmpdir.join('a.py')
+    connection = sqlite3.connect(str(tmpdir.join('out', 'sqlite.coverage')))
+    assert [r[0] for r in connection.execute('SELECT path FROM file')] == [str(tmpdir.join('a.py'))]
+    connection.close()
+
+
+@pytest.mark.httpretty
+def test_plan(capsys, monkeypatch, tmpdir, caplog):
+    """Test writing a plan without downloading and then downloading it without querying AppVeyor.
+
+    :param capsys: pytest fixture.
+    :param monkeypatch: pytest fixture.
+    :param tmpdir: pytest fixture.
+    :param caplog: pytest extension fixture.
+    """
+    jobs_artifacts = [('v5wnn9k8auqcqovw', 'file.txt', 10), ('bpgcbvqmawv1jw06', 'file.txt', 20)]
+    for job, file_name, size in jobs_artifacts:
+        httpretty.register_uri(httpretty.GET, PREFIX % (job, file_name), body=job[0] * size)
+    config = dict(always_job_dirs=False, no_job_dirs='skip', dir=str(tmpdir), mangle_coverage=False)
+    monkeypatch.setattr('appveyor_artifacts.get_urls', lambda c, actions: appveyor_artifacts.artifacts_urls(
+        c, jobs_artifacts, actions=actions))
+    monkeypatch.setattr('appveyor_artifacts.validate', lambda _: None)
+
+    # Plan.
+    plan = tmpdir.join('plan.json')
+    appveyor_artifacts.main(dict(config, plan=str(plan)))
+    manifest = json.loads(plan.read())
+    assert manifest['artifacts'] == [
+        dict(action='download', file_name='file.txt', job='v5wnn9k8auqcqovw', path=str(tmpdir.join('file.txt')),
+             size=10, url=PREFIX % ('v5wnn9k8auqcqovw', 'file.txt')),
+        dict(action='skip', file_name='file.txt', job='bpgcbvqmawv1jw06', path=None, size=20,
+             url=PREFIX % ('bpgcbvqmawv1jw06', 'file.txt')),
+    ]
+    assert (manifest['total_files'], manifest['total_size'], manifest['version']) == (1, 10, 1)
+    assert manifest['throughput'] > 0
+    assert manifest['eta'] == 10 / manifest['throughput']
+    assert [i.basename for i in tmpdir.listdir()] == ['plan.json']
+    assert caplog.records[-3].message.startswith('Planned 1 file(s), 10 bytes total, ETA ')
+
+    # Download.
+    monkeypatch.setattr('appveyor_artifacts.get_urls', None)
+    appveyor_artifacts.main(dict(config, from_plan=str(plan)))
+    assert tmpdir.join('file.txt').read() == 'v' * 10
+    messages = [r.message for r in caplog.records if r.levelname != 'DEBUG']
+    assert messages[-3:] == [
+        'Loaded plan for 1 file(s) from {0}'.format(plan),
+        'Downloading file:',
+        'Downloaded 1 file(s), 10 bytes total.',
+    ]
+    assert capsys.readouterr()[1] == ' => file.txt 10 bytes\n'
+
+
 @pytest.mark.skipif('(os.environ.get("CI"), os.environ.get("TRAVIS")) != ("true", "true")')
 @pytest.mark.parametrize('direct', [False, True])
 def test_subprocess(tmpdir, direct):
@@ -1,8 +1,16 @@
 """Test mangle_coverage() function."""
 
+import json
+import multiprocessing
+import os
+import sqlite3
+import time
+
 import pytest
 
-from appveyor_artifacts import HandledError, mangle_coverage
+from appveyor_artifacts import get_path_index, HandledError, mangle_coverage, MangleQueue
+
+HEADER = '!coverage.py: This is a private format, don\'t read it directly!'
 
 
 def test_not_coverage_file(tmpdir, caplog):
@@ -54,3 +62,289 @@ def test_success(tmpdir):
     mangle_coverage(str(local_path))
     assert local_path.computehash() != old_hash
     assert '"C:' not in local_path.read()
+
+
+def test_linear_scaling(monkeypatch, tmpdir):
+    """Benchmark many distinct paths, substituting must not rescan the file once per path.
+
+    :param monkeypatch: pytest fixture.
+    :param tmpdir: pytest fixture.
+    """
+    monkeypatch.chdir(tmpdir)
+    tmpdir.join('src').ensure_dir()
+
+    def run(count):
+        """Mangle a coverage file with `count` distinct paths and return the best time of three runs."""
+        arcs = ','.join('"C:\\\\projects\\\\repo\\\\src\\\\mod{0}.py":[[1,2],[-1,1]]'.format(i) for i in range(count))
+        contents = '!coverage.py: This is a private format, don\'t read it directly!{"arcs":{' + arcs + '}}'
+        for i in range(count):
+            tmpdir.join('src', 'mod{0}.py'.format(i)).ensure()
+        timings = list()
+        for _ in range(3):
+            local_path = tmpdir.join('.coverage')
+            local_path.write(contents)
+            start = time.time()
+            mangle_coverage(str(local_path))
+            timings.append(time.time() - start)
+        assert '"C:' not in local_path.read()
+        assert '"{0}":'.format(tmpdir.join('src', 'mod{0}.py'.format(count - 1))) in local_path.read()
+        return min(timings)
+
+    small, large = run(300), run(2400)
+    assert large < small * 24  # Linear is about 8 times slower, quadratic about 64 times.
+
+
+@pytest.mark.parametrize('chunk_size', [1, 7, 64, 1048576])
+def test_chunks(monkeypatch, tmpdir, chunk_size):
+    """Test paths spanning chunk boundaries and contents after them not being truncated.
+
+    :param monkeypatch: pytest fixture.
+    :param tmpdir: pytest fixture.
+    :param int chunk_size: Bytes read at a time.
+    """
+    monkeypatch.chdir(tmpdir)
+    monkeypatch.setattr('appveyor_artifacts.MANGLE_CHUNK', chunk_size)
+    tmpdir.join('a.py').ensure()
+    tmpdir.join('sub', 'b.py').ensure()
+    local_path = tmpdir.join('.coverage')
+    local_path.write(
+        '!coverage.py: This is a private format, don\'t read it directly!{"lines":{"C:\\\\projects\\\\repo\\\\a.py":'
+        '[1,2,3],"C:\\\\projects\\\\repo\\\\sub\\\\b.py":[4,5]}}\n' + ' ' * 100 + 'end'
+    )
+
+    mangle_coverage(str(local_path))
+    expected = (
+        '!coverage.py: This is a private format, don\'t read it directly!{"lines":{"%s":[1,2,3],"%s":[4,5]}}\n'
+        % (tmpdir.join('a.py'), tmpdir.join('sub', 'b.py'))
+    ) + ' ' * 100 + 'end'
+    assert local_path.read() == expected
+    assert sorted(p.basename for p in tmpdir.listdir()) == ['.coverage', 'a.py', 'sub']  # No temp file left behind.
+
+
+def create_database(path, paths):
+    """Create a minimal coverage.py SQLite data file.
+
+    :param path: py.path.local instance.
+    :param iter paths: Source file paths to put in the "file" table.
+    """
+    connection = sqlite3.connect(str(path))
+    with connection:
+        connection.execute('CREATE TABLE coverage_schema (version INTEGER)')
+        connection.execute('CREATE TABLE file (id INTEGER PRIMARY KEY, path TEXT, UNIQUE (path))')
+        connection.executemany('INSERT INTO file (path) VALUES (?)', [(p, ) for p in paths])
+    connection.close()
+
+
+def read_database(path):
+    """Read paths from the "file" table.
+
+    :param path: py.path.local instance.
+
+    :return: Paths ordered by ID.
+    :rtype: list
+    """
+    connection = sqlite3.connect(str(path))
+    paths = [r[0] for r in connection.execute('SELECT path FROM file ORDER BY id')]
+    connection.close()
+    return paths
+
+
+def test_sqlite(monkeypatch, tmpdir):
+    """Test SQLite coverage file.
+
+    :param monkeypatch: pytest fixture.
+    :param tmpdir: pytest fixture.
+    """
+    monkeypatch.chdir(tmpdir)
+    tmpdir.join('a.py').ensure()
+    tmpdir.join('sub', 'b.py').ensure()
+    local_path = tmpdir.join('.coverage')
+    create_database(local_path, ['C:\\projects\\repo\\a.py', 'C:\\projects\\repo\\sub\\b.py', '/home/user/c.py'])
+    linked = tmpdir.join('linked')
+    os.link(str(local_path), str(linked))
+
+    mangle_coverage(str(local_path))
+    assert read_database(local_path) == [str(tmpdir.join('a.py')), str(tmpdir.join('sub', 'b.py')), '/home/user/c.py']
+    assert read_database(linked)[0] == 'C:\\projects\\repo\\a.py'  # Hard link broken first.
+
+
+def test_sqlite_file_not_found(monkeypatch, tmpdir, caplog):
+    """Test SQLite coverage file with a missing source file.
+
+    :param monkeypatch: pytest fixture.
+    :param tmpdir: pytest fixture.
+    :param caplog: pytest extension fixture.
+    """
+    monkeypatch.chdir(tmpdir)
+    tmpdir.join('a.py').ensure()
+    local_path = tmpdir.join('.coverage')
+    create_database(local_path, ['C:\\projects\\repo\\a.py', 'C:\\projects\\repo\\missing.py'])
+    old_hash = local_path.computehash()
+
+    with pytest.raises(HandledError):
+        mangle_coverage(str(local_path))
+    assert [r.message for r in caplog.records if r.levelname == 'ERROR'][0].startswith('No such file: ')
+    assert local_path.computehash() == old_hash
+
+
+def test_sqlite_not_coverage(tmpdir, caplog):
+    """Test unrelated SQLite database.
+
+    :param tmpdir: pytest fixture.
+    :param caplog: pytest extension fixture.
+    """
+    local_path = tmpdir.join('other.db')
+    connection = sqlite3.connect(str(local_path))
+    with connection:
+        connection.execute('CREATE TABLE file (id INTEGER PRIMARY KEY, path TEXT)')
+    connection.close()
+    old_hash = local_path.computehash()
+
+    mangle_coverage(str(local_path))
+    assert caplog.records[-2].message == 'File {0} not a coverage file.'.format(str(local_path))
+    assert local_path.computehash() == old_hash
+
+
+def test_missing_reported_at_once(monkeypatch, tmpdir, caplog):
+    """Test every missing file being logged before failing.
+
+    :param monkeypatch: pytest fixture.
+    :param tmpdir: pytest fixture.
+    :param caplog: pytest extension fixture.
+    """
+    monkeypatch.chdir(tmpdir)
+    tmpdir.join('a.py').ensure()
+    local_path = tmpdir.join('.coverage')
+    local_path.write(
+        '!coverage.py: This is a private format, don\'t read it directly!{"lines":{"C:\\\\projects\\\\repo\\\\b.py":'
+        '[1],"C:\\\\projects\\\\repo\\\\a.py":[1],"C:\\\\projects\\\\repo\\\\c.py":[1]}}'
+    )
+    old_hash = local_path.computehash()
+
+    with pytest.raises(HandledError):
+        mangle_coverage(str(local_path))
+    errors = [r.message for r in caplog.records if r.levelname == 'ERROR']
+    assert errors == ['No such file: {0}'.format(tmpdir.join(n)) for n in ('b.py', 'c.py')]
+    assert local_path.computehash() == old_hash
+
+
+def test_directory_listed_once(monkeypatch, tmpdir):
+    """Test directories being listed once for all coverage files.
+
+    :param monkeypatch: pytest fixture.
+    :param tmpdir: pytest fixture.
+    """
+    if not hasattr(os, 'scandir'):
+        return pytest.skip('No os.scandir().')
+    monkeypatch.chdir(tmpdir)
+    listed = list()
+    scandir = os.scandir
+    monkeypatch.setattr('os.scandir', lambda d: listed.append(d) or scandir(d))
+    for name in ('a.py', 'b.py', 'c.py'):
+        tmpdir.join('src', name).ensure()
+
+    for i, name in enumerate(('a.py', 'b.py', 'c.py', 'a.py')):
+        local_path = tmpdir.join('.coverage{0}'.format(i))
+        local_path.write('!coverage.py: {"lines":{"C:\\\\projects\\\\repo\\\\src\\\\%s":[1]}}' % name)
+        mangle_coverage(str(local_path))
+        assert local_path.read() == '!coverage.py: {"lines":{"%s":[1]}}' % tmpdir.join('src', name)
+    assert listed == [str(tmpdir.join('src'))]
+
+
+def test_path_map(monkeypatch, tmpdir):
+    """Test --path-map rules in both file formats.
+
+    :param monkeypatch: pytest fixture.
+    :param tmpdir: pytest fixture.
+    """
+    monkeypatch.chdir(tmpdir)
+    tmpdir.join('src', 'a.py').ensure()
+    tmpdir.join('lib', 'b.py').ensure()
+    path_map = 'C:\\build\\*\\src,D:/other/src=src;E:\\=lib'
+
+    local_path = tmpdir.join('.coverage')
+    local_path.write(
+        '!coverage.py: {"lines":{"C:\\\\build\\\\x64\\\\src\\\\a.py":[1],"d:\\\\other\\\\src\\\\a.py":[2],'
+        '"E:\\\\b.py":[3],"F:\\\\c.py":[4]}}'
+    )
+    mangle_coverage(str(local_path), path_map=path_map)
+    contents = local_path.read()
+    assert contents.startswith(HEADER)
+    expected = {str(tmpdir.join('src', 'a.py')): [1, 2], str(tmpdir.join('lib', 'b.py')): [3], 'F:\\c.py': [4]}
+    assert json.loads(contents[len(HEADER):]) == dict(lines=expected)  # Both prefixes merged into one key.
+
+    local_path = tmpdir.join('sqlite.coverage')
+    create_database(local_path, ['C:\\build\\x64\\src\\a.py', 'E:\\b.py', 'C:\\projects\\repo\\c.py'])
+    mangle_coverage(str(local_path), path_map=path_map)
+    assert read_database(local_path) == [str(tmpdir.join('src', 'a.py')), str(tmpdir.join('lib', 'b.py')),
+                                         'C:\\projects\\repo\\c.py']
+
+
+def test_path_map_merge_sqlite(monkeypatch, tmpdir):
+    """Test merging files of a SQLite coverage file whose paths are rewritten to the same local file.
+
+    :param monkeypatch: pytest fixture.
+    :param tmpdir: pytest fixture.
+    """
+    monkeypatch.chdir(tmpdir)
+    tmpdir.join('src', 'a.py').ensure()
+    tmpdir.join('src', 'b.py').ensure()
+    local_path = tmpdir.join('.coverage')
+    connection = sqlite3.connect(str(local_path))
+    with connection:
+        connection.executescript("""
+            CREATE TABLE coverage_schema (version INTEGER);
+            CREATE TABLE file (id INTEGER PRIMARY KEY, path TEXT, UNIQUE (path));
+            CREATE TABLE line_bits (file_id INTEGER, context_id INTEGER, numbits BLOB, UNIQUE (file_id, context_id));
+            CREATE TABLE arc (file_id INTEGER, context_id INTEGER, fromno INTEGER, tono INTEGER,
+                              UNIQUE (file_id, context_id, fromno, tono));
+            CREATE TABLE tracer (file_id INTEGER PRIMARY KEY, tracer TEXT);
+            INSERT INTO file (path) VALUES ('C:\\projects\\repo\\src\\a.py');
+            INSERT INTO file (path) VALUES ('C:\\Python27\\Lib\\site-packages\\src\\a.py');
+            INSERT INTO file (path) VALUES ('C:\\Python27\\Lib\\site-packages\\src\\b.py');
+            INSERT INTO line_bits VALUES (1, 1, x'06'), (2, 1, x'0001'), (2, 2, x'01'), (3, 1, x'02');
+            INSERT INTO arc VALUES (1, 1, -1, 1), (2, 1, -1, 1), (2, 1, 1, 2);
+            INSERT INTO tracer VALUES (2, 'plugin.Tracer');
+        """)
+    connection.close()
+
+    mangle_coverage(str(local_path), path_map='C:\\projects\\*\\src,C:\\Python27\\Lib\\site-packages\\src=src')
+    connection = sqlite3.connect(str(local_path))
+    query = 'SELECT f.path, l.context_id, l.numbits FROM line_bits l JOIN file f ON f.id = l.file_id ORDER BY 1, 2'
+    assert [(p, c, bytes(n)) for p, c, n in connection.execute(query)] == [
+        (str(tmpdir.join('src', 'a.py')), 1, b'\x06\x01'),
+        (str(tmpdir.join('src', 'a.py')), 2, b'\x01'),
+        (str(tmpdir.join('src', 'b.py')), 1, b'\x02'),
+    ]
+    assert connection.execute('SELECT file_id, fromno, tono FROM arc ORDER BY 2').fetchall() == [(1, -1, 1), (1, 1, 2)]
+    assert connection.execute('SELECT file_id, tracer FROM tracer').fetchall() == [(1, 'plugin.Tracer')]
+    assert connection.execute('SELECT COUNT(*) FROM file').fetchone()[0] == 2
+    connection.close()
+
+
+def test_queue_seeded(monkeypatch, tmpdir, caplog):
+    """Test MangleQueue worker processes starting from the path index of the parent.
+
+    The parent resolves src/a.py before it's deleted, so only a worker reusing that resolution finds it. Workers are
+    spawned instead of forked (the default on Windows and macOS) so they don't inherit the index by copy.
+
+    :param monkeypatch: pytest fixture.
+    :param tmpdir: pytest fixture.
+    :param caplog: pytest extension fixture.
+    """
+    monkeypatch.chdir(tmpdir)
+    tmpdir.join('src', 'a.py').ensure()
+    get_path_index().resolve('C:\\projects\\repo\\src\\a.py')
+    tmpdir.join('src', 'a.py').remove()
+    local_path = tmpdir.join('.coverage')
+    local_path.write('!coverage.py: {"lines":{"C:\\\\projects\\\\repo\\\\src\\\\a.py":[1]}}')
+
+    monkeypatch.setattr('multiprocessing.Pool', multiprocessing.get_context('spawn').Pool)
+    mangling = MangleQueue(dict(jobs=1))
+    try:
+        mangling.put(str(local_path))
+        mangling.join()
+    finally:
+        mangling.close()
+    assert local_path.read() == '!coverage.py: {"lines":{"%s":[1]}}' % tmpdir.join('src', 'a.py')
+    assert not [r for r in caplog.records if r.levelname == 'ERROR']
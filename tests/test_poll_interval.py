@@ -0,0 +1,66 @@
+"""Test parse_timestamp(), build_durations(), and poll_interval() functions."""
+
+import time
+
+import pytest
+
+from appveyor_artifacts import build_durations, parse_timestamp, poll_interval
+
+
+@pytest.mark.parametrize('value,expected', [
+    ('2016-05-01T22:01:35.1234567+00:00', 1462140095.1234567),
+    ('2016-05-01T22:01:35Z', 1462140095),
+    ('2016-05-01T15:01:35-07:00', 1462140095),
+    ('2016-05-02T00:31:35.5+02:30', 1462140095.5),
+    ('', None),
+    ('yesterday', None),
+])
+def test_parse_timestamp(value, expected):
+    """Test parsing AppVeyor timestamps.
+
+    :param str value: Timestamp to parse.
+    :param float expected: Expected return value.
+    """
+    assert parse_timestamp(value) == expected
+
+
+def test_build_durations():
+    """Test getting durations of previous builds."""
+    builds = [
+        {'status': 'running', 'started': '2016-05-01T22:20:00Z'},
+        {'status': 'success', 'started': '2016-05-01T22:00:00Z', 'finished': '2016-05-01T22:10:30Z'},
+        {'status': 'failed', 'started': '2016-05-01T21:00:00Z', 'finished': '2016-05-01T21:01:00Z'},
+        {'status': 'success', 'started': '2016-05-01T20:00:00Z', 'finished': '2016-05-01T20:08:00Z'},
+        {'status': 'success'},
+    ]
+    assert build_durations(builds) == [630, 480]
+
+
+@pytest.mark.parametrize('elapsed,expected', [
+    (0, 60),  # ETA is 10 minutes away.
+    (500, 50),
+    (590, 5),
+    (599, 2),  # Almost done.
+    (640, 10),  # Overdue.
+    (604, 2),
+])
+def test_poll_interval(elapsed, expected):
+    """Test adapting poll interval to the estimated end of the build.
+
+    :param int elapsed: Seconds since the build started.
+    :param int expected: Expected interval.
+    """
+    history = dict(durations=[900, 600, 300], started=time.time() - elapsed)
+    assert poll_interval(history) == pytest.approx(expected, abs=0.1)
+
+
+def test_poll_interval_defaults(monkeypatch):
+    """Test without history and with a deadline.
+
+    :param monkeypatch: pytest fixture.
+    """
+    monkeypatch.setattr('appveyor_artifacts.SLEEP_FOR', 7)
+    assert poll_interval(dict()) == 7
+    assert poll_interval(dict(durations=[600], started=None)) == 7
+    assert poll_interval(dict(), deadline=time.time() + 3) == pytest.approx(3, abs=0.1)
+    assert poll_interval(dict(), deadline=time.time() - 3) == 0
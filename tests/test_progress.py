@@ -0,0 +1,176 @@
+"""Test Progress class."""
+
+import collections
+import io
+import threading
+
+import pytest
+
+from appveyor_artifacts import format_size, HandledError, Progress
+
+
+class FakeStream(io.StringIO):
+    """StringIO pretending to be a terminal or not."""
+
+    def __init__(self, tty):
+        """Constructor.
+
+        :param bool tty: Return value of isatty().
+        """
+        super(FakeStream, self).__init__()
+        self.tty = tty
+
+    def isatty(self):
+        """Pretend to be a terminal or not.
+
+        :return: If it's a terminal.
+        :rtype: bool
+        """
+        return self.tty
+
+    def write(self, data):
+        """Accept str on Python 2.
+
+        :param str data: Data to write.
+
+        :return: Number of characters written.
+        :rtype: int
+        """
+        return super(FakeStream, self).write(u'{0}'.format(data))
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Mock time.time() with a list holding the current time.
+
+    :param monkeypatch: pytest fixture.
+
+    :return: Single item list, change it to move the clock.
+    :rtype: list
+    """
+    now = [1000.0]
+    monkeypatch.setattr('time.time', lambda: now[0])
+    return now
+
+
+@pytest.mark.parametrize('size,expected', [
+    (0, '0 B'),
+    (1023, '1023 B'),
+    (1536, '1.5 KiB'),
+    (10485760, '10.0 MiB'),
+    (5 * 1024 ** 4, '5120.0 GiB'),
+])
+def test_format_size(size, expected):
+    """Test format_size().
+
+    :param int size: Number of bytes.
+    :param str expected: Expected return value.
+    """
+    assert format_size(size) == expected
+
+
+def test_tty(monkeypatch, clock):
+    """Test redrawing the status line at most every PROGRESS_REDRAW seconds on a TTY.
+
+    The line is truncated to the terminal width on Python 3.3+, so mock a wide one.
+
+    :param monkeypatch: pytest fixture.
+    :param list clock: Mocked time.
+    """
+    stream = FakeStream(True)
+    monkeypatch.setattr('sys.stderr', stream)
+    size = collections.namedtuple('Size', 'columns lines')
+    monkeypatch.setattr('shutil.get_terminal_size', lambda *_: size(200, 24), raising=False)
+    progress = Progress(4096, 2)
+    progress.start('one.bin', 1024)
+    progress.start('sub/two.bin', 3072)
+
+    progress.update('one.bin', 512)
+    clock[0] += 0.1
+    progress.update('sub/two.bin', 512)
+    assert stream.getvalue() == ''  # Too soon.
+
+    clock[0] += 0.1
+    progress.update('sub/two.bin', 512)
+    expected = '\r\x1b[K0/2 files, 1.5 KiB of 4.0 KiB (37%), 7.5 KiB/s, ETA 0:00 | one.bin 50% | two.bin 33%'
+    assert stream.getvalue() == expected
+
+    # Finished file is printed above the status line.
+    progress.done('one.bin', 1024)
+    expected += '\r\x1b[K => one.bin 1024 bytes\n'
+    expected += '\r\x1b[K1/2 files, 2.0 KiB of 4.0 KiB (50%), 10.0 KiB/s, ETA 0:00 | two.bin 33%'
+    assert stream.getvalue() == expected
+
+    progress.done('sub/two.bin', 3072, 'cached')
+    expected += '\r\x1b[K => sub/two.bin 3072 bytes (cached)\n'
+    assert stream.getvalue() == expected
+    progress.close()
+    assert stream.getvalue() == expected
+
+
+def test_not_tty(monkeypatch, clock):
+    """Test printing periodic progress lines for CI logs.
+
+    :param monkeypatch: pytest fixture.
+    :param list clock: Mocked time.
+    """
+    stream = FakeStream(False)
+    monkeypatch.setattr('sys.stderr', stream)
+    progress = Progress(1048576, 1)
+    progress.start('big.bin', 1048576)
+    for _ in range(20):
+        clock[0] += 1
+        progress.update('big.bin', 32768)
+    progress.done('big.bin', 1048576)
+    progress.close()
+    expected = (
+        'Progress: 0/1 files, 320.0 KiB of 1.0 MiB (31%), 32.0 KiB/s, ETA 0:22 | big.bin 31%\n'
+        'Progress: 0/1 files, 640.0 KiB of 1.0 MiB (62%), 32.0 KiB/s, ETA 0:12 | big.bin 62%\n'
+        ' => big.bin 1048576 bytes\n'
+    )
+    assert stream.getvalue() == expected
+
+
+def test_concurrent(monkeypatch):
+    """Test many threads updating one Progress instance, and aborting them.
+
+    :param monkeypatch: pytest fixture.
+    """
+    stream = FakeStream(True)
+    monkeypatch.setattr('sys.stderr', stream)
+    monkeypatch.setattr('appveyor_artifacts.PROGRESS_REDRAW', 0)
+    progress = Progress()
+
+    def worker(number):
+        """Download a fake file.
+
+        :param int number: Thread number.
+        """
+        name = 'file{0}.bin'.format(number)
+        progress.expect(1, 1000)
+        progress.start(name, 1000)
+        for _ in range(100):
+            progress.update(name, 10)
+        progress.done(name, 1000)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    progress.close()
+
+    assert progress.counts == dict(files=8, size=8000, finished=8, received=8000)
+    lines = [line.rpartition('\x1b[K')[2] for line in stream.getvalue().splitlines()]
+    expected = [' => file{0}.bin 1000 bytes'.format(i) for i in range(8)]
+    assert sorted(line for line in lines if line.startswith(' => ')) == expected
+    assert stream.getvalue().endswith(' bytes\n')  # No status line left behind.
+
+    # Failed download stops the others.
+    progress.start('file8.bin', 1000)
+    progress.update('file8.bin', 500)
+    progress.abort.set()
+    with pytest.raises(HandledError):
+        progress.update('file8.bin', 500)
+    progress.discard('file8.bin')
+    assert progress.counts['received'] == 8000
@@ -5,7 +5,7 @@ import socket
 import httpretty
 import pytest
 
-from appveyor_artifacts import HandledError, query_api
+from appveyor_artifacts import get_session, HandledError, open_session, query_api, retry_delay
 
 
 @pytest.mark.httpretty
@@ -83,6 +83,8 @@ def test_timeout_and_error(monkeypatch, request, caplog, mode):
     monkeypatch.setattr('appveyor_artifacts.API_PREFIX', 'http://{}/api'.format(host_port))
     if mode == 'Timeout':
         monkeypatch.setattr('appveyor_artifacts.QUERY_ATTEMPTS', 1)
+    else:
+        open_session(dict(backoff='0'))
 
     # Test.
     with pytest.raises(HandledError):
@@ -95,9 +97,79 @@ def test_timeout_and_error(monkeypatch, request, caplog, mode):
     else:
         expected = [
             'Unable to connect to server.',
-            'Network error, retrying in 1 second...',
+            'Network error, retrying in 0.0 seconds...',
             'Unable to connect to server.',
-            'Network error, retrying in 1 second...',
+            'Network error, retrying in 0.0 seconds...',
             'Unable to connect to server.',
         ]
     assert records == expected
+
+
+@pytest.mark.httpretty
+@pytest.mark.parametrize('status', [429, 502, 503, 504])
+def test_retry_status(monkeypatch, caplog, status):
+    """Test retrying throttled and unavailable responses.
+
+    :param monkeypatch: pytest fixture.
+    :param caplog: pytest extension fixture.
+    :param int status: HTTP status code of the first reply.
+    """
+    sleeps = list()
+    monkeypatch.setattr('appveyor_artifacts.time.sleep', sleeps.append)
+    url = 'https://ci.appveyor.com/api/projects/team/app'
+    httpretty.register_uri(httpretty.GET, url, responses=[
+        httpretty.Response(body='<html></html>', status=status, adding_headers={'Retry-After': '7'}),
+        httpretty.Response(body='{"project": "test"}'),
+    ])
+
+    assert query_api(url[27:]) == dict(project='test')
+    assert 7 <= sleeps[0] <= 8
+    assert get_session().retries == 1
+    assert get_session().retry_wait == sleeps[0]
+    records = [r.message for r in caplog.records if r.levelname in ('ERROR', 'WARNING')]
+    assert records == ['HTTP {0}, retrying in {1:.1f} seconds...'.format(status, sleeps[0])]
+
+
+@pytest.mark.httpretty
+@pytest.mark.parametrize('retry_budget', ['0', '1'])
+def test_retry_budget(monkeypatch, caplog, retry_budget):
+    """Test giving up once the retry budget of the whole run is spent.
+
+    :param monkeypatch: pytest fixture.
+    :param caplog: pytest extension fixture.
+    :param str retry_budget: Value of --retry-budget.
+    """
+    monkeypatch.setattr('appveyor_artifacts.time.sleep', lambda _: None)
+    url = 'https://ci.appveyor.com/api/projects/team/app'
+    httpretty.register_uri(httpretty.GET, url, body='{"message": "Slow down."}', status=429)
+    open_session(dict(attempts='5', retry_budget=retry_budget))
+
+    with pytest.raises(HandledError):
+        query_api(url[27:])
+    with pytest.raises(HandledError):
+        query_api(url[27:])
+
+    assert get_session().retries == int(retry_budget)
+    assert len(httpretty.latest_requests()) == 2 + int(retry_budget)
+    records = [r.message for r in caplog.records if r.levelname == 'ERROR']
+    assert records == ['HTTP 429: Slow down.'] * 2
+
+
+@pytest.mark.parametrize('retry_after', ['', '30', '999999999', 'Wed, 21 Oct 2099 07:28:00 GMT', 'garbage'])
+def test_retry_delay(monkeypatch, retry_after):
+    """Test exponential backoff with full jitter and Retry-After, which is clamped to RETRY_BACKOFF_MAX.
+
+    :param monkeypatch: pytest fixture.
+    :param str retry_after: Retry-After header value.
+    """
+    monkeypatch.setattr('appveyor_artifacts.random.uniform', lambda low, high: high)
+    response = type('Response', (), dict(headers={'Retry-After': retry_after}))()
+    delays = [retry_delay(i, response) for i in range(8)]
+
+    if retry_after == '30':
+        assert delays == [31] * 8
+    elif retry_after.endswith('GMT') or retry_after.isdigit():
+        assert delays == [60] * 8  # Clamped to RETRY_BACKOFF_MAX.
+    else:
+        assert delays == [1, 2, 4, 8, 16, 32, 60, 60]
+    assert retry_delay(3) == 8
@@ -1,7 +1,10 @@
 """Test query_artifacts() function."""
 
+import time
 from functools import partial
 
+import pytest
+
 from appveyor_artifacts import query_artifacts
 
 
@@ -14,10 +17,12 @@ def mock_query_api(url, replies):
     return replies[url]
 
 
-def test(monkeypatch):
+@pytest.mark.parametrize('api_jobs', [1, 4])
+def test(monkeypatch, api_jobs):
     """Test everything.
 
     :param monkeypatch: pytest fixture.
+    :param int api_jobs: Number of concurrent queries.
     """
     # Test empty.
     monkeypatch.setattr('appveyor_artifacts.query_api', lambda _: list())
@@ -39,7 +44,7 @@ def test(monkeypatch):
         ],
     }
     monkeypatch.setattr('appveyor_artifacts.query_api', partial(mock_query_api, replies=replies))
-    actual = query_artifacts(['v5wnn9k8auqcqovw', 'bpgcbvqmawv1jw06'])
+    actual = query_artifacts(['v5wnn9k8auqcqovw', 'bpgcbvqmawv1jw06'], api_jobs=api_jobs)
 
     expected = [
         ('v5wnn9k8auqcqovw', 'luajit.exe', 675840),
@@ -52,3 +57,24 @@ def test(monkeypatch):
         ('bpgcbvqmawv1jw06', 'no_ext', 101),
     ]
     assert actual == expected
+
+
+def test_order(monkeypatch):
+    """Test that concurrent queries finishing out of order still return results in job order.
+
+    :param monkeypatch: pytest fixture.
+    """
+    job_ids = ['job{0:02d}'.format(i) for i in range(12)]
+
+    def slow_query_api(url):
+        """Reply slower for earlier jobs.
+
+        :param str url: Url of the job artifacts.
+        """
+        job = url.split('/')[2]
+        time.sleep((len(job_ids) - job_ids.index(job)) * 0.005)
+        return [{'fileName': 'file.txt', 'size': job_ids.index(job)}]
+
+    monkeypatch.setattr('appveyor_artifacts.query_api', slow_query_api)
+    actual = query_artifacts(job_ids, api_jobs=5)
+    assert actual == [(j, 'file.txt', i) for i, j in enumerate(job_ids)]
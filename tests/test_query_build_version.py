@@ -45,7 +45,10 @@ def test_success(monkeypatch, caplog, kind):
         tag='v2.0.0' if kind == 'tag' else '',
     )
 
-    actual = query_build_version(config)
+    history = dict()
+    actual = query_build_version(config, history=history)
+    assert history['durations'] == []
+    assert history['started'] is None
     if kind == 'tag':
         expected = '1.0.235'
     elif kind == 'pull request':
@@ -58,6 +61,70 @@ def test_success(monkeypatch, caplog, kind):
     assert messages == ['This is a {0} build.'.format(kind)]
 
 
+def test_paging(monkeypatch):
+    """Test paging through older builds and not querying indexed builds again.
+
+    :param monkeypatch: pytest fixture.
+    """
+    def build(build_id):
+        """Mock build JSON dict."""
+        return dict(buildId=build_id, commitId='{0:040x}'.format(build_id), version='1.0.{0}'.format(build_id))
+    url = '/projects/user/repo/history?'
+    replies = {
+        url + 'recordsNumber=10': dict(builds=[build(i) for i in range(100, 90, -1)]),
+        url + 'recordsNumber=20&startBuildId=91': dict(builds=[build(i) for i in range(90, 70, -1)]),
+        url + 'recordsNumber=40&startBuildId=71': dict(builds=[build(i) for i in range(70, 50, -1)]),
+    }
+    queried = list()
+    monkeypatch.setattr('appveyor_artifacts.query_api', lambda url: queried.append(url) or replies[url])
+
+    config = dict(commit='{0:040x}'.format(60), job_name='', owner='user', pull_request='', repo='repo', tag='')
+    history = dict()
+    assert query_build_version(config, history=history) == '1.0.60'
+    assert [u.split('?')[1] for u in queried] == [
+        'recordsNumber=10', 'recordsNumber=20&startBuildId=91', 'recordsNumber=40&startBuildId=71'
+    ]
+    assert history['exhausted'] is True
+
+    # Poll again with two new builds, only the first page is queried.
+    replies[url + 'recordsNumber=10'] = dict(builds=[build(i) for i in range(102, 92, -1)])
+    queried[:] = []
+    assert query_build_version(config, history=history) == '1.0.60'
+    assert queried == [url + 'recordsNumber=10']
+    assert history['newest'] == 102
+
+    # Unknown commit isn't searched for in exhausted history.
+    config['commit'] = '{0:040x}'.format(1)
+    queried[:] = []
+    assert query_build_version(config, history=history) is None
+    assert queried == [url + 'recordsNumber=10']
+
+
+def test_paging_ignored(monkeypatch):
+    """Test that paging through newer builds stops if the API ignores startBuildId.
+
+    :param monkeypatch: pytest fixture.
+    """
+    def build(build_id):
+        """Mock build JSON dict."""
+        return dict(buildId=build_id, commitId='{0:040x}'.format(build_id), version='1.0.{0}'.format(build_id))
+    replies = dict(builds=[build(i) for i in range(100, 90, -1)])
+    queried = list()
+    monkeypatch.setattr('appveyor_artifacts.query_api', lambda url: queried.append(url) or replies)
+
+    config = dict(commit='{0:040x}'.format(95), job_name='', owner='user', pull_request='', repo='repo', tag='')
+    history = dict()
+    assert query_build_version(config, history=history) == '1.0.95'
+
+    # More than a page of new builds, every page is the same.
+    replies = dict(builds=[build(i) for i in range(120, 110, -1)])
+    config['commit'] = '{0:040x}'.format(115)
+    queried[:] = []
+    assert query_build_version(config, history=history) == '1.0.115'
+    assert [u.split('?')[1] for u in queried] == ['recordsNumber=10', 'recordsNumber=10&startBuildId=111']
+    assert history['newest'] == 120
+
+
 def test_empty(monkeypatch):
     """Test when there are no matching builds.
 
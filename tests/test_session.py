@@ -0,0 +1,68 @@
+"""Test Session class and open_session(), get_session(), close_session() functions."""
+
+import logging
+
+import httpretty
+import pytest
+
+import appveyor_artifacts
+from appveyor_artifacts import close_session, get_session, open_session, query_api, Session
+
+
+@pytest.mark.parametrize('pool_size', ['', '3'])
+def test_pool_size(pool_size):
+    """Test connection pool sizing.
+
+    :param str pool_size: Value of --pool-size.
+    """
+    session = Session(dict(pool_size=pool_size))
+    adapter = session.get_adapter('https://ci.appveyor.com/api')
+    expected = int(pool_size or appveyor_artifacts.POOL_SIZE)
+    assert session.pool_size == expected
+    assert adapter.poolmanager.connection_pool_kw['maxsize'] == expected
+
+
+def test_shared():
+    """Test that one session is reused until closed."""
+    session = get_session()
+    assert get_session() is session
+    close_session()
+    assert appveyor_artifacts.SESSION is None
+
+    configured = open_session(dict(pool_size='2'))
+    assert get_session() is configured
+    assert configured is not session
+    assert configured.pool_size == 2
+
+
+@pytest.mark.httpretty
+@pytest.mark.parametrize('no_keep_alive', [False, True])
+def test_keep_alive(no_keep_alive):
+    """Test that API queries go through the shared session and honor --no-keep-alive.
+
+    :param bool no_keep_alive: Value of --no-keep-alive.
+    """
+    url = 'https://ci.appveyor.com/api/projects/team/app'
+    httpretty.register_uri(httpretty.GET, url, body='{"project": "test"}')
+    open_session(dict(no_keep_alive=no_keep_alive))
+
+    assert query_api(url[27:]) == dict(project='test')
+    assert httpretty.last_request().headers['Connection'] == ('close' if no_keep_alive else 'keep-alive')
+
+
+@pytest.mark.httpretty
+def test_get_with_retries(monkeypatch):
+    """Test that the last response is returned even if it's still one of RETRY_STATUSES.
+
+    :param monkeypatch: pytest fixture.
+    """
+    monkeypatch.setattr('appveyor_artifacts.time.sleep', lambda _: None)
+    url = 'https://ci.appveyor.com/api/projects/team/app'
+    httpretty.register_uri(httpretty.GET, url, body='{"message": "Slow down."}', status=429)
+    session = open_session(dict(attempts='2'))
+
+    response = session.get_with_retries(url, logging.getLogger(__name__), headers=dict(Accept='text/plain'))
+    assert response.status_code == 429
+    assert session.retries == 1
+    assert len(httpretty.latest_requests()) == 2
+    assert httpretty.last_request().headers['Accept'] == 'text/plain'
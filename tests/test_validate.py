@@ -9,28 +9,66 @@ from appveyor_artifacts import HandledError, validate
 
 VALID = dict(
     always_job_dirs=False,
+    api_jobs='2',
+    artifact_cache='',
+    artifact_cache_size='4096',
+    attempts='5',
+    backoff='0',
+    cache_size='1024',
+    checksums='sums.txt',
+    combine='.coverage',
     commit='abc1234',
     dir=os.getcwd(),
+    from_plan=__file__,
     job_name='Environment: Python2.7',
+    jobs='4',
     no_job_dirs='skip',
     owner='me',
+    path_map='C:\\projects\\*\\,D:\\build\\=.;E:\\=lib',
+    plan='',
+    pool_size='4',
     pull_request='4',
     repo='antlers',
+    retry_budget='0',
+    segments='8',
+    split_above='1048576',
+    sync=True,
     tag='v1.2.3',
+    timeout='3600',
     verbose=True,
+    verify=__file__,
 )
 
 VALID_OPPOSITE = dict(
     always_job_dirs=True,
+    api_jobs='',
+    artifact_cache='',
+    artifact_cache_size='',
+    attempts='',
+    backoff='',
+    cache_size='',
+    checksums='',
+    combine='',
     commit='',
     dir='',
+    from_plan='',
     job_name='',
+    jobs='',
     no_job_dirs='',
     owner='me',
+    path_map='',
+    plan='plan.json',
+    pool_size='',
     pull_request='',
     repo='antlers',
+    retry_budget='',
+    segments='',
+    split_above='',
+    sync=False,
     tag='',
+    timeout='',
     verbose=False,
+    verify='',
 )
 
 
@@ -45,7 +83,7 @@ def test_bad_mandatory(caplog):
 
     :param caplog: pytest extension fixture.
     """
-    config = VALID.copy()
+    config = dict(VALID, from_plan='', verify='')
     validate(config)
 
     # owner
@@ -90,11 +128,27 @@ def test_bad_optional(caplog):
     validate(config)
 
     # commit
-    config['commit'] = 'invalid'
+    config.update(commit='invalid', from_plan='', verify='')
     with pytest.raises(HandledError):
         validate(config)
     assert caplog.records[-2].message == 'No or invalid git commit obtained.'
-    config['commit'] = VALID['commit']
+    config.update(commit=VALID['commit'], from_plan=VALID['from_plan'], verify=VALID['verify'])
+    validate(config)
+
+    # checksums
+    config['checksums'] = os.path.join(os.getcwd(), 'dir_not_exist', 'sums.txt')
+    with pytest.raises(HandledError):
+        validate(config)
+    assert caplog.records[-2].message == "--checksums directory doesn't exist: " + config['checksums']
+    config['checksums'] = VALID['checksums']
+    validate(config)
+
+    # combine
+    config['combine'] = os.path.join(os.getcwd(), 'dir_not_exist', '.coverage')
+    with pytest.raises(HandledError):
+        validate(config)
+    assert caplog.records[-2].message == "--combine directory doesn't exist: " + config['combine']
+    config['combine'] = VALID['combine']
     validate(config)
 
     # dir
@@ -105,6 +159,19 @@ def test_bad_optional(caplog):
     config['dir'] = VALID['dir']
     validate(config)
 
+    # from_plan
+    config['plan'] = 'plan.json'
+    with pytest.raises(HandledError):
+        validate(config)
+    assert caplog.records[-2].message == 'Contradiction: --from-plan and --plan used.'
+    config['plan'] = VALID['plan']
+    config['from_plan'] = os.path.join(os.getcwd(), 'file_not_exist.json')
+    with pytest.raises(HandledError):
+        validate(config)
+    assert caplog.records[-2].message == "Plan file doesn't exist: " + config['from_plan']
+    config['from_plan'] = VALID['from_plan']
+    validate(config)
+
     # no_job_dirs
     config['no_job_dirs'] = 'unknown'
     with pytest.raises(HandledError):
@@ -113,6 +180,25 @@ def test_bad_optional(caplog):
     config['no_job_dirs'] = VALID['no_job_dirs']
     validate(config)
 
+    # path_map
+    for value in ('C:\\projects', 'C:\\projects\\=', '=src', 'C:\\,,D:\\=src', 'C:\\=.;;D:\\=src'):
+        config['path_map'] = value
+        with pytest.raises(HandledError):
+            validate(config)
+        assert caplog.records[-2].message.startswith('--path-map has invalid rule: ')
+    config['path_map'] = VALID['path_map']
+    validate(config)
+
+    # plan
+    config['from_plan'] = ''
+    config['plan'] = os.path.join(os.getcwd(), 'dir_not_exist', 'plan.json')
+    with pytest.raises(HandledError):
+        validate(config)
+    assert caplog.records[-2].message == "--plan directory doesn't exist: " + config['plan']
+    config['plan'] = VALID['plan']
+    config['from_plan'] = VALID['from_plan']
+    validate(config)
+
     # pull_request
     config['pull_request'] = 'a'
     with pytest.raises(HandledError):
@@ -128,3 +214,42 @@ def test_bad_optional(caplog):
     assert caplog.records[-2].message == 'Invalid git tag obtained.'
     config['tag'] = VALID['tag']
     validate(config)
+
+    # verify
+    config['verify'] = os.path.join(os.getcwd(), 'file_not_exist.txt')
+    with pytest.raises(HandledError):
+        validate(config)
+    assert caplog.records[-2].message == "Checksums file doesn't exist: " + config['verify']
+    config['verify'] = VALID['verify']
+    validate(config)
+
+    # numeric options
+    for key, values, message in (('api_jobs', ('a', '0'), 'is not a positive integer.'),
+                                 ('artifact_cache_size', ('1G',), 'is not a digit.'),
+                                 ('attempts', ('a', '0'), 'is not a positive integer.'),
+                                 ('backoff', ('a', '-1'), 'is not a digit.'),
+                                 ('cache_size', ('1k',), 'is not a digit.'),
+                                 ('jobs', ('a', '0'), 'is not a positive integer.'),
+                                 ('pool_size', ('a', '0'), 'is not a positive integer.'),
+                                 ('retry_budget', ('a',), 'is not a digit.'),
+                                 ('segments', ('a', '0'), 'is not a positive integer.'),
+                                 ('split_above', ('1M',), 'is not a digit.'),
+                                 ('timeout', ('1h',), 'is not a digit.')):
+        for value in values:
+            config[key] = value
+            with pytest.raises(HandledError):
+                validate(config)
+            assert caplog.records[-2].message == '--{0} {1}'.format(key.replace('_', '-'), message)
+        config[key] = VALID[key]
+        validate(config)
+
+
+@pytest.mark.parametrize('key', ['from_plan', 'verify'])
+def test_no_queries(key):
+    """Test that repo, owner, and commit aren't needed by options making no AppVeyor queries.
+
+    :param str key: Option making no queries.
+    """
+    config = dict(VALID_OPPOSITE, commit='invalid', owner='', plan='', repo='')
+    config[key] = __file__
+    validate(config)